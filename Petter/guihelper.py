@@ -61,6 +61,21 @@ def exception_handler(f):
     return wrapper
 
 
+#
+# Loads UI files with a single, shared loader, since creating a loader
+# looks for widget plugins.
+#
+ui_loader = None
+
+
+def load_ui(ui_full_file_name, parent=None):
+    global ui_loader
+    if ui_loader is None:
+        ui_loader = QtUiTools.QUiLoader()
+    ui_loader.setWorkingDirectory(os.path.dirname(ui_full_file_name))
+    return ui_loader.load(ui_full_file_name, parent)
+
+
 #
 # Main window class which loads UI files, supports settings, etc.
 #
@@ -75,10 +90,8 @@ class PMainWindow(QtGui.QMainWindow):
         QtGui.QMainWindow.__init__(self)
 
         # Set up UI
-        loader = QtUiTools.QUiLoader()
-        loader.setWorkingDirectory(ui_dir)
         ui_full_file_name = os.path.join(ui_dir, ui_file)
-        self.ui = loader.load(ui_full_file_name, None)
+        self.ui = load_ui(ui_full_file_name, None)
         self.setCentralWidget(self.ui)
         QtCore.QMetaObject.connectSlotsByName(self)
 
@@ -0,0 +1,238 @@
+#!/usr/bin/python3
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+#
+# Times reading, painting, searching and cursor navigation without a
+# display and writes the results as JSON, so that they can be compared
+# between commits:
+#
+#   python benchmark.py --output before.json
+#   python benchmark.py --output after.json --sizes 1 100 100000
+
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import timeit
+
+from PySide import QtCore, QtGui
+
+import sexton
+from modules import search
+from modules.data_buffer import FileBuffer, MmapFileBuffer
+
+MB = 1024 * 1024
+
+
+def create_file(directory, size):
+	# Creates a sparse file of the given size with a block of random
+	# data and a search signature every 16 MB.
+	file_name = os.path.join(directory, 'sexton_benchmark_{0}.bin'.format(size))
+	random_generator = random.Random(size)
+	with open(file_name, 'wb') as f:
+		f.truncate(size)
+		for pos in range(0, size, 16 * MB):
+			block = bytearray(random_generator.getrandbits(8)
+			                  for i in range(min(4096, size - pos)))
+			block[100:108] = b'SEXTON!!'[:max(0, len(block) - 100)]
+			f.seek(pos)
+			f.write(block)
+	return file_name
+
+
+def measure(function, min_time=0.5, min_repetitions=3):
+	# Runs function until min_time has passed. Returns the number of
+	# calls and the total time.
+	repetitions = 0
+	start_time = timeit.default_timer()
+	while True:
+		function()
+		repetitions += 1
+		elapsed = timeit.default_timer() - start_time
+		if elapsed >= min_time and repetitions >= min_repetitions:
+			return repetitions, elapsed
+
+
+def result(repetitions, elapsed, bytes_per_repetition=None):
+	values = {'repetitions': repetitions,
+	          'seconds': elapsed,
+	          'seconds_per_repetition': elapsed / repetitions}
+	if bytes_per_repetition is not None:
+		values['bytes_per_second'] = bytes_per_repetition * repetitions / elapsed
+	return values
+
+
+def benchmark_read(data_buffer, min_time):
+	size = data_buffer.length()
+	screen_length = 16 * 150
+	results = {}
+
+	positions = iter(range(0, 2**63, screen_length))
+	def sequential():
+		pos = next(positions) % max(1, size - screen_length)
+		view, length = data_buffer.read(pos, screen_length)
+		view[length - 1]
+	results['sequential'] = result(*measure(sequential, min_time),
+	                               bytes_per_repetition=screen_length)
+
+	random_generator = random.Random(0)
+	def random_access():
+		pos = random_generator.randrange(max(1, size - screen_length))
+		view, length = data_buffer.read(pos, screen_length)
+		view[length - 1]
+	results['random'] = result(*measure(random_access, min_time),
+	                           bytes_per_repetition=screen_length)
+	return results
+
+
+def benchmark_paint(data_buffer, min_time):
+	view = sexton.HexView(None, None, False)
+	view.headless_height = 2160
+	view.open(data_buffer)
+	image = QtGui.QImage(1600, view.headless_height,
+	                     QtGui.QImage.Format_ARGB32_Premultiplied)
+	screen_length = view.line_width * view.number_of_lines_on_screen()
+
+	def paint():
+		# Make sure the data is in memory; we time painting, not I/O.
+		data_buffer.read(view.line_width * view.data_line, screen_length)
+		image.fill(QtCore.Qt.white)
+		painter = QtGui.QPainter(image)
+		view.paint(painter)
+		painter.end()
+
+	results = {}
+	def paint_uncached():
+		view.row_cache.clear()
+		paint()
+	results['full_frame'] = result(*measure(paint_uncached, min_time))
+
+	max_line = max(1, view.number_of_rows() - view.number_of_lines_on_screen())
+	def paint_scroll():
+		view.data_line = (view.data_line + 1) % max_line
+		paint()
+	results['scroll_one_line'] = result(*measure(paint_scroll, min_time))
+	view.prefetcher.stop()
+	return results
+
+
+def benchmark_search(data_buffer, search_length, min_time):
+	search_length = min(search_length, data_buffer.length())
+	patterns = {
+		'string': b'SEXTON!!',
+		'regex': re.compile(b'SEX[A-Z]+!!'),
+		'multiple': search.MultiPattern([b'SEXTON!!', b'\x7fELF',
+		                                 b'MZ\x90\x00', b'PK\x03\x04']),
+	}
+	results = {}
+	for name, pattern in sorted(patterns.items()):
+		def run_search():
+			for match in search.find_all(data_buffer, pattern, 0, search_length):
+				pass
+		results[name] = result(*measure(run_search, min_time, 1),
+		                       bytes_per_repetition=search_length)
+
+	def run_parallel_search():
+		for match in search.parallel_find_all(data_buffer, patterns['string'],
+		                                      0, search_length):
+			pass
+	results['string_parallel'] = result(*measure(run_parallel_search,
+	                                             min_time, 1),
+	                                    bytes_per_repetition=search_length)
+	return results
+
+
+def benchmark_navigation(data_buffer, min_time):
+	view = sexton.HexView(None, None, False)
+	view.open(data_buffer)
+	results = {}
+
+	def page_down():
+		view.move_cursor_page_down()
+		if view.get_cursor_position() + 16 * 100 >= data_buffer.length():
+			view.set_cursor_position(0)
+	results['page_down'] = result(*measure(page_down, min_time))
+
+	random_generator = random.Random(0)
+	def jump():
+		view.set_cursor_position(random_generator.randrange(data_buffer.length()))
+	results['jump'] = result(*measure(jump, min_time))
+	view.prefetcher.stop()
+	return results
+
+
+def git_commit():
+	try:
+		this_dir = os.path.dirname(os.path.abspath(__file__))
+		output = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+		                                 cwd=this_dir, stderr=subprocess.STDOUT)
+		return output.decode('ascii').strip()
+	except Exception:
+		return None
+
+
+def main():
+	parser = argparse.ArgumentParser(description='Sexton benchmarks.')
+	parser.add_argument('--output', type=str, default='benchmark.json',
+	                    help='JSON file to write the results to.')
+	parser.add_argument('--sizes', type=int, nargs='+',
+	                    default=[1, 100, 10000, 100000],
+	                    help='Sizes of the synthetic files in MB.')
+	parser.add_argument('--directory', type=str, default=None,
+	                    help='Where to create the synthetic (sparse) files.')
+	parser.add_argument('--min-time', type=float, default=0.5,
+	                    help='Minimum time for each measurement in seconds.')
+	parser.add_argument('--search-length', type=int, default=256,
+	                    help='Number of MB to search in each file.')
+	args = parser.parse_args()
+
+	# Create an application without GUI support. This allows
+	# benchmarks to be run without an X server.
+	app = QtGui.QApplication(sys.argv, QtGui.QApplication.Tty)
+
+	results = {}
+	directory = tempfile.mkdtemp() if args.directory is None else args.directory
+	for size in args.sizes:
+		file_name = create_file(directory, size * MB)
+		try:
+			print("{0} MB...".format(size))
+			size_results = {}
+			for buffer_class in [FileBuffer, MmapFileBuffer]:
+				data_buffer = buffer_class(file_name)
+				size_results[buffer_class.__name__] = {
+					'read': benchmark_read(data_buffer, args.min_time),
+					'paint': benchmark_paint(data_buffer, args.min_time),
+					'search': benchmark_search(data_buffer,
+					                           args.search_length * MB,
+					                           args.min_time),
+					'navigation': benchmark_navigation(data_buffer,
+					                                   args.min_time),
+				}
+				del data_buffer
+			results['{0}MB'.format(size)] = size_results
+		finally:
+			os.unlink(file_name)
+	if args.directory is None:
+		os.rmdir(directory)
+
+	output = {
+		'version': sexton.__version__,
+		'commit': git_commit(),
+		'python': platform.python_version(),
+		'platform': platform.platform(),
+		'results': results,
+	}
+	with open(args.output, 'w') as f:
+		json.dump(output, f, indent=2, sort_keys=True)
+	print("Results written to", args.output)
+	# The application has to exist until all views are gone.
+	del app
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# An index of hashes of fixed-size blocks of a file. It is built in the
+# background and saved in the cache directory. When the file is opened
+# again and its size and modification time are unchanged, the index is
+# available immediately. When the file has been modified by another
+# program, rebuilding the index tells which blocks changed, so that only
+# those are read again.
+
+import array
+import hashlib
+import os
+import struct
+
+try:
+	import xxhash
+except ImportError:
+	xxhash = None
+
+from modules.data_buffer import read_chunks
+from modules.file_cache import cache_file_name, file_signature
+from modules.worker import BufferThread
+
+DEFAULT_BLOCK_LENGTH = 1024 * 1024
+
+if xxhash is not None:
+	HASH_NAME = b'xxh64'
+else:
+	HASH_NAME = b'sha1-64'
+
+# Magic, hash name, block length, file size and modification time.
+HEADER = struct.Struct('<4s16sQQq')
+MAGIC = b'SXHI'
+
+
+def hash_block(chunks):
+	# A 64-bit hash of the data in chunks. A buffer returns at most one
+	# window per read, so a block is hashed incrementally.
+	if xxhash is not None:
+		hash_object = xxhash.xxh64()
+	else:
+		hash_object = hashlib.sha1()
+	for chunk in chunks:
+		hash_object.update(chunk)
+	if xxhash is not None:
+		return hash_object.intdigest()
+	return int.from_bytes(hash_object.digest()[:8], 'little')
+
+
+class BlockHashIndex:
+	def __init__(self, block_length=DEFAULT_BLOCK_LENGTH):
+		self.block_length = block_length
+		self.hashes = array.array('Q')
+		# (size, modification time) of the file when it was hashed.
+		self.signature = None
+
+	def build(self, data_buffer, progress=None):
+		# Hashes every block of the buffer and returns the numbers of the
+		# blocks that differ from the previous hashes, or None if
+		# progress(position) returned True.
+		old_hashes = self.hashes
+		hashes = array.array('Q')
+		length = data_buffer.length()
+		for pos in range(0, length, self.block_length):
+			if progress is not None and progress(pos):
+				return None
+			end = min(pos + self.block_length, length)
+			hashes.append(hash_block(read_chunks(data_buffer, pos, end)))
+		self.hashes = hashes
+
+		changed = [i for i in range(len(hashes))
+		           if i >= len(old_hashes) or hashes[i] != old_hashes[i]]
+		changed.extend(range(len(hashes), len(old_hashes)))
+		return changed
+
+	def changed_ranges(self, changed_blocks):
+		# Converts block numbers to (pos, length) for DataBuffer.refresh.
+		return [(i * self.block_length, self.block_length)
+		        for i in changed_blocks]
+
+	def save(self, index_file_name):
+		directory = os.path.dirname(index_file_name)
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		# Write to a temporary file first so that a partially written
+		# index is never loaded.
+		temporary_file_name = index_file_name + '.tmp'
+		with open(temporary_file_name, 'wb') as f:
+			size, modification_time = self.signature
+			f.write(HEADER.pack(MAGIC, HASH_NAME, self.block_length, size,
+			                    modification_time))
+			self.hashes.tofile(f)
+		os.replace(temporary_file_name, index_file_name)
+
+
+def load_index(index_file_name):
+	# Returns the saved index, or None if there is no usable index.
+	try:
+		with open(index_file_name, 'rb') as f:
+			header = f.read(HEADER.size)
+			if len(header) != HEADER.size:
+				return None
+			magic, hash_name, block_length, size, modification_time = \
+				HEADER.unpack(header)
+			if magic != MAGIC or hash_name.rstrip(b'\x00') != HASH_NAME:
+				return None
+			index = BlockHashIndex(block_length)
+			index.signature = (size, modification_time)
+			index.hashes.frombytes(f.read())
+	except (OSError, ValueError):
+		return None
+	return index
+
+
+class IndexThread(BufferThread):
+	# Brings the index of a file up to date in the background (see
+	# BufferThread). The result lists the (pos, length) that changed
+	# since the index was last built; it is empty for a file that was not
+	# indexed before. The index is available as thread.index.
+
+	def __init__(self, data_buffer, file_name, index, progress_changed,
+	             finished):
+		BufferThread.__init__(self, data_buffer, data_buffer.length(),
+		                      progress_changed, finished)
+		self.file_name = file_name
+		self.index = index
+
+	def work(self, data_buffer):
+		index_file_name = cache_file_name(self.file_name, 'hashes')
+		if self.index is None:
+			self.index = load_index(index_file_name)
+		signature = file_signature(self.file_name)
+		if self.index is not None and self.index.signature == signature:
+			return []
+		if self.index is None:
+			index = BlockHashIndex()
+		else:
+			index = self.index
+		changed = index.build(data_buffer, self.progress)
+		if changed is None:
+			return None
+		index.signature = signature
+		changed_ranges = []
+		if self.index is not None:
+			changed_ranges = index.changed_ranges(changed)
+		self.index = index
+		self.index.save(index_file_name)
+		return changed_ranges
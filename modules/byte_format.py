@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Formatting of bytes for display. Long data is formatted by C code
+# (translate, hexlify and slice assignments) rather than per byte.
+
+import binascii
+
+def make_glyph_table(encoding='cp1252', fallback_encoding='cp850'):
+	# A string with one display character for each byte value.
+	glyphs = []
+	for byte in range(256):
+		if byte >= 32:
+			# TODO: allow user to change decoder.
+			try:
+				glyphs.append(bytes([byte]).decode(encoding))
+			except UnicodeDecodeError:
+				glyphs.append(bytes([byte]).decode(fallback_encoding))
+		else:
+			glyphs.append('.')
+	return ''.join(glyphs)
+
+GLYPH_TABLE = make_glyph_table()
+HEX_TABLE = ['%02X' % byte for byte in range(256)]
+
+
+def bytes_to_string(byte_data):
+	# Latin-1 maps every byte to the code point with the same value,
+	# which the glyph table then translates.
+	return str(byte_data, 'latin-1').translate(GLYPH_TABLE)
+
+
+def bytes_to_hex(byte_data, separator=' '):
+	if len(byte_data) == 0:
+		return ''
+	# hexlify only takes a separator from Python 3.8 on, so the digits
+	# and the separator are interleaved with slice assignments instead.
+	# Below about 32 bytes (e.g. a row of the view) joining the table
+	# entries is faster.
+	if len(separator) == 0:
+		return binascii.hexlify(byte_data).decode('ascii').upper()
+	if len(byte_data) < 32 or max(separator) > '\x7f':
+		return separator.join([HEX_TABLE[byte] for byte in bytearray(byte_data)])
+	hexed = binascii.hexlify(byte_data).upper()
+	encoded_separator = separator.encode('ascii')
+	length = len(byte_data)
+	step = 2 + len(encoded_separator)
+	result = bytearray(step * length - len(encoded_separator))
+	result[0::step] = hexed[0::2]
+	result[1::step] = hexed[1::2]
+	for i in range(len(encoded_separator)):
+		result[2 + i::step] = encoded_separator[i:i + 1] * (length - 1)
+	return result.decode('ascii')
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Command-line subcommands that run without the GUI. Nothing here may
+# import PySide, so that they work on servers without Qt.
+#
+#   sexton.py find --hex "4D 5A 90 00" --string PK FILES...
+#   sexton.py dump --offset 0x200 --length 256 FILE
+
+import argparse
+import binascii
+import collections
+import concurrent.futures
+import contextlib
+import multiprocessing
+import os
+import re
+import stat
+import sys
+
+from modules import search
+from modules.byte_format import bytes_to_hex, bytes_to_string
+from modules.data_buffer import BlockDeviceBuffer, MmapFileBuffer
+
+COMMANDS = ('find', 'dump')
+
+# Number of bytes read at a time when dumping.
+DUMP_CHUNK_LENGTH = 64 * 1024
+
+
+def open_buffer(file_name):
+	# Block devices report a size of zero and can not be mapped.
+	if stat.S_ISBLK(os.stat(file_name).st_mode):
+		return BlockDeviceBuffer(file_name)
+	return MmapFileBuffer(file_name)
+
+
+def parse_number(string):
+	# Accepts decimal and 0x-prefixed hexadecimal numbers.
+	return int(string, 0)
+
+
+def get_pattern(args):
+	# Returns the pattern to search for and the names of the patterns.
+	if args.regex is not None:
+		if args.hex or args.string:
+			raise ValueError("--regex can not be combined with other patterns.")
+		return re.compile(args.regex.encode('utf-8'), re.DOTALL), [args.regex]
+
+	names = []
+	patterns = []
+	for hex_string in args.hex:
+		names.append(hex_string)
+		patterns.append(binascii.unhexlify(hex_string.replace(" ", "")))
+	for string in args.string:
+		names.append(string)
+		patterns.append(string.encode('utf-8'))
+	if len(patterns) == 0:
+		raise ValueError("No pattern given; use --hex, --string or --regex.")
+	if len(patterns) == 1:
+		return patterns[0], names
+	return search.MultiPattern(patterns), names
+
+
+def format_match(file_name, match, names):
+	line = "{0}:{1}".format(file_name, match[0])
+	if len(match) > 2:
+		line += ":" + names[match[2]]
+	return line
+
+
+def segment_tasks(file_names, max_span, segment_length):
+	# Generates (file number, file name, task) for the segments of the
+	# files in order. A task holds the arguments of search_segment
+	# after the pattern, or the error that prevented opening the file.
+	for number, file_name in enumerate(file_names):
+		try:
+			with contextlib.closing(open_buffer(file_name)) as data_buffer:
+				opener = data_buffer.opener()
+				length = data_buffer.length()
+		except (OSError, ValueError) as error:
+			yield number, file_name, error
+			continue
+		for start in range(0, length, segment_length):
+			end = min(start + segment_length, length)
+			yield number, file_name, (opener, start, end,
+			                          min(end + max_span - 1, length),
+			                          max_span)
+
+
+def find(args):
+	# All files are split into segments, which are searched by one pool
+	# of processes, so that many small files are searched in parallel
+	# as well as one large file. The matches are printed in the order of
+	# the files and offsets; an error only stops the search of the file
+	# it occurred in.
+	pattern, names = get_pattern(args)
+	jobs = args.jobs if args.jobs is not None else multiprocessing.cpu_count()
+	regex, max_span, overlapping = search.compile_pattern(pattern)
+	match_size = 3 if isinstance(pattern, search.MultiPattern) else 2
+	tasks = segment_tasks(args.files, max_span, search.DEFAULT_SEGMENT_LENGTH)
+
+	executor = concurrent.futures.ProcessPoolExecutor(jobs)
+	pending = collections.deque()
+	current_number = None
+	found = False
+	failed = False
+	try:
+		while True:
+			# Keep a bounded number of segments in flight.
+			while len(pending) < 2 * jobs:
+				task = next(tasks, None)
+				if task is None:
+					break
+				number, file_name, arguments = task
+				if not isinstance(arguments, Exception):
+					arguments = executor.submit(search.search_segment,
+					                            arguments[0], pattern,
+					                            *arguments[1:])
+				pending.append((number, file_name, arguments))
+			if len(pending) == 0:
+				break
+
+			number, file_name, future = pending.popleft()
+			if number != current_number:
+				current_number = number
+				skip_file = False
+				printed = 0
+				last_end = 0
+			if skip_file:
+				future.cancel()
+				continue
+			try:
+				if isinstance(future, Exception):
+					raise future
+				matches = future.result()
+			except Exception as error:
+				print("sexton.py: {0}: {1}".format(file_name, error),
+				      file=sys.stderr)
+				failed = True
+				skip_file = True
+				continue
+			for i in range(0, len(matches), match_size):
+				match = tuple(matches[i:i + match_size])
+				# Regex matches may overlap a match that was found in the
+				# previous segment.
+				if not overlapping and match[0] < last_end:
+					continue
+				last_end = match[1]
+				if args.max_matches is not None and \
+				   printed >= args.max_matches:
+					skip_file = True
+					break
+				print(format_match(file_name, match, names), flush=True)
+				printed += 1
+				found = True
+	finally:
+		for number, file_name, future in pending:
+			if not isinstance(future, Exception):
+				future.cancel()
+		executor.shutdown(wait=len(pending) == 0)
+	if failed:
+		return 2
+	return 0 if found else 1
+
+
+def dump(args):
+	data_buffer = open_buffer(args.file)
+	end = data_buffer.length()
+	if args.length is not None:
+		end = min(end, args.offset + args.length)
+
+	pos = args.offset
+	while pos < end:
+		view, length = data_buffer.read(pos, min(DUMP_CHUNK_LENGTH, end - pos))
+		length = min(length, len(view))
+		if length <= 0:
+			break
+		if args.raw:
+			sys.stdout.buffer.write(view[:length])
+		else:
+			lines = []
+			for line_pos in range(0, length, args.width):
+				data = view[line_pos:min(line_pos + args.width, length)]
+				lines.append("{0:08X}  {1:<{2}}  {3}".format(
+					pos + line_pos, bytes_to_hex(data), 3 * args.width - 1,
+					bytes_to_string(data)))
+			print('\n'.join(lines))
+		pos += length
+	sys.stdout.flush()
+	return 0
+
+
+def main(argv):
+	parser = argparse.ArgumentParser(prog='sexton.py')
+	subparsers = parser.add_subparsers(dest='command')
+
+	find_parser = subparsers.add_parser('find',
+		help='Print the offsets where patterns occur in files.')
+	find_parser.add_argument('files', type=str, nargs='+')
+	find_parser.add_argument('--hex', type=str, action='append', default=[],
+		help='Hexadecimal bytes to search for, e.g. "4D 5A".')
+	find_parser.add_argument('--string', type=str, action='append', default=[],
+		help='UTF-8 string to search for.')
+	find_parser.add_argument('--regex', type=str, default=None,
+		help='Regular expression to search for.')
+	find_parser.add_argument('--max-matches', type=int, default=None,
+		help='Maximum number of matches printed per file.')
+	find_parser.add_argument('--jobs', type=int, default=None,
+		help='Number of processes (default: number of cores).')
+
+	dump_parser = subparsers.add_parser('dump',
+		help='Print part of a file as hexadecimal.')
+	dump_parser.add_argument('file', type=str)
+	dump_parser.add_argument('--offset', type=parse_number, default=0)
+	dump_parser.add_argument('--length', type=parse_number, default=None)
+	dump_parser.add_argument('--width', type=int, default=16,
+		help='Number of bytes per line.')
+	dump_parser.add_argument('--raw', action='store_true',
+		help='Write the bytes unformatted.')
+
+	args = parser.parse_args(argv)
+	try:
+		if args.command == 'find':
+			return find(args)
+		else:
+			return dump(args)
+	except (ValueError, OSError, binascii.Error) as error:
+		print("{0}: {1}".format(parser.prog, error), file=sys.stderr)
+		return 2
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Finds the byte ranges where two data buffers differ. The buffers are
+# compared one block at a time; only blocks that differ are refined to
+# exact ranges. Memory use is bounded by the block length and the
+# number of differing ranges, which are kept in compact arrays.
+
+import array
+import bisect
+import re
+
+# Number of bytes compared per read from the data buffers.
+DEFAULT_BLOCK_LENGTH = 1024 * 1024
+# Differing blocks are refined in parts of this length.
+REFINE_LENGTH = 64 * 1024
+# Differences separated by fewer equal bytes than this are reported as
+# one range. This keeps the index small for data that differs almost
+# everywhere, e.g. two encrypted files.
+DEFAULT_MERGE_GAP = 16
+
+
+def read_block(data_buffer, pos, length):
+	view, length = data_buffer.read(pos, length)
+	return view[:min(length, len(view))]
+
+
+def find_differences(buffer_a, buffer_b, start=0,
+                     block_length=DEFAULT_BLOCK_LENGTH,
+                     merge_gap=DEFAULT_MERGE_GAP, progress=None):
+	# Generates (start, end) for every range where the buffers differ, in
+	# increasing order. Bytes past the end of the shorter buffer differ.
+	#
+	# progress(position) is called before each block is read. If it
+	# returns True, the comparison stops.
+	if merge_gap > 1:
+		# Bytes formatting with % needs Python 3.5.
+		gap = str(merge_gap - 1).encode('ascii')
+		difference = re.compile(b'[^\\x00]+(?:\\x00{1,' + gap +
+		                        b'}[^\\x00]+)*')
+	else:
+		difference = re.compile(b'[^\\x00]+')
+	length_a = buffer_a.length()
+	length_b = buffer_b.length()
+	common_length = min(length_a, length_b)
+
+	pending = None
+	pos = start
+	while pos < common_length:
+		if progress is not None and progress(pos):
+			return
+		view_a = read_block(buffer_a, pos, min(block_length,
+		                                       common_length - pos))
+		view_b = read_block(buffer_b, pos, len(view_a))
+		length = min(len(view_a), len(view_b))
+		if length <= 0:
+			raise ValueError("The data buffer returned no data.")
+		view_a = view_a[:length]
+		view_b = view_b[:length]
+
+		# Comparing a bytearray with a memoryview is a memcmp, while
+		# comparing two memoryviews is done element by element.
+		if bytearray(view_a) != view_b:
+			for sub_pos in range(0, length, REFINE_LENGTH):
+				sub_a = view_a[sub_pos:sub_pos + REFINE_LENGTH]
+				sub_b = view_b[sub_pos:sub_pos + REFINE_LENGTH]
+				if bytearray(sub_a) == sub_b:
+					continue
+				# The XOR of the parts is zero where they are equal.
+				xor = int.from_bytes(sub_a, 'little') ^ \
+				      int.from_bytes(sub_b, 'little')
+				xor = xor.to_bytes(len(sub_a), 'little')
+				for match in difference.finditer(xor):
+					range_start = pos + sub_pos + match.start()
+					range_end = pos + sub_pos + match.end()
+					if pending is not None and \
+					   range_start - pending[1] < merge_gap:
+						pending[1] = range_end
+					else:
+						if pending is not None:
+							yield tuple(pending)
+						pending = [range_start, range_end]
+		pos += length
+
+	if length_a != length_b:
+		if pending is not None and common_length - pending[1] < merge_gap:
+			pending[1] = max(length_a, length_b)
+		else:
+			if pending is not None:
+				yield tuple(pending)
+			pending = [common_length, max(length_a, length_b)]
+	if pending is not None:
+		yield tuple(pending)
+
+
+class DiffIndex:
+	# Sorted, non-overlapping differing ranges.
+
+	def __init__(self):
+		self.starts = array.array('Q')
+		self.ends = array.array('Q')
+		self.total_length = 0
+
+	def __len__(self):
+		return len(self.starts)
+
+	def add(self, start, end):
+		# Ranges have to be added in increasing order.
+		if len(self.starts) > 0 and start < self.ends[-1]:
+			raise ValueError("Differences must be added in order.")
+		self.starts.append(start)
+		self.ends.append(end)
+		self.total_length += end - start
+
+	def extend(self, starts, ends):
+		for start, end in zip(starts, ends):
+			self.add(start, end)
+
+	def different_bytes(self):
+		return self.total_length
+
+	def range_at(self, pos):
+		# Returns the range containing pos, or None.
+		i = bisect.bisect_right(self.starts, pos) - 1
+		if i >= 0 and pos < self.ends[i]:
+			return self.starts[i], self.ends[i]
+		return None
+
+	def next_difference(self, pos):
+		# Returns the first range starting after pos, or None.
+		i = bisect.bisect_right(self.starts, pos)
+		if i < len(self.starts):
+			return self.starts[i], self.ends[i]
+		return None
+
+	def previous_difference(self, pos):
+		# Returns the last range starting before pos, or None.
+		i = bisect.bisect_left(self.starts, pos) - 1
+		if i >= 0:
+			return self.starts[i], self.ends[i]
+		return None
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+import array
+import os
+
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+from Petter.guihelper import exception_handler, invoke_in_main_thread
+
+from modules import compare
+from modules.data_buffer import MmapFileBuffer, open_copy
+from modules.scroll_model import ScrollModel
+from modules.worker import BufferThread
+
+
+class CompareThread(BufferThread):
+	# Compares two data buffers on a background thread (see
+	# BufferThread). The differing ranges are handed over in batches with
+	# differences_found(thread, starts, ends). The result is True if the
+	# comparison completed.
+
+	def __init__(self, buffer_a, buffer_b, differences_found,
+	             progress_changed, finished):
+		BufferThread.__init__(self, buffer_a,
+		                      max(buffer_a.length(), buffer_b.length()),
+		                      progress_changed, finished)
+		self.buffer_b = buffer_b
+		self.differences_found = differences_found
+		self.starts = array.array('Q')
+		self.ends = array.array('Q')
+
+	def work(self, buffer_a):
+		with open_copy(self.buffer_b) as buffer_b:
+			for start, end in compare.find_differences(buffer_a, buffer_b,
+			                                           progress=self.progress):
+				self.starts.append(start)
+				self.ends.append(end)
+		if self.canceled.is_set():
+			return None
+		return True
+
+	def deliver(self):
+		if len(self.starts) > 0:
+			self.differences_found(self, self.starts, self.ends)
+			self.starts = array.array('Q')
+			self.ends = array.array('Q')
+
+
+class CompareWindow(QMainWindow):
+	# Two files side by side, scrolled together, with navigation between
+	# the differing ranges. The views are instances of view_class (the
+	# HexView of the main window).
+
+	def __init__(self, main_window, company_name, software_name, view_class,
+	             file_name_a, file_name_b):
+		QMainWindow.__init__(self)
+		self.setWindowTitle("Compare {0} and {1}".format(
+			os.path.basename(file_name_a), os.path.basename(file_name_b)))
+
+		self.main_window = main_window
+
+		# Set up UI
+		self.previousButton = QPushButton("Previous")
+		self.nextButton = QPushButton("Next")
+		self.resultLabel = QLabel("")
+		self.progressBar = QProgressBar()
+		self.progressBar.setRange(0, 1000)
+		self.progressBar.setTextVisible(False)
+		self.previousButton.clicked.connect(self.on_previousButton_clicked)
+		self.nextButton.clicked.connect(self.on_nextButton_clicked)
+		button_layout = QHBoxLayout()
+		button_layout.addWidget(self.previousButton)
+		button_layout.addWidget(self.nextButton)
+		button_layout.addWidget(self.resultLabel, 1)
+		button_layout.addWidget(self.progressBar)
+
+		self.views = []
+		view_layout = QHBoxLayout()
+		for file_name in [file_name_a, file_name_b]:
+			view = view_class(None, self)
+			view.open(MmapFileBuffer(file_name))
+			view_layout.addWidget(view, 1)
+			self.views.append(view)
+		self.scrollBar = QScrollBar(Qt.Vertical)
+		self.scrollBar.valueChanged.connect(self.on_scrollBar_valueChanged)
+		self.scrollBar.actionTriggered.connect(
+			self.on_scrollBar_actionTriggered)
+		view_layout.addWidget(self.scrollBar)
+
+		layout = QVBoxLayout()
+		layout.addLayout(button_layout)
+		layout.addLayout(view_layout, 1)
+		widget = QWidget()
+		widget.setLayout(layout)
+		self.setCentralWidget(widget)
+		self.resize(1200, 600)
+
+		# Read settings
+		self.settings = QSettings(company_name, software_name)
+		self.restoreGeometry(self.settings.value("Compare/geometry"))
+
+		self.scroll_model = ScrollModel()
+		self.ignore_valueChanged = False
+		self.update_scrollbar_range()
+
+		self.differences = compare.DiffIndex()
+		self.compare_thread = CompareThread(
+			self.views[0].data_buffer, self.views[1].data_buffer,
+			lambda *args: invoke_in_main_thread(self.differences_found, *args),
+			lambda *args: invoke_in_main_thread(self.progress_changed, *args),
+			lambda *args: invoke_in_main_thread(self.compare_finished, *args))
+		self.compare_thread.start()
+		self.resultLabel.setText("Comparing...")
+
+	def closeEvent(self, event):
+		self.settings.setValue("Compare/geometry", self.saveGeometry())
+		self.compare_thread.cancel()
+		# The prefetch threads of the views run until stopped.
+		for view in self.views:
+			if view.prefetcher is not None:
+				view.prefetcher.stop()
+				view.prefetcher = None
+		QMainWindow.closeEvent(self, event)
+
+	@exception_handler
+	def resizeEvent(self, event):
+		QMainWindow.resizeEvent(self, event)
+		self.update_scrollbar_range()
+
+	def longest_view(self):
+		return max(self.views, key=lambda view: view.data_buffer.length())
+
+	def update_scrollbar_range(self):
+		view = self.longest_view()
+		self.scroll_model.set_range(view.number_of_rows() - 10,
+		                            view.number_of_lines_on_screen())
+		self.ignore_valueChanged = True
+		self.scrollBar.setMaximum(self.scroll_model.maximum())
+		self.scrollBar.setPageStep(self.scroll_model.page_step())
+		self.ignore_valueChanged = False
+
+	def open_file(self, file_name, is_drive=False):
+		# Files dropped on the views are opened in the main window.
+		self.main_window.open_file(file_name, is_drive)
+
+	def update_line(self, line):
+		# Called by the views when they scroll.
+		for view in self.views:
+			if view.data_line != line:
+				view.set_line(line)
+		scrollbar_pos = self.scroll_model.set_line(line)
+		if self.scrollBar.value() != scrollbar_pos:
+			self.ignore_valueChanged = True
+			self.scrollBar.setValue(scrollbar_pos)
+			self.ignore_valueChanged = False
+
+	@exception_handler
+	def on_scrollBar_valueChanged(self, value):
+		if self.ignore_valueChanged:
+			return
+		line = self.scroll_model.set_value(value)
+		for view in self.views:
+			view.set_line(line)
+
+	@exception_handler
+	def on_scrollBar_actionTriggered(self, action):
+		view = self.views[0]
+		if action == QAbstractSlider.SliderSingleStepAdd:
+			lines = 1
+		elif action == QAbstractSlider.SliderSingleStepSub:
+			lines = -1
+		elif action == QAbstractSlider.SliderPageStepAdd:
+			lines = view.number_of_lines_on_screen()
+		elif action == QAbstractSlider.SliderPageStepSub:
+			lines = -view.number_of_lines_on_screen()
+		else:
+			return
+		self.scroll_model.set_line(view.data_line)
+		value = self.scroll_model.step(lines)
+		for view in self.views:
+			view.set_line(self.scroll_model.line)
+		self.scrollBar.setSliderPosition(value)
+
+	def show_difference(self, difference):
+		if difference is None:
+			return
+		start, end = difference
+		for view in self.views:
+			last = max(0, view.data_buffer.length() - 1)
+			view.set_cursor_position(min(start, last))
+			view.set_selection(start, end)
+		self.update_line(self.views[0].data_line)
+		self.update_result_label()
+
+	@exception_handler
+	def on_previousButton_clicked(self):
+		pos = self.views[0].get_cursor_position()
+		self.show_difference(self.differences.previous_difference(pos))
+
+	@exception_handler
+	def on_nextButton_clicked(self):
+		pos = self.views[0].get_cursor_position()
+		self.show_difference(self.differences.next_difference(pos))
+
+	def update_result_label(self, text=""):
+		self.resultLabel.setText("{0} differences ({1} bytes). {2}".format(
+			len(self.differences), self.differences.different_bytes(), text))
+
+	def differences_found(self, compare_thread, starts, ends):
+		if compare_thread is not self.compare_thread:
+			return
+		self.differences.extend(starts, ends)
+
+	def progress_changed(self, compare_thread, fraction, bytes_per_second):
+		if compare_thread is not self.compare_thread:
+			return
+		self.progressBar.setValue(int(1000 * min(1.0, fraction)))
+		self.update_result_label("Comparing... ({0:.2f} GB/s)".format(
+			bytes_per_second / 1e9))
+
+	def compare_finished(self, compare_thread, completed, error):
+		if compare_thread is not self.compare_thread:
+			return
+		self.progressBar.hide()
+		if len(self.differences) == 0 and error is None:
+			self.resultLabel.setText("The files are identical.")
+		else:
+			self.update_result_label()
+		if error is not None:
+			QMessageBox.critical(self, "Compare", error)
@@ -2,12 +2,32 @@
 #
 # Petter Strandmark 2013.
 
+import bisect
+import collections
+import contextlib
+import errno
+import mmap
 import os
+import stat
+import struct
+import sys
+import threading
+import timeit
 try:
-	import pywintypes
-	import win32file
-except:
-	win32file = None
+	import fcntl
+except ImportError:
+	fcntl = None
+
+from modules.metrics import metrics
+
+# Linux ioctls for the size of a block device in bytes and its
+# logical sector size.
+BLKGETSIZE64 = 0x80081272
+BLKSSZGET = 0x1268
+
+# Granularity of the pages of a mapped file that are known to be in
+# memory.
+RESIDENT_BLOCK_LENGTH = 64 * 1024
 
 
 class DataBuffer:
@@ -16,16 +36,51 @@ class DataBuffer:
 
 	def __del__(self):
 		self.flush()
+		self.close()
+
+	def close(self):
+		# Releases files and handles. The buffer can not be read after
+		# this.
+		pass
 
 	def read(self, pos, length):
 		return None, 0
 
+	def is_resident(self, pos, length):
+		# Whether read() can return the range without waiting for I/O.
+		return True
+
+	def prefetch(self, pos, length):
+		# Called from a background thread to bring the range into memory.
+		pass
+
+	def opener(self):
+		# Returns (class, arguments) that open the same data again, e.g.
+		# in another process, or None if that is not possible.
+		return None
+
 	def length(self):
 		return 0
 
+	def write(self, pos, data):
+		# Writes data at pos. Data beyond the end is ignored; the
+		# length of a buffer never changes.
+		raise Exception("Trying to write a read-only buffer.")
+
 	def flush(self):
 		pass
 
+	def refresh(self, ranges=None):
+		# Called when the underlying data has changed, e.g. a file that
+		# was modified by another program. ranges is a list of
+		# (pos, length) that changed, or None if anything may have.
+		pass
+
+	def refreshes_ranges(self):
+		# Whether refresh(ranges) only reads the given ranges again.
+		# Finding the changed ranges is not worth it for other buffers.
+		return False
+
 	def is_readonly(self):
 		return True
 
@@ -36,6 +91,299 @@ class DataBuffer:
 		return self.modified
 
 
+def read_chunks(data_buffer, start, end, chunk_length=1024 * 1024,
+                alignment=1):
+	# Yields memoryviews covering [start, end) in order, each at most
+	# chunk_length bytes. Buffers may return less than asked for, so this
+	# is the way to read more than one window. With an alignment, every
+	# chunk but the last is a multiple of it; a trailing part shorter
+	# than the alignment is not returned.
+	pos = start
+	while pos < end:
+		view, length = data_buffer.read(pos, min(chunk_length, end - pos))
+		length = min(length, len(view), end - pos)
+		length -= length % alignment
+		if length <= 0:
+			return
+		yield view[:length]
+		pos += length
+
+
+@contextlib.contextmanager
+def open_copy(data_buffer, writable=False):
+	# Opens a separate instance of the buffer for a background thread,
+	# since the main thread keeps reading from the original one, and
+	# closes it afterwards. Buffers that can not be opened again are
+	# used directly. Copies are read-only unless writable is set, which
+	# only buffers that can be written support.
+	opener = data_buffer.opener()
+	if opener is None:
+		yield data_buffer
+		return
+	buffer_class, arguments = opener
+	if writable:
+		copy = buffer_class(*arguments, readonly=False)
+	else:
+		copy = buffer_class(*arguments)
+	try:
+		yield copy
+	finally:
+		copy.close()
+
+
+class PageCache:
+	# Holds recently used, aligned blocks of a data source in memory.
+	# Blocks are evicted in least-recently-used order once the memory
+	# budget is exhausted. The source is read with read_function(pos, length),
+	# which may return less data than requested at the end of the source.
+	#
+	# The cache may be filled from a background thread (see prefetch.py).
+	# The lock is never held while reading from the source.
+
+	def __init__(self, read_function, block_length=64 * 1024,
+	             max_memory=64 * 1024 * 1024):
+		self.read_function = read_function
+		self.block_length = block_length
+		self.max_blocks = max(1, max_memory // block_length)
+		self.blocks = collections.OrderedDict()
+		self.lock = threading.Lock()
+		self.hits = 0
+		self.misses = 0
+
+	def read_into(self, target, pos, length):
+		# Copies length bytes starting at pos into the writable
+		# buffer target. Returns the number of bytes copied.
+		if length <= 0:
+			return 0
+		first_block = pos // self.block_length
+		last_block = (pos + length - 1) // self.block_length
+		blocks = self.load_blocks(first_block, last_block, True)
+
+		copied = 0
+		for block_number in range(first_block, last_block + 1):
+			block = blocks[block_number]
+			block_start = block_number * self.block_length
+			begin = max(pos, block_start) - block_start
+			end = min(pos + length - block_start, len(block))
+			if end <= begin:
+				break
+			target[copied:copied + end - begin] = block[begin:end]
+			copied += end - begin
+		return copied
+
+	def load(self, pos, length):
+		# Makes the range resident without copying it anywhere. Used
+		# for read-ahead, so the hit and miss counters are not updated.
+		if length <= 0:
+			return
+		self.load_blocks(pos // self.block_length,
+		                 (pos + length - 1) // self.block_length, False)
+
+	def load_blocks(self, first_block, last_block, count):
+		# Returns a dictionary with all requested blocks, reading the
+		# missing ones with one read per run of consecutive blocks.
+		blocks = {}
+		runs = []
+		with self.lock:
+			for block_number in range(first_block, last_block + 1):
+				block = self.blocks.get(block_number)
+				if block is not None:
+					self.blocks.move_to_end(block_number)
+					blocks[block_number] = block
+				elif runs and runs[-1][1] == block_number:
+					runs[-1][1] += 1
+				else:
+					runs.append([block_number, block_number + 1])
+			if count:
+				self.hits += len(blocks)
+				self.misses += last_block - first_block + 1 - len(blocks)
+		if count:
+			metrics.count(cache_hits=len(blocks),
+			              cache_misses=last_block - first_block + 1 - len(blocks))
+
+		for run_start, run_end in runs:
+			start_time = timeit.default_timer()
+			data = self.read_function(run_start * self.block_length,
+			                          (run_end - run_start) * self.block_length)
+			metrics.record('io_read', timeit.default_timer() - start_time)
+			view = memoryview(data)
+			metrics.count(io_reads=1, io_bytes=len(view))
+			with self.lock:
+				for block_number in range(run_start, run_end):
+					begin = (block_number - run_start) * self.block_length
+					block = bytearray(view[begin:begin + self.block_length])
+					self.blocks[block_number] = block
+					blocks[block_number] = block
+				self.evict()
+		return blocks
+
+	def is_resident(self, pos, length):
+		first_block = pos // self.block_length
+		last_block = (pos + max(length, 1) - 1) // self.block_length
+		with self.lock:
+			for block_number in range(first_block, last_block + 1):
+				if block_number not in self.blocks:
+					return False
+		return True
+
+	def write(self, pos, data):
+		# Update resident blocks with data written to the source.
+		view = memoryview(data)
+		with self.lock:
+			for block_number in range(pos // self.block_length,
+			                          (pos + len(view) - 1) // self.block_length + 1):
+				block = self.blocks.get(block_number)
+				if block is None:
+					continue
+				block_start = block_number * self.block_length
+				begin = max(pos, block_start)
+				end = min(pos + len(view), block_start + len(block))
+				if end > begin:
+					block[begin - block_start:end - block_start] = \
+						view[begin - pos:end - pos]
+
+	def clear(self):
+		with self.lock:
+			self.blocks.clear()
+
+	def invalidate(self, pos, length):
+		# Drops the blocks overlapping the range, so that they are read
+		# again from the source.
+		first_block = pos // self.block_length
+		last_block = (pos + max(length, 1) - 1) // self.block_length
+		with self.lock:
+			for block_number in range(first_block, last_block + 1):
+				self.blocks.pop(block_number, None)
+
+	def evict(self):
+		# Must be called with the lock held.
+		while len(self.blocks) > self.max_blocks:
+			self.blocks.popitem(last=False)
+
+	def memory_usage(self):
+		return len(self.blocks) * self.block_length
+
+	def hit_ratio(self):
+		total = self.hits + self.misses
+		if total == 0:
+			return 0.0
+		return self.hits / total
+
+
+class EditBuffer(DataBuffer):
+	# Keeps edits on top of another data buffer, which is not changed
+	# until flush(). The edits are stored as sorted, non-overlapping
+	# pieces of (offset, bytes), so memory use depends on the size of the
+	# edits and not on the size of the file. Reads merge the pieces into
+	# the data on the fly, and flush() writes only the edited ranges, in
+	# place.
+
+	def __init__(self, data_buffer):
+		DataBuffer.__init__(self)
+		self.data_buffer = data_buffer
+		self.piece_starts = []
+		self.pieces = []
+
+	def read(self, pos, length):
+		view, read_length = self.data_buffer.read(pos, length)
+
+		first = max(0, bisect.bisect_right(self.piece_starts, pos) - 1)
+		last = bisect.bisect_left(self.piece_starts, pos + read_length)
+		if first == last or \
+		   (last == first + 1 and
+		    self.piece_starts[first] + len(self.pieces[first]) <= pos):
+			# No edits in this range; return the view unchanged.
+			return view, read_length
+
+		merged = bytearray(view[:read_length])
+		for i in range(first, last):
+			start = self.piece_starts[i]
+			begin = max(pos, start)
+			end = min(pos + read_length, start + len(self.pieces[i]))
+			if end > begin:
+				merged[begin - pos:end - pos] = \
+					self.pieces[i][begin - start:end - start]
+		return memoryview(merged), read_length
+
+	def write(self, pos, data):
+		if self.is_readonly():
+			raise Exception("Trying to write a read-only buffer.")
+		data = bytes(data[:max(0, self.length() - pos)])
+		if len(data) == 0:
+			return
+		end = pos + len(data)
+
+		# The data extends the piece that it overlaps or that ends where
+		# it starts, in place, so that sequential writes do not copy the
+		# piece again. Other pieces that it overlaps are replaced, and
+		# only the part of the last one beyond the data is kept.
+		first = bisect.bisect_left(self.piece_starts, pos)
+		if first > 0 and \
+		   self.piece_starts[first - 1] + len(self.pieces[first - 1]) >= pos:
+			first -= 1
+		last = bisect.bisect_left(self.piece_starts, end)
+
+		if first < last and self.piece_starts[first] <= pos and \
+		   last == first + 1:
+			new_start = self.piece_starts[first]
+			piece = self.pieces[first]
+			piece[pos - new_start:end - new_start] = data
+		else:
+			tail = b''
+			if first < last:
+				tail = self.pieces[last - 1][end - self.piece_starts[last - 1]:]
+			if first < last and self.piece_starts[first] <= pos:
+				new_start = self.piece_starts[first]
+				piece = self.pieces[first]
+				piece[pos - new_start:] = data
+			else:
+				new_start = pos
+				piece = bytearray(data)
+			piece += tail
+
+		self.piece_starts[first:last] = [new_start]
+		self.pieces[first:last] = [piece]
+		self.modified = True
+
+	def edited_bytes(self):
+		return sum(len(piece) for piece in self.pieces)
+
+	def is_resident(self, pos, length):
+		return self.data_buffer.is_resident(pos, length)
+
+	def prefetch(self, pos, length):
+		self.data_buffer.prefetch(pos, length)
+
+	def opener(self):
+		# Note that the edits are not part of the opened data.
+		return self.data_buffer.opener()
+
+	def refresh(self, ranges=None):
+		# Edits are kept on top of the new data.
+		self.data_buffer.refresh(ranges)
+
+	def refreshes_ranges(self):
+		return self.data_buffer.refreshes_ranges()
+
+	def length(self):
+		return self.data_buffer.length()
+
+	def flush(self):
+		# Write the edited ranges to the underlying buffer.
+		for start, piece in zip(self.piece_starts, self.pieces):
+			self.data_buffer.write(start, piece)
+		self.data_buffer.flush()
+		self.piece_starts = []
+		self.pieces = []
+		self.modified = False
+
+	def close(self):
+		self.data_buffer.close()
+
+	def is_readonly(self):
+		return self.data_buffer.is_readonly()
+
+
 class TestBuffer(DataBuffer):
 
 	def __init__(self, length):
@@ -49,6 +397,10 @@ class TestBuffer(DataBuffer):
 		read_length = min(length, self.data_length - pos)
 		return self.view[pos:], read_length
 
+	def write(self, pos, data):
+		data = data[:max(0, self.data_length - pos)]
+		self.buffer[pos:pos + len(data)] = data
+
 	def is_readonly(self):
 		return False
 
@@ -61,38 +413,39 @@ class TestBuffer(DataBuffer):
 
 class FileBuffer(DataBuffer):
 
-	def __init__(self, file_name, readonly=True):
+	def __init__(self, file_name, readonly=True,
+	             cache_max_memory=64 * 1024 * 1024):
 		DataBuffer.__init__(self)
 
 		self.file_name = file_name
+		self.readonly = readonly
+		self.cache = PageCache(self.read_from_file,
+		                       max_memory=cache_max_memory)
 		self.buffer_max_length = 512 * 1024
 		self.buffer = bytearray(self.buffer_max_length)
+		self.view = memoryview(self.buffer)
 		self.read_into_buffer(0)
 
-		self.readonly = readonly
-		self.last_pos = -1
-		self.last_length = -1
+	def read_from_file(self, pos, length):
+		with open(self.file_name, 'rb') as f:
+			f.seek(pos)
+			return f.read(length)
 
 	def read_into_buffer(self, pos):
 		#print "Reading file block: ", pos
 		self.file_size = os.path.getsize(self.file_name)
 
-		# TODO: handle file size changes.
-
-		if self.modified:
-			self.flush()
-
-		with open(self.file_name, 'rb') as f:
-			f.seek(pos)
+		self.buffer_length = self.buffer_max_length
+		if pos + self.buffer_length > self.file_size:
+			self.buffer_length = self.file_size - pos
+		# The buffer is reused; data is copied from the page cache,
+		# which only reads blocks that are not resident.
+		self.cache.read_into(self.view, pos, self.buffer_length)
+		self.buffer_start = pos
 
-			self.buffer_length = self.buffer_max_length
-			if pos + self.buffer_length > self.file_size:
-				self.buffer_length = self.file_size - pos
-			# TODO: Reuse bytearray each time.
-			self.buffer = bytearray(f.read(self.buffer_length))
-			self.view = memoryview(self.buffer)
-			self.buffer_start = pos
-			self.modified = False
+		# Views returned earlier now point to other data.
+		self.last_pos = -1
+		self.last_length = -1
 
 	def read(self, pos, length):
 
@@ -100,47 +453,285 @@ class FileBuffer(DataBuffer):
 		if pos == self.last_pos and length == self.last_length:
 			return self.last_view, self.last_read_length
 
-		self.last_pos = pos
-		self.last_length = length
-
 		# We cannot read past the end of the file.
 		read_length = min(length, self.file_size - pos)
+		metrics.count(reads=1, bytes_read=read_length)
 		# Is the requested interval outside the current buffer?
-		if pos < self.buffer_start or pos + read_length \
-		   > self.buffer_start + self.buffer_length:
+		if not self.in_buffer(pos, read_length):
+			self.read_into_buffer(self.window_start(pos))
 
-			self.read_into_buffer(max(0, pos - self.buffer_max_length // 2))
-			the_view = self.view[pos - self.buffer_start:]
+		# Return a view into the current buffer.
+		the_view = self.view[pos - self.buffer_start:]
 
-			self.last_view = the_view
-			self.last_read_length = read_length
-			return the_view, read_length
+		self.last_pos = pos
+		self.last_length = length
+		self.last_view = the_view
+		self.last_read_length = read_length
+		return the_view, read_length
+
+	def in_buffer(self, pos, length):
+		return self.buffer_start <= pos and \
+		       pos + length <= self.buffer_start + self.buffer_length
+
+	def window_start(self, pos):
+		# Where the buffer starts when it is moved to contain pos.
+		return max(0, pos - self.buffer_max_length // 2)
+
+	def is_resident(self, pos, length):
+		read_length = min(length, self.file_size - pos)
+		if self.in_buffer(pos, read_length):
+			return True
+		start = self.window_start(pos)
+		return self.cache.is_resident(start, min(self.buffer_max_length,
+		                                         self.file_size - start))
+
+	def prefetch(self, pos, length):
+		start = self.window_start(pos)
+		end = max(start + self.buffer_max_length, pos + length)
+		self.cache.load(start, min(end, self.file_size) - start)
+
+	def refresh(self, ranges=None):
+		if ranges is None:
+			self.cache.clear()
 		else:
-			# Return a view into the current buffer.
-			the_view = self.view[pos - self.buffer_start:]
+			for pos, length in ranges:
+				self.cache.invalidate(pos, length)
+		# The file may also have changed size.
+		self.file_size = os.path.getsize(self.file_name)
+		self.read_into_buffer(min(self.buffer_start,
+		                          self.window_start(self.file_size)))
 
-			self.last_view = the_view
-			self.last_read_length = read_length
-			return the_view, read_length
+	def refreshes_ranges(self):
+		return True
+
+	def opener(self):
+		return FileBuffer, (self.file_name,)
 
 	def length(self):
 		return self.file_size
 
-	def flush(self):
-		# Don't write to the file if there are no changes.
-		if not self.modified:
-			return
-		# If there has been changes, the buffer can not be
-		# read-only.
+	def write(self, pos, data):
 		if self.readonly:
 			raise Exception("Trying to write a read-only buffer.")
+		data = data[:max(0, self.file_size - pos)]
 
-		# Open the file for writing.
-		with open(self.file_name, 'wb') as f:
-			f.seek(self.buffer_start)
-			f.write(self.buffer)
+		# Write in place. The file is never truncated.
+		with open(self.file_name, 'r+b') as f:
+			f.seek(pos)
+			f.write(data)
 
-		self.modified = False
+		# Keep the page cache and the current buffer up to date.
+		self.cache.write(pos, data)
+		begin = max(pos, self.buffer_start)
+		end = min(pos + len(data), self.buffer_start + self.buffer_length)
+		if end > begin:
+			self.buffer[begin - self.buffer_start:end - self.buffer_start] = \
+				data[begin - pos:end - pos]
+
+	def is_readonly(self):
+		return self.readonly
+
+
+class MmapFileBuffer(DataBuffer):
+
+	def __init__(self, file_name, readonly=True, window_max_length=None,
+	             cache_max_memory=64 * 1024 * 1024):
+		DataBuffer.__init__(self)
+
+		self.file_name = file_name
+		# Files that can not be written (e.g. on read-only mounts) are
+		# opened read-only.
+		self.readonly = readonly or not os.access(self.file_name, os.W_OK)
+		self.file_size = os.path.getsize(self.file_name)
+
+		# The mapping is always read-only; writes go through a second
+		# file object, which is opened by the first write. The mapping
+		# reflects the writes.
+		self.file = open(self.file_name, 'rb')
+		self.write_file = None
+
+		# The prefetch thread reads the mapping while the main thread may
+		# replace it.
+		self.map_lock = threading.Lock()
+
+		# Whether mapped pages are in memory can not be queried portably,
+		# so the buffer keeps track of the blocks that the prefetch thread
+		# has read, up to the memory budget of a page cache. The oldest
+		# are forgotten first, as the OS evicts them too.
+		self.resident_lock = threading.Lock()
+		self.resident_blocks = collections.OrderedDict()
+		self.max_resident_blocks = max(1, cache_max_memory //
+		                                  RESIDENT_BLOCK_LENGTH)
+
+		# Map the entire file if it fits comfortably in the address space.
+		# On 32-bit systems large files are mapped one window at a time.
+		if window_max_length is None and self.file_size > sys.maxsize // 4:
+			window_max_length = 64 * 1024 * 1024
+		self.window_max_length = window_max_length
+		self.map_file()
+		# The start of the file is shown first.
+		self.prefetch(0, RESIDENT_BLOCK_LENGTH)
+
+	def map_file(self):
+		self.unmap()
+		if self.file_size > 0:
+			if self.window_max_length is None:
+				try:
+					self.map_window(0, self.file_size)
+				except (OverflowError, OSError, ValueError):
+					# Mapping everything failed (e.g. out of address space).
+					self.window_max_length = 64 * 1024 * 1024
+			if self.window_max_length is not None:
+				self.map_window(0, 0)
+
+	def map_window(self, pos, length):
+		if self.window_max_length is None:
+			start = 0
+			map_length = self.file_size
+		else:
+			# Keep some data before the requested position so that
+			# scrolling backwards does not remap immediately. The start
+			# of a mapping has to be a multiple of the allocation
+			# granularity.
+			granularity = mmap.ALLOCATIONGRANULARITY
+			start = max(0, pos - self.window_max_length // 4)
+			start -= start % granularity
+			map_length = max(self.window_max_length, pos + length - start)
+			map_length = min(map_length, self.file_size - start)
+
+		# Views handed out earlier keep the old mapping alive until
+		# they are garbage collected, so it is not closed explicitly.
+		start_time = timeit.default_timer()
+		new_map = mmap.mmap(self.file.fileno(), map_length,
+		                    access=mmap.ACCESS_READ, offset=start)
+		metrics.record('map_window', timeit.default_timer() - start_time)
+		with self.map_lock:
+			self.map = new_map
+			self.view = memoryview(new_map)
+			self.map_start = start
+			self.map_length = map_length
+
+	def unmap(self):
+		with self.map_lock:
+			self.map = None
+			self.view = memoryview(b'')
+			self.map_start = 0
+			self.map_length = 0
+
+	def read(self, pos, length):
+		# We cannot read past the end of the file.
+		read_length = max(0, min(length, self.file_size - pos))
+		metrics.count(reads=1, bytes_read=read_length)
+		# Is the requested interval outside the current mapping?
+		if pos < self.map_start or pos + read_length \
+		   > self.map_start + self.map_length:
+			self.map_window(pos, read_length)
+		# Return a view directly into the mapping.
+		return self.view[pos - self.map_start:], read_length
+
+	def is_resident(self, pos, length):
+		first_block = pos // RESIDENT_BLOCK_LENGTH
+		last_block = (pos + max(length, 1) - 1) // RESIDENT_BLOCK_LENGTH
+		with self.resident_lock:
+			for block_number in range(first_block, last_block + 1):
+				if block_number not in self.resident_blocks:
+					return False
+		return True
+
+	def prefetch(self, pos, length):
+		# Reads whole blocks, touching one byte per page of the mapping.
+		# The mapping is taken under the lock, since the main thread may
+		# remap at any time; the old map stays valid while referenced.
+		# Ranges outside of the mapping are read through the file, which
+		# brings them into the page cache of the OS all the same.
+		first_block = pos // RESIDENT_BLOCK_LENGTH
+		start = first_block * RESIDENT_BLOCK_LENGTH
+		end = min(pos + length, self.file_size)
+		if end <= start:
+			return
+		with self.map_lock:
+			the_map, view, map_start, map_length = \
+				self.map, self.view, self.map_start, self.map_length
+		end = min(end + RESIDENT_BLOCK_LENGTH - 1 - (end - 1) %
+		          RESIDENT_BLOCK_LENGTH, self.file_size)
+		start_time = timeit.default_timer()
+		if the_map is not None and map_start <= start and \
+		   end <= map_start + map_length:
+			if hasattr(mmap, 'MADV_WILLNEED'):
+				# Let the OS read all pages at once.
+				page_offset = (start - map_start) % mmap.PAGESIZE
+				the_map.madvise(mmap.MADV_WILLNEED,
+				                start - map_start - page_offset,
+				                end - start + page_offset)
+			bytes(view[start - map_start:end - map_start:mmap.PAGESIZE])
+		else:
+			self.file.seek(start)
+			self.file.read(end - start)
+		metrics.record('io_read', timeit.default_timer() - start_time)
+		metrics.count(io_reads=1, io_bytes=end - start)
+
+		with self.resident_lock:
+			for block_number in range(first_block,
+			                          (end - 1) // RESIDENT_BLOCK_LENGTH + 1):
+				self.resident_blocks[block_number] = True
+				self.resident_blocks.move_to_end(block_number)
+			while len(self.resident_blocks) > self.max_resident_blocks:
+				self.resident_blocks.popitem(last=False)
+
+	def refresh(self, ranges=None):
+		# The mapping always shows the current contents of the file;
+		# only a change of size requires a new mapping. The size is
+		# checked before the mapping is touched, since reading a mapped
+		# page beyond the end of a truncated file raises SIGBUS.
+		file_size = os.fstat(self.file.fileno()).st_size
+		if file_size != self.file_size:
+			self.unmap()
+			self.file_size = file_size
+			self.map_file()
+		# The pages of the changed ranges have to be read from the file
+		# again, so they are prefetched again.
+		with self.resident_lock:
+			if ranges is None:
+				self.resident_blocks.clear()
+			else:
+				for pos, length in ranges:
+					first_block = pos // RESIDENT_BLOCK_LENGTH
+					last_block = (pos + max(length, 1) - 1) // \
+					             RESIDENT_BLOCK_LENGTH
+					for block_number in range(first_block, last_block + 1):
+						self.resident_blocks.pop(block_number, None)
+
+	def refreshes_ranges(self):
+		return True
+
+	def opener(self):
+		return MmapFileBuffer, (self.file_name,)
+
+	def length(self):
+		return self.file_size
+
+	def write(self, pos, data):
+		if self.readonly:
+			raise Exception("Trying to write a read-only buffer.")
+		data = data[:max(0, self.file_size - pos)]
+
+		# Write in place. The file is never truncated.
+		if self.write_file is None:
+			self.write_file = open(self.file_name, 'r+b')
+		self.write_file.seek(pos)
+		self.write_file.write(data)
+		self.write_file.flush()
+
+	def close(self):
+		# The mapping is not closed, since views handed out earlier may
+		# still use it; it is released with the last of them.
+		if getattr(self, 'map_lock', None) is not None:
+			self.unmap()
+		if getattr(self, 'write_file', None) is not None:
+			self.write_file.close()
+			self.write_file = None
+		if getattr(self, 'file', None) is not None:
+			self.file.close()
 
 	def is_readonly(self):
 		return self.readonly
@@ -148,22 +739,23 @@ class FileBuffer(DataBuffer):
 
 class DriveBuffer(DataBuffer):
 
-	def __init__(self, drive_name):
+	def __init__(self, drive_name, cache_max_memory=64 * 1024 * 1024):
 		DataBuffer.__init__(self)
 
 		self.drive_name = drive_name
+		# The cache block length is a multiple of all common sector sizes.
+		self.cache = PageCache(self.read_from_drive,
+		                       max_memory=cache_max_memory)
 		self.buffer_max_length = 512 * 1024
 		self.buffer = bytearray(self.buffer_max_length)
+		self.view = memoryview(self.buffer)
 		self.read_into_buffer(0)
 
-	def read_into_buffer(self, pos):
-		space = win32file.GetDiskFreeSpace(self.drive_name)
-		self.bytes_per_sector = space[1]
-		self.file_size = space[0] * space[1] * space[3]
-		#print("Reading file block: ", pos)
-		#print("-- {0} bytes per sector".format(self.bytes_per_sector))
-		#print("-- drive size : {0:.2f} GB".format(self.file_size / 1024**3))
-
+	def read_from_drive(self, pos, length):
+		# pywin32 is slow to import, so it is imported on first use.
+		import pywintypes
+		import win32file
+		length = min(length, self.file_size - pos)
 		try:
 			drive_device_name = "\\\\.\\" + self.drive_name.strip("\\")
 			hfile = win32file.CreateFile(drive_device_name,
@@ -178,12 +770,7 @@ class DriveBuffer(DataBuffer):
 			# Set the read position. It is important that
 			# we read a multiple of the sector size.
 			win32file.SetFilePointer(hfile, pos, win32file.FILE_BEGIN)
-
-			self.buffer_length = self.buffer_max_length
-			if pos + self.buffer_length > self.file_size:
-				self.buffer_length = self.file_size - pos
-
-			result = win32file.ReadFile(hfile, self.buffer_length)
+			result = win32file.ReadFile(hfile, length)
 			win32file.CloseHandle(hfile)
 		except pywintypes.error as err:
 			if err.winerror == 5:
@@ -192,22 +779,32 @@ class DriveBuffer(DataBuffer):
 				                "Elevate Process.")
 			else:
 				raise Exception(err.strerror)
+		return result[1]
 
-		self.buffer = result[1]
-		self.view = memoryview(self.buffer)
+	def read_into_buffer(self, pos):
+		import win32file
+		space = win32file.GetDiskFreeSpace(self.drive_name)
+		self.bytes_per_sector = space[1]
+		self.file_size = space[0] * space[1] * space[3]
+		#print("Reading file block: ", pos)
+		#print("-- {0} bytes per sector".format(self.bytes_per_sector))
+		#print("-- drive size : {0:.2f} GB".format(self.file_size / 1024**3))
+
+		self.buffer_length = self.buffer_max_length
+		if pos + self.buffer_length > self.file_size:
+			self.buffer_length = self.file_size - pos
+
+		self.cache.read_into(self.view, pos, self.buffer_length)
 		self.buffer_start = pos
 
 	def read(self, pos, length):
 		# We cannot read past the end of the file.
 		read_length = min(length, self.file_size - pos)
+		metrics.count(reads=1, bytes_read=read_length)
 		# Is the requested interval outside the current buffer?
 		if pos < self.buffer_start or pos + read_length \
 		   > self.buffer_start + self.buffer_length:
-			# We want to read before the actual position to cache data.
-			read_position = pos - self.buffer_max_length // 2
-			# Move back to an even sector size.
-			read_position -= read_position % self.bytes_per_sector
-			self.read_into_buffer(max(0, read_position))
+			self.read_into_buffer(self.window_start(pos))
 			#print "-- Start in view:", pos - self.buffer_start
 			the_view = self.view[pos - self.buffer_start:]
 			return the_view, read_length
@@ -218,8 +815,181 @@ class DriveBuffer(DataBuffer):
 
 		return self.view[pos:], read_length
 
+	def window_start(self, pos):
+		# We want to read before the actual position to cache data.
+		read_position = pos - self.buffer_max_length // 2
+		# Move back to an even sector size.
+		read_position -= read_position % self.bytes_per_sector
+		return max(0, read_position)
+
+	def is_resident(self, pos, length):
+		read_length = min(length, self.file_size - pos)
+		if self.buffer_start <= pos and \
+		   pos + read_length <= self.buffer_start + self.buffer_length:
+			return True
+		start = self.window_start(pos)
+		return self.cache.is_resident(start, min(self.buffer_max_length,
+		                                         self.file_size - start))
+
+	def prefetch(self, pos, length):
+		start = self.window_start(pos)
+		end = max(start + self.buffer_max_length, pos + length)
+		self.cache.load(start, min(end, self.file_size) - start)
+
+	def refresh(self, ranges=None):
+		if ranges is None:
+			self.cache.clear()
+		else:
+			for pos, length in ranges:
+				self.cache.invalidate(pos, length)
+		self.read_into_buffer(self.buffer_start)
+
+	def refreshes_ranges(self):
+		return True
+
+	def opener(self):
+		return DriveBuffer, (self.drive_name,)
+
 	def length(self):
 		return self.file_size
 
 	def flush(self):
 		pass
+
+
+class BlockDeviceBuffer(DriveBuffer):
+	# A disk, partition or loop device (or any image file) on POSIX
+	# systems. By default the device is read with O_DIRECT, bypassing
+	# the page cache of the operating system, if the device supports
+	# it. Reads are always sector aligned.
+
+	def __init__(self, drive_name, cache_max_memory=64 * 1024 * 1024,
+	             direct=True):
+		DataBuffer.__init__(self)
+
+		self.drive_name = drive_name
+		self.cache_max_memory = cache_max_memory
+		self.fd = None
+		self.direct = direct and hasattr(os, 'O_DIRECT')
+		# Direct reads seek and read in two calls, and the cache may be
+		# filled from the prefetch thread at the same time.
+		self.read_lock = threading.Lock()
+		try:
+			self.open_device()
+		except PermissionError:
+			raise PermissionError("Access denied.\n\nRoot privileges or "
+			                      "membership of the disk group are "
+			                      "required to open drives.")
+		self.bytes_per_sector, self.file_size = self.device_geometry()
+
+		self.cache = PageCache(self.read_from_drive,
+		                       max_memory=cache_max_memory)
+		self.buffer_max_length = 512 * 1024
+		self.buffer = bytearray(self.buffer_max_length)
+		self.view = memoryview(self.buffer)
+		self.buffer_start = 0
+		self.buffer_length = 0
+		self.read_into_buffer(0)
+
+	def close(self):
+		if getattr(self, 'fd', None) is not None:
+			os.close(self.fd)
+			self.fd = None
+
+	def open_device(self):
+		if self.fd is not None:
+			os.close(self.fd)
+			self.fd = None
+		flags = os.O_RDONLY
+		if self.direct:
+			try:
+				self.fd = os.open(self.drive_name, flags | os.O_DIRECT)
+				return
+			except OSError as err:
+				# E.g. tmpfs does not support direct I/O.
+				if err.errno != errno.EINVAL:
+					raise
+				self.direct = False
+		self.fd = os.open(self.drive_name, flags)
+
+	def device_geometry(self):
+		# Returns the sector size and the size in bytes.
+		if fcntl is not None and stat.S_ISBLK(os.fstat(self.fd).st_mode):
+			size = fcntl.ioctl(self.fd, BLKGETSIZE64, bytes(8))
+			sector = fcntl.ioctl(self.fd, BLKSSZGET, bytes(4))
+			return struct.unpack('i', sector)[0], struct.unpack('Q', size)[0]
+		return 512, os.lseek(self.fd, 0, os.SEEK_END)
+
+	def read_from_drive(self, pos, length):
+		length = min(length, self.file_size - pos)
+		if not self.direct:
+			return os.pread(self.fd, length, pos)
+
+		# Direct I/O needs a sector-aligned length and memory. The
+		# position is aligned by the cache, and anonymous maps are
+		# page aligned.
+		sector = self.bytes_per_sector
+		data = mmap.mmap(-1, (length + sector - 1) // sector * sector)
+		try:
+			with self.read_lock:
+				os.lseek(self.fd, pos, os.SEEK_SET)
+				read_length = os.readv(self.fd, [data])
+		except OSError as err:
+			if err.errno != errno.EINVAL:
+				raise
+			# Direct I/O is not possible after all; use the page cache.
+			self.direct = False
+			self.open_device()
+			return self.read_from_drive(pos, length)
+		return memoryview(data)[:min(length, read_length)]
+
+	def read_into_buffer(self, pos):
+		self.buffer_length = self.buffer_max_length
+		if pos + self.buffer_length > self.file_size:
+			self.buffer_length = self.file_size - pos
+
+		self.cache.read_into(self.view, pos, self.buffer_length)
+		self.buffer_start = pos
+
+	def refresh(self, ranges=None):
+		# An image file may have changed size.
+		self.bytes_per_sector, self.file_size = self.device_geometry()
+		self.buffer_start = min(self.buffer_start,
+		                        self.window_start(self.file_size))
+		DriveBuffer.refresh(self, ranges)
+
+	def opener(self):
+		return BlockDeviceBuffer, (self.drive_name, self.cache_max_memory,
+		                           self.direct)
+
+
+def list_block_devices(sys_block='/sys/block'):
+	# Returns (device file, size in bytes, description) for the disks
+	# and partitions on Linux, as listed in /sys/block.
+	def read_attribute(*path):
+		try:
+			with open(os.path.join(*path)) as f:
+				return f.read().strip()
+		except OSError:
+			return ''
+
+	devices = []
+	if not os.path.isdir(sys_block):
+		return devices
+	for disk in sorted(os.listdir(sys_block)):
+		disk_dir = os.path.join(sys_block, disk)
+		model = read_attribute(disk_dir, 'device', 'model')
+		if not model and disk.startswith('loop'):
+			model = read_attribute(disk_dir, 'loop', 'backing_file')
+		names = [(disk, disk_dir, model)]
+		for partition in sorted(os.listdir(disk_dir)):
+			partition_dir = os.path.join(disk_dir, partition)
+			if os.path.exists(os.path.join(partition_dir, 'partition')):
+				names.append((partition, partition_dir, "Partition"))
+		for name, device_dir, description in names:
+			# The size is always given in 512-byte units.
+			size = read_attribute(device_dir, 'size')
+			if not size or int(size) == 0:
+				continue
+			devices.append(('/dev/' + name, 512 * int(size), description))
+	return devices
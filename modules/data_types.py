@@ -8,11 +8,56 @@ import os
 import struct
 import time
 
-from PySide import QtUiTools
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from Petter.guihelper import exception_handler
+from Petter.guihelper import exception_handler, load_ui
+
+from modules import typed_array
+
+
+class ArrayModel(QAbstractTableModel):
+	# Offsets and values of the array table. The values are decoded in
+	# one pass and formatted only when the table displays them.
+
+	def __init__(self):
+		QAbstractTableModel.__init__(self)
+		self.start = 0
+		self.values = []
+		self.type_character = 'B'
+
+	def rowCount(self, parent=QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.values)
+
+	def columnCount(self, parent=QModelIndex()):
+		if parent.isValid():
+			return 0
+		return 2
+
+	def data(self, index, role=Qt.DisplayRole):
+		if role != Qt.DisplayRole or not index.isValid():
+			return None
+		row = index.row()
+		if index.column() == 0:
+			return "0x{0:X}".format(self.offset(row))
+		return typed_array.format_value(self.values[row], self.type_character)
+
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if role != Qt.DisplayRole or orientation != Qt.Horizontal:
+			return None
+		return ["Offset", "Value"][section]
+
+	def offset(self, row):
+		return self.start + row * typed_array.ITEM_SIZES[self.type_character]
+
+	def set_values(self, start, values, type_character):
+		self.beginResetModel()
+		self.start = start
+		self.values = values
+		self.type_character = type_character
+		self.endResetModel()
 
 
 class DataTypes(QMainWindow):
@@ -26,9 +71,8 @@ class DataTypes(QMainWindow):
 		self.main_window = main_window
 
 		# Set up UI
-		loader = QtUiTools.QUiLoader()
 		this_dir = os.path.dirname(__file__)
-		self.ui = loader.load(os.path.join(this_dir, 'data_types.ui'), None)
+		self.ui = load_ui(os.path.join(this_dir, 'data_types.ui'), None)
 		self.setCentralWidget(self.ui)
 		QMetaObject.connectSlotsByName(self)
 
@@ -45,6 +89,16 @@ class DataTypes(QMainWindow):
 		self.date_changed_internally = False
 		self.time_changed_internally = False
 
+		# The array table.
+		for name, type_character in typed_array.TYPES:
+			self.ui.typeComboBox.addItem(name, type_character)
+		self.ui.typeComboBox.setCurrentIndex(
+			int(self.settings.value("DataTypes/array_type", 0)))
+		self.array_model = ArrayModel()
+		self.ui.arrayTable.setModel(self.array_model)
+		self.ui.arrayTable.verticalHeader().hide()
+		self.ui.arrayTable.horizontalHeader().setStretchLastSection(True)
+
 	def set_view(self, view):
 		self.view = view
 
@@ -167,11 +221,51 @@ class DataTypes(QMainWindow):
 				self.ui.timeEdit.setTime(qtime)
 				self.set_hexEdit_bytes(bytes_or_view)
 
+	def update_array(self):
+		# Decode the values from the cursor to the end of the screen
+		# and the statistics of the selection.
+		type_character = self.ui.typeComboBox.itemData(
+			self.ui.typeComboBox.currentIndex())
+		little_endian = self.ui.arrayLittleEndianCheckBox.isChecked()
+		view = self.view
+		start = view.get_cursor_position()
+		screen_end = (view.data_line + view.number_of_lines_on_screen()) * \
+		             view.line_width
+		data, length = view.data_buffer.read(start, max(0, screen_end - start))
+		values = typed_array.decode(data[:max(0, length)], type_character,
+		                            little_endian)
+		self.array_model.set_values(start, values, type_character)
+
+		if view.selection_start < 0 or \
+		   view.selection_end <= view.selection_start:
+			self.ui.statisticsLabel.setText("No selection.")
+			return
+		end = min(view.selection_end,
+		          view.selection_start + typed_array.STATISTICS_MAX_LENGTH)
+		result = typed_array.statistics(view.data_buffer, view.selection_start,
+		                                end, type_character, little_endian)
+		if result is None:
+			self.ui.statisticsLabel.setText("No values in the selection.")
+			return
+		count, minimum, maximum, mean = result
+		text = "{0} values. Min {1}, max {2}, mean {3:g}".format(
+			count,
+			typed_array.format_value(minimum, type_character),
+			typed_array.format_value(maximum, type_character),
+			mean)
+		if end < view.selection_end:
+			text += " (first {0} MB)".format(
+				typed_array.STATISTICS_MAX_LENGTH // (1024 * 1024))
+		self.ui.statisticsLabel.setText(text)
+
 	def update(self):
 		if not self.view:
 			return
 		if not self.view.data_buffer:
 			return
+		if self.ui.tabWidget.currentWidget() == self.ui.tab_array:
+			self.update_array()
+			return
 		data_view = self.view.data_at_position(self.view.get_cursor_position())
 		self.set_bytes(data_view)
 
@@ -180,6 +274,8 @@ class DataTypes(QMainWindow):
 
 	def closeEvent(self, event):
 		self.settings.setValue("DataTypes/geometry", self.saveGeometry())
+		self.settings.setValue("DataTypes/array_type",
+		                       self.ui.typeComboBox.currentIndex())
 		QMainWindow.closeEvent(self, event)
 
 	@Slot()
@@ -304,3 +400,18 @@ class DataTypes(QMainWindow):
 	@exception_handler
 	def on_doubleRadioButton_clicked(self):
 		self.update()
+
+	@Slot()
+	@exception_handler
+	def on_typeComboBox_currentIndexChanged(self):
+		self.update()
+
+	@Slot()
+	@exception_handler
+	def on_arrayLittleEndianCheckBox_clicked(self):
+		self.update()
+
+	@Slot(QModelIndex)
+	@exception_handler
+	def on_arrayTable_clicked(self, index):
+		self.view.set_cursor_position(self.array_model.offset(index.row()))
@@ -13,11 +13,14 @@ except:
 	win32file = None
 
 
-from PySide import QtGui, QtUiTools
+from PySide import QtGui
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from Petter.guihelper import exception_handler, invoke_in_main_thread
+from Petter.guihelper import exception_handler, invoke_in_main_thread, \
+                             load_ui
+
+from modules.data_buffer import list_block_devices
 
 
 class DriveDialog(QDialog):
@@ -31,9 +34,8 @@ class DriveDialog(QDialog):
 		self.main_window = main_window
 
 		# Set up UI
-		loader = QtUiTools.QUiLoader()
 		this_dir = os.path.dirname(__file__)
-		self.ui = loader.load(os.path.join(this_dir, 'drives.ui'), self)
+		self.ui = load_ui(os.path.join(this_dir, 'drives.ui'), self)
 		layout = QVBoxLayout()
 		layout.addWidget(self.ui)
 		self.setLayout(layout)
@@ -66,6 +68,16 @@ class DriveDialog(QDialog):
 					newItem = QTreeWidgetItem([drive, err.strerror])
 				newItem.drive = drive
 				self.ui.driveTree.addTopLevelItem(newItem)
+		elif os.name == 'posix':
+			for device, size, description in list_block_devices():
+				if description:
+					description = "{0:.2f} GB ({1})".format(size / 1024**3,
+					                                        description)
+				else:
+					description = "{0:.2f} GB".format(size / 1024**3)
+				newItem = QTreeWidgetItem([device, description])
+				newItem.drive = device
+				self.ui.driveTree.addTopLevelItem(newItem)
 		else:
 			QtGui.QMessageBox.critical(self, "pywin32 not found",
 """Pywin32 is required to be able to use this feature.
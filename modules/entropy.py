@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Shannon entropy and the fraction of zero bytes for blocks of a data
+# buffer, shown as an overview next to the scroll bar. High entropy
+# means compressed or encrypted data; zero-filled gaps stand out as
+# blocks with only zeros.
+#
+# Large buffers are divided into at most MAX_BLOCKS blocks, and every
+# byte of a block is counted, one chunk at a time. The blocks are
+# computed in an order that fills in the whole overview coarsely first,
+# then in more detail.
+#
+# NumPy is required; without it, NUMPY_AVAILABLE is False.
+
+import array
+import os
+import struct
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from modules.data_buffer import read_chunks
+from modules.file_cache import cache_file_name, file_signature
+from modules.worker import BufferThread
+
+NUMPY_AVAILABLE = numpy is not None
+
+MAX_BLOCKS = 4096
+MIN_BLOCK_LENGTH = 64 * 1024
+CHUNK_LENGTH = 1024 * 1024
+# Value of blocks that have not been computed yet.
+UNKNOWN = -1.0
+
+# Magic, block length, file size and modification time. Maps saved
+# with the magic SXEN were computed from samples and are not used.
+HEADER = struct.Struct('<4sQQq')
+MAGIC = b'SXE2'
+
+
+def block_statistics(counts):
+	# Returns the entropy (0 to 8 bits per byte) and the fraction of zero
+	# bytes, given the number of occurrences of each byte value.
+	total = int(counts.sum())
+	if total == 0:
+		return 0.0, 0.0
+	probabilities = counts[counts > 0] / float(total)
+	entropy = -numpy.sum(probabilities * numpy.log2(probabilities))
+	return float(entropy), float(counts[0]) / total
+
+
+def computation_order(number_of_blocks):
+	# Every 2**k:th block for decreasing k, without repetitions.
+	step = 1
+	while step * 2 < number_of_blocks:
+		step *= 2
+	order = list(range(0, number_of_blocks, step))
+	while step > 1:
+		order.extend(range(step // 2, number_of_blocks, step))
+		step //= 2
+	return order
+
+
+class EntropyMap:
+	def __init__(self, length):
+		self.length = length
+		block_length = max(MIN_BLOCK_LENGTH, -(-length // MAX_BLOCKS))
+		# Round up to a multiple of the minimum length.
+		self.block_length = -(-block_length // MIN_BLOCK_LENGTH) * \
+		                    MIN_BLOCK_LENGTH
+		self.number_of_blocks = -(-length // self.block_length)
+		self.entropy = array.array('f', [UNKNOWN]) * self.number_of_blocks
+		self.zeros = array.array('f', [UNKNOWN]) * self.number_of_blocks
+		self.signature = None
+
+	def compute(self, data_buffer, progress=None):
+		# Computes all blocks. progress(bytes_done) is called after each
+		# chunk; if it returns True, the computation stops and the block
+		# being counted is left unknown.
+		bytes_done = 0
+		for block in computation_order(self.number_of_blocks):
+			if self.entropy[block] != UNKNOWN:
+				continue
+			pos = block * self.block_length
+			end = min(pos + self.block_length, self.length)
+			counts = numpy.zeros(256, dtype=numpy.int64)
+			for chunk in read_chunks(data_buffer, pos, end, CHUNK_LENGTH):
+				values = numpy.frombuffer(chunk, dtype=numpy.uint8)
+				counts += numpy.bincount(values, minlength=256)
+				bytes_done += len(chunk)
+				if progress is not None and progress(bytes_done):
+					return False
+			self.entropy[block], self.zeros[block] = block_statistics(counts)
+		return True
+
+	def block_range(self, first_pos, last_pos):
+		# Averages of the computed blocks overlapping the range, or None
+		# if none of them has been computed.
+		first = first_pos // self.block_length
+		last = min(max(first, last_pos // self.block_length),
+		           self.number_of_blocks - 1)
+		entropy = [e for e in self.entropy[first:last + 1] if e != UNKNOWN]
+		if not entropy:
+			return None
+		zeros = [z for z in self.zeros[first:last + 1] if z != UNKNOWN]
+		return sum(entropy) / len(entropy), sum(zeros) / len(zeros)
+
+	def save(self, cache_file):
+		directory = os.path.dirname(cache_file)
+		if not os.path.isdir(directory):
+			os.makedirs(directory)
+		temporary_file_name = cache_file + '.tmp'
+		with open(temporary_file_name, 'wb') as f:
+			size, modification_time = self.signature
+			f.write(HEADER.pack(MAGIC, self.block_length, size,
+			                    modification_time))
+			self.entropy.tofile(f)
+			self.zeros.tofile(f)
+		os.replace(temporary_file_name, cache_file)
+
+
+def load_entropy_map(cache_file, signature):
+	# Returns the saved map if it matches the file, otherwise None.
+	try:
+		with open(cache_file, 'rb') as f:
+			header = f.read(HEADER.size)
+			if len(header) != HEADER.size:
+				return None
+			magic, block_length, size, modification_time = \
+				HEADER.unpack(header)
+			if magic != MAGIC or (size, modification_time) != signature:
+				return None
+			entropy_map = EntropyMap(size)
+			if entropy_map.block_length != block_length:
+				return None
+			entropy_map.signature = signature
+			entropy_map.entropy = array.array('f')
+			entropy_map.entropy.fromfile(f, entropy_map.number_of_blocks)
+			entropy_map.zeros = array.array('f')
+			entropy_map.zeros.fromfile(f, entropy_map.number_of_blocks)
+	except (OSError, EOFError, ValueError):
+		return None
+	return entropy_map
+
+
+class EntropyThread(BufferThread):
+	# Computes the entropy map of a buffer in the background (see
+	# BufferThread). For files, the map is loaded from and saved to the
+	# cache directory. thread.entropy_map is filled in progressively; it
+	# is also the result.
+
+	def __init__(self, data_buffer, file_name, progress_changed, finished):
+		BufferThread.__init__(self, data_buffer, data_buffer.length(),
+		                      progress_changed, finished)
+		self.file_name = file_name
+		self.entropy_map = EntropyMap(data_buffer.length())
+
+	def work(self, data_buffer):
+		cache_file = None
+		if self.file_name is not None:
+			cache_file = cache_file_name(self.file_name, 'entropy')
+			signature = file_signature(self.file_name)
+			entropy_map = load_entropy_map(cache_file, signature)
+			if entropy_map is not None:
+				self.entropy_map = entropy_map
+				return entropy_map
+			self.entropy_map.signature = signature
+
+		if not self.entropy_map.compute(data_buffer, self.progress):
+			return None
+		if cache_file is not None:
+			self.entropy_map.save(cache_file)
+		return self.entropy_map
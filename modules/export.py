@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Copying and exporting ranges of a data buffer. The range is read in
+# chunks, so neither is limited by the window a buffer returns from a
+# single read, and only one chunk at a time is held in memory while
+# exporting.
+
+import os
+
+from modules.byte_format import bytes_to_hex, bytes_to_string
+from modules.data_buffer import read_chunks
+from modules.worker import BufferThread
+
+# The clipboard gets at most this many bytes of a selection.
+COPY_MAX_LENGTH = 4 * 1024 * 1024
+CHUNK_LENGTH = 1024 * 1024
+
+
+def copy_text(data_buffer, start, end, as_text=False,
+              max_length=COPY_MAX_LENGTH):
+	# Returns the range as text or space-separated hex and whether all
+	# of it fit within max_length bytes.
+	copy_end = min(end, start + max_length)
+	pieces = [bytes_to_string(chunk) if as_text else bytes_to_hex(chunk)
+	          for chunk in read_chunks(data_buffer, start, copy_end,
+	                                   CHUNK_LENGTH)]
+	if as_text:
+		return ''.join(pieces), copy_end == end
+	return ' '.join(pieces), copy_end == end
+
+
+def export_range(data_buffer, start, end, output, as_hex=False, progress=None):
+	# Writes the range to the binary file object output, as raw bytes or
+	# as space-separated hex. Returns False if progress(position)
+	# returned True.
+	pos = start
+	for chunk in read_chunks(data_buffer, start, end, CHUNK_LENGTH):
+		if progress is not None and progress(pos):
+			return False
+		if as_hex:
+			if pos > start:
+				output.write(b' ')
+			output.write(bytes_to_hex(chunk).encode('ascii'))
+		else:
+			output.write(chunk)
+		pos += len(chunk)
+	if pos < end:
+		raise ValueError("Could only read {0} of {1} bytes.".format(
+			pos - start, end - start))
+	return True
+
+
+class ExportThread(BufferThread):
+	# Exports [start, end) of a buffer to a file on a background thread.
+	# The result is True if the export completed. A canceled or failed
+	# export is removed.
+
+	def __init__(self, data_buffer, start, end, file_name, as_hex,
+	             progress_changed, finished):
+		BufferThread.__init__(self, data_buffer, end - start,
+		                      progress_changed, finished)
+		self.start_pos = start
+		self.end_pos = end
+		self.file_name = file_name
+		self.as_hex = as_hex
+
+	def work(self, data_buffer):
+		completed = False
+		try:
+			with open(self.file_name, 'wb') as output:
+				completed = export_range(
+					data_buffer, self.start_pos, self.end_pos, output,
+					self.as_hex, lambda pos: self.progress(pos - self.start_pos))
+		finally:
+			if not completed and os.path.exists(self.file_name):
+				os.remove(self.file_name)
+		return True if completed else None
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Data computed from a file (block hashes, entropy) is saved in a
+# per-user cache directory, so that it is available immediately when the
+# file is opened again. Cache files are named after a hash of the
+# absolute path of the file.
+
+import hashlib
+import os
+import stat
+
+
+def cache_directory():
+	if os.name == 'nt':
+		base = os.getenv('LOCALAPPDATA') or os.path.expanduser('~')
+		return os.path.join(base, 'Sexton', 'cache')
+	base = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+	                                                   '.cache')
+	return os.path.join(base, 'sexton')
+
+
+def cache_file_name(file_name, kind):
+	# E.g. cache_file_name('/data/disk.img', 'hashes').
+	path = os.path.abspath(file_name).encode('utf-8', 'surrogateescape')
+	key = hashlib.sha1(path).hexdigest()
+	return os.path.join(cache_directory(), key + '.' + kind)
+
+
+def file_signature(file_name):
+	# Changes when the file is modified (in practice). The status of a
+	# block device has no size, so it is found by seeking to the end.
+	info = os.stat(file_name)
+	size = info.st_size
+	if stat.S_ISBLK(info.st_mode):
+		with open(file_name, 'rb') as f:
+			size = f.seek(0, os.SEEK_END)
+	return size, info.st_mtime_ns
@@ -2,15 +2,136 @@
 #
 # Petter Strandmark 2013.
 
+import array
 import binascii
 import os
 import re
+import timeit
 
-from PySide import QtUiTools
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-from Petter.guihelper import exception_handler
+from Petter.guihelper import exception_handler, invoke_in_main_thread, \
+                             load_ui
+
+from modules import replace, search
+from modules.metrics import metrics
+from modules.worker import BufferThread
+
+
+class SearchThread(BufferThread):
+	# Runs a search over one or more (start, end) ranges on a background
+	# thread (see BufferThread). Matches are handed over in batches with
+	# matches_found(thread, starts, ends, pattern_indices); the indices
+	# are only filled for a MultiPattern. The result is the number of
+	# matches.
+	#
+	# The search stops after max_matches matches, if given.
+
+	def __init__(self, data_buffer, find_all, pattern, ranges, max_matches,
+	             matches_found, progress_changed, finished):
+		BufferThread.__init__(self, data_buffer,
+		                      sum(end - start for start, end in ranges),
+		                      progress_changed, finished)
+		self.find_all = find_all
+		self.pattern = pattern
+		self.ranges = ranges
+		self.max_matches = max_matches
+		self.matches_found = matches_found
+
+		self.bytes_searched = 0
+		self.number_of_matches = 0
+		self.starts = array.array('Q')
+		self.ends = array.array('Q')
+		self.pattern_indices = array.array('L')
+
+	def work(self, data_buffer):
+		try:
+			for start, end in self.ranges:
+				if not self.search_range(data_buffer, start, end):
+					break
+				self.bytes_searched += end - start
+		finally:
+			metrics.record('search', timeit.default_timer() - self.start_time)
+			metrics.count(searches=1, search_bytes=self.bytes_searched)
+		if self.canceled.is_set():
+			return None
+		return self.number_of_matches
+
+	def search_range(self, data_buffer, start, end):
+		# Returns False if the search should stop.
+		def progress(pos):
+			return self.progress(self.bytes_searched + pos - start)
+
+		for match in self.find_all(data_buffer,
+		                           self.pattern,
+		                           start,
+		                           end,
+		                           progress=progress):
+			if self.canceled.is_set():
+				return False
+			self.starts.append(match[0])
+			self.ends.append(match[1])
+			if len(match) > 2:
+				self.pattern_indices.append(match[2])
+			self.number_of_matches += 1
+			if self.number_of_matches == self.max_matches:
+				return False
+			progress(match[0])
+		return not self.canceled.is_set()
+
+	def deliver(self):
+		if len(self.starts) > 0:
+			self.matches_found(self, self.starts, self.ends,
+			                   self.pattern_indices)
+			self.starts = array.array('Q')
+			self.ends = array.array('Q')
+			self.pattern_indices = array.array('L')
+
+
+class MatchListModel(QAbstractListModel):
+	# List of search matches. The offsets are kept in compact arrays and
+	# the rows are formatted only when the list view displays them.
+
+	def __init__(self):
+		QAbstractListModel.__init__(self)
+		self.starts = array.array('Q')
+		self.ends = array.array('Q')
+		self.pattern_indices = array.array('L')
+		self.pattern_names = []
+
+	def rowCount(self, parent=QModelIndex()):
+		if parent.isValid():
+			return 0
+		return len(self.starts)
+
+	def data(self, index, role=Qt.DisplayRole):
+		if role != Qt.DisplayRole or not index.isValid():
+			return None
+		row = index.row()
+		start = self.starts[row]
+		length = self.ends[row] - start
+		text = "0x{0:016X}   {1} bytes".format(start, length)
+		if row < len(self.pattern_indices):
+			text += "   " + self.pattern_names[self.pattern_indices[row]]
+		return text
+
+	def clear(self, pattern_names=None):
+		self.beginResetModel()
+		self.starts = array.array('Q')
+		self.ends = array.array('Q')
+		self.pattern_indices = array.array('L')
+		self.pattern_names = pattern_names if pattern_names is not None else []
+		self.endResetModel()
+
+	def add_matches(self, starts, ends, pattern_indices):
+		first_row = len(self.starts)
+		self.beginInsertRows(QModelIndex(), first_row,
+		                     first_row + len(starts) - 1)
+		self.starts.extend(starts)
+		self.ends.extend(ends)
+		self.pattern_indices.extend(pattern_indices)
+		self.endInsertRows()
 
 
 class FindAndReplace(QMainWindow):
@@ -24,9 +145,8 @@ class FindAndReplace(QMainWindow):
 		self.main_window = main_window
 
 		# Set up UI
-		loader = QtUiTools.QUiLoader()
 		this_dir = os.path.dirname(__file__)
-		self.ui = loader.load(os.path.join(this_dir, 'find_and_replace.ui'), None)
+		self.ui = load_ui(os.path.join(this_dir, 'find_and_replace.ui'), None)
 		self.setCentralWidget(self.ui)
 		QMetaObject.connectSlotsByName(self)
 
@@ -49,6 +169,18 @@ class FindAndReplace(QMainWindow):
 
 		self.view = None
 
+		# The running search, if any, and the results of Find All.
+		self.search_thread = None
+		self.search_is_find_all = False
+		# Replace All writes the replacement in place, or copies the
+		# file, with the replace thread.
+		self.replace_thread = None
+		self.match_list = MatchListModel()
+		self.ui.resultList.setModel(self.match_list)
+		self.ui.progressBar.setRange(0, 1000)
+		self.ui.progressBar.hide()
+		self.ui.cancelButton.setEnabled(False)
+
 	def set_view(self, view):
 		self.view = view
 
@@ -62,11 +194,154 @@ class FindAndReplace(QMainWindow):
 		                       self.ui.encodingEdit.text())
 		self.settings.setValue("FindAndReplace/search",
 		                       self.ui.searchEdit.text())
+		self.cancel_search()
 		QMainWindow.closeEvent(self, event)
 
 	def setEnabled(self, enabled):
 		self.ui.findButton.setEnabled(enabled)
-		self.ui.replaceButton.setEnabled(False)
+		self.ui.findAllButton.setEnabled(enabled)
+		self.ui.replaceButton.setEnabled(enabled)
+
+	def get_pattern_names(self):
+		# The patterns of a multiple pattern search, as entered.
+		names = self.ui.searchEdit.text().split(';')
+		return [name.strip() for name in names if len(name.strip()) > 0]
+
+	def get_pattern(self):
+		encoding = self.ui.encodingEdit.text()
+
+		if self.ui.multiCheckBox.isChecked() and \
+		   not self.ui.regexButton.isChecked():
+			patterns = []
+			for name in self.get_pattern_names():
+				if self.ui.stringButton.isChecked():
+					patterns.append(name.encode(encoding))
+				else:
+					patterns.append(binascii.unhexlify(name.replace(" ", "")))
+			pattern = search.MultiPattern(patterns)
+		elif self.ui.stringButton.isChecked():
+			pattern = self.ui.searchEdit.text().encode(encoding)
+		elif self.ui.hexButton.isChecked():
+			hex_string = self.ui.searchEdit.text()
+			hex_string = hex_string.replace(" ", "")
+			pattern = binascii.unhexlify(hex_string)
+		elif self.ui.regexButton.isChecked():
+			pattern = re.compile(self.ui.searchEdit.text().encode(encoding))
+		return pattern
+
+	def get_replacement(self):
+		# Entered like the search pattern; regular expressions are
+		# replaced with the literal string.
+		if self.ui.hexButton.isChecked():
+			hex_string = self.ui.replaceEdit.text().replace(" ", "")
+			return binascii.unhexlify(hex_string)
+		return self.ui.replaceEdit.text().encode(self.ui.encodingEdit.text())
+
+	def get_find_all(self):
+		# Large files are searched by several processes, which read
+		# the file themselves.
+		file_length = self.view.data_buffer.length()
+		if file_length >= 4 * search.DEFAULT_SEGMENT_LENGTH and \
+		   self.view.data_buffer.opener() is not None:
+			return search.parallel_find_all
+		else:
+			return search.find_all
+
+	def start_search(self, ranges, max_matches, find_all):
+		pattern = self.get_pattern()
+		# Check the pattern before starting the thread.
+		search.compile_pattern(pattern)
+
+		self.cancel_search()
+		self.search_is_find_all = find_all
+		# The search thread may read the data from disk.
+		self.main_window.flush_buffer()
+
+		self.search_thread = SearchThread(
+			self.view.data_buffer, self.get_find_all(), pattern, ranges,
+			max_matches,
+			lambda *args: invoke_in_main_thread(self.matches_found, *args),
+			lambda *args: invoke_in_main_thread(self.progress_changed, *args),
+			lambda *args: invoke_in_main_thread(self.search_finished, *args))
+		self.search_thread.start()
+
+		self.ui.progressBar.setValue(0)
+		self.ui.progressBar.show()
+		self.ui.cancelButton.setEnabled(True)
+		self.ui.resultLabel.setText("Searching...")
+
+	def cancel_search(self):
+		if self.search_thread is not None:
+			self.search_thread.cancel()
+			self.search_thread = None
+		if self.replace_thread is not None:
+			self.replace_thread.cancel()
+			self.replace_thread = None
+		self.ui.progressBar.hide()
+		self.ui.cancelButton.setEnabled(False)
+
+	def matches_found(self, search_thread, starts, ends, pattern_indices):
+		# Results from a canceled search may still arrive.
+		if search_thread is not self.search_thread:
+			return
+		if self.search_is_find_all:
+			self.match_list.add_matches(starts, ends, pattern_indices)
+		else:
+			# Set cursor position and selection to the found string.
+			self.view.set_cursor_position(starts[0])
+			self.view.set_selection(starts[0], ends[0])
+
+	def progress_changed(self, search_thread, fraction, bytes_per_second):
+		if search_thread is not self.search_thread:
+			return
+		self.ui.progressBar.setValue(int(1000 * min(1.0, fraction)))
+		text = "Searching... ({0:.2f} GB/s)".format(bytes_per_second / 1e9)
+		if self.search_is_find_all:
+			text = "{0} matches. ".format(len(self.match_list.starts)) + text
+		self.ui.resultLabel.setText(text)
+
+	def search_finished(self, search_thread, number_of_matches, error):
+		if search_thread is not self.search_thread:
+			return
+		self.cancel_search()
+		if self.search_is_find_all:
+			text = "{0} matches.".format(len(self.match_list.starts))
+		elif number_of_matches == 0:
+			text = "No match found."
+		else:
+			text = ""
+		self.ui.resultLabel.setText(text)
+		if error is not None:
+			QMessageBox.critical(self, "Find and Replace", error)
+
+	def replace_progress_changed(self, replace_thread, fraction,
+	                             bytes_per_second):
+		if replace_thread is not self.replace_thread:
+			return
+		self.ui.progressBar.setValue(int(1000 * min(1.0, fraction)))
+
+	def replace_finished(self, replace_thread, replacements, error):
+		in_place = replace_thread.output_file_name is None
+		if in_place and replace_thread.data_buffer is self.view.data_buffer:
+			# The file has been written as the search went on, also if
+			# the thread was canceled.
+			self.view.data_buffer.refresh()
+			self.main_window.file_written()
+			self.main_window.data_edited()
+			self.view.update()
+		if replace_thread is not self.replace_thread:
+			return
+		self.cancel_search()
+		if error is not None:
+			self.ui.resultLabel.setText("")
+			QMessageBox.critical(self, "Find and Replace", error)
+		elif in_place:
+			self.ui.resultLabel.setText(
+				"{0} replacements.".format(replacements))
+		else:
+			self.ui.resultLabel.setText(
+				"{0} replacements written to {1}.".format(
+					replacements, os.path.basename(replace_thread.output_file_name)))
 
 	@Slot()
 	@exception_handler
@@ -79,22 +354,6 @@ class FindAndReplace(QMainWindow):
 	@Slot()
 	@exception_handler
 	def on_findButton_clicked(self):
-		self.setEnabled(False)
-		self.ui.searchEdit.setEnabled(False)
-
-		progress_ticks = 1000000000
-		progress = QProgressDialog("Searching file...",
-		                           "Cancel",
-		                           0,
-		                           progress_ticks,
-		                           self.main_window)
-		progress.setWindowModality(Qt.WindowModal)
-		progress.setWindowTitle("Find and Replace")
-		progress.setAutoClose(False)
-		progress.setAutoReset(False)
-		progress.setMinimumDuration(400)
-
-		step_length = 100 * 1024
 		file_length = self.view.data_buffer.length()
 
 		current_pos = self.view.get_cursor_position()
@@ -108,62 +367,76 @@ class FindAndReplace(QMainWindow):
 			if current_pos >= file_length:
 				current_pos = 0
 
-		start_pos = current_pos
-		bytes_searched = 0
+		# Search to the end of the file and then wrap around.
+		regex, max_span, overlapping = search.compile_pattern(self.get_pattern())
+		ranges = [(current_pos, file_length)]
+		if current_pos > 0:
+			ranges.append((0, min(file_length, current_pos + max_span - 1)))
+		self.start_search(ranges, 1, False)
 
-		encoding = self.ui.encodingEdit.text()
+	@Slot()
+	@exception_handler
+	def on_findAllButton_clicked(self):
+		if isinstance(self.get_pattern(), search.MultiPattern):
+			self.match_list.clear(self.get_pattern_names())
+		else:
+			self.match_list.clear()
+		self.start_search([(0, self.view.data_buffer.length())], None, True)
 
-		wanted_bytes = None
-		regex_selected = False
-		if self.ui.stringButton.isChecked():
-			wanted_bytes = self.ui.searchEdit.text().encode(encoding)
-		elif self.ui.hexButton.isChecked():
-			hex_string = self.ui.searchEdit.text()
-			hex_string = hex_string.replace(" ", "")
-			wanted_bytes = binascii.unhexlify(hex_string)
-		elif self.ui.regexButton.isChecked():
-			regex_selected = True
-			regex = re.compile(self.ui.searchEdit.text().encode(encoding))
-
-		wrapped_around = False
-		while(bytes_searched < file_length):
-			fraction_complete = min(1.0, float(bytes_searched) / file_length)
-			progress.setValue(int(fraction_complete * progress_ticks))
-			if progress.wasCanceled():
-				break
-
-			view, length = self.view.data_buffer.read(current_pos, step_length)
-			# Convert view to bytes for searching.
-			bytes = view[:length].tobytes()
-			if not regex_selected:
-				# Search in the bytes.
-				found_start = bytes.find(wanted_bytes)
-				found_end   = found_start + len(wanted_bytes)
-			else:
-				# Search in the bytes using regex.
-				match = regex.search(bytes)
-				if match is None:
-					found_start = -1
-				else:
-					found_start = match.start()
-					found_end   = match.end()
-
-			if found_start >= 0:
-				# Set cursor position and selection to the found string.
-				self.view.set_cursor_position(current_pos + found_start)
-				self.view.set_selection(current_pos + found_start,
-				                        current_pos + found_end)
-				break
-			else:
-				bytes_searched += length
-				current_pos += length
+	@Slot()
+	@exception_handler
+	def on_replaceButton_clicked(self):
+		pattern = self.get_pattern()
+		replacement = self.get_replacement()
+		search.compile_pattern(pattern)
+		data_buffer = self.view.data_buffer
 
-			if current_pos >= file_length:
-				current_pos = 0
-				wrapped_around = True
-			if wrapped_around and current_pos >= start_pos + step_length:
-				break
+		if replace.match_length(pattern) == len(replacement) and \
+		   not data_buffer.is_readonly():
+			# Overwrite the matches in place.
+			answer = QMessageBox.question(
+				self, "Find and Replace",
+				"Replace all matches? The file is modified in place.",
+				QMessageBox.Yes | QMessageBox.No)
+			if answer != QMessageBox.Yes:
+				return
+			file_name = None
+		else:
+			# The length changes (or the buffer is read-only), so the
+			# result is written to a new file.
+			file_name, _ = QFileDialog.getSaveFileName(
+				self, "Save the result of Replace All")
+			if not file_name:
+				return
+			open_file_name = self.main_window.file_name
+			if open_file_name is not None and \
+			   os.path.abspath(file_name) == os.path.abspath(open_file_name):
+				raise Exception("Can not write the result to the file "
+				                "being read.")
+		self.cancel_search()
+		self.main_window.flush_buffer()
+		self.replace_thread = replace.ReplaceThread(
+			data_buffer, pattern, replacement, file_name,
+			lambda *args: invoke_in_main_thread(self.replace_progress_changed,
+			                                    *args),
+			lambda *args: invoke_in_main_thread(self.replace_finished, *args))
+		self.replace_thread.start()
+		self.ui.progressBar.setValue(0)
+		self.ui.progressBar.show()
+		self.ui.cancelButton.setEnabled(True)
+		self.ui.resultLabel.setText("Replacing...")
 
-		progress.close()
-		self.setEnabled(True)
-		self.ui.searchEdit.setEnabled(True)
+	@Slot()
+	@exception_handler
+	def on_cancelButton_clicked(self):
+		self.cancel_search()
+		self.ui.resultLabel.setText("Canceled.")
+
+	@Slot(QModelIndex)
+	@exception_handler
+	def on_resultList_clicked(self, index):
+		row = index.row()
+		start = self.match_list.starts[row]
+		end = self.match_list.ends[row]
+		self.view.set_cursor_position(start)
+		self.view.set_selection(start, end)
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+from Petter.guihelper import exception_handler, invoke_in_main_thread
+
+from modules import hashing
+
+
+class HashWindow(QMainWindow):
+	# Computes the hashes of the selection, or of the whole file if
+	# nothing is selected, on a background thread.
+
+	def __init__(self, main_window, company_name, software_name):
+		QMainWindow.__init__(self)
+		self.setWindowTitle("Hash")
+		self.setWindowFlags(Qt.CustomizeWindowHint |
+		                    Qt.WindowTitleHint |
+		                    Qt.WindowCloseButtonHint)
+
+		self.main_window = main_window
+		self.view = None
+		self.hash_thread = None
+
+		# Read settings
+		self.settings = QSettings(company_name, software_name)
+		self.restoreGeometry(self.settings.value("Hash/geometry"))
+		checked = self.settings.value("Hash/algorithms",
+		                              ','.join(hashing.ALGORITHMS)).split(',')
+
+		# Set up UI
+		checkbox_layout = QHBoxLayout()
+		self.checkboxes = []
+		for algorithm in hashing.ALGORITHMS:
+			checkbox = QCheckBox(hashing.NAMES[algorithm])
+			checkbox.setChecked(algorithm in checked)
+			checkbox_layout.addWidget(checkbox)
+			self.checkboxes.append(checkbox)
+		self.rangeLabel = QLabel("")
+		self.text = QPlainTextEdit()
+		self.text.setReadOnly(True)
+		self.text.setFont(QFont("DejaVu Sans Mono, Courier, Monospace", 9))
+		self.progressBar = QProgressBar()
+		self.progressBar.setRange(0, 1000)
+		self.progressBar.hide()
+		self.statusLabel = QLabel("")
+		self.startButton = QPushButton("Start")
+		self.startButton.clicked.connect(self.on_startButton_clicked)
+		self.cancelButton = QPushButton("Cancel")
+		self.cancelButton.clicked.connect(self.on_cancelButton_clicked)
+		self.cancelButton.setEnabled(False)
+		button_layout = QHBoxLayout()
+		button_layout.addWidget(self.statusLabel, 1)
+		button_layout.addWidget(self.startButton)
+		button_layout.addWidget(self.cancelButton)
+
+		layout = QVBoxLayout()
+		layout.addLayout(checkbox_layout)
+		layout.addWidget(self.rangeLabel)
+		layout.addWidget(self.text)
+		layout.addWidget(self.progressBar)
+		layout.addLayout(button_layout)
+		widget = QWidget()
+		widget.setLayout(layout)
+		self.setCentralWidget(widget)
+		self.resize(560, 260)
+
+	def set_view(self, view):
+		self.view = view
+
+	def closeEvent(self, event):
+		self.settings.setValue("Hash/geometry", self.saveGeometry())
+		self.settings.setValue("Hash/algorithms",
+		                       ','.join(self.algorithms()))
+		self.cancel()
+		QMainWindow.closeEvent(self, event)
+
+	def algorithms(self):
+		return [algorithm for algorithm, checkbox
+		        in zip(hashing.ALGORITHMS, self.checkboxes)
+		        if checkbox.isChecked()]
+
+	def hash_range(self):
+		view = self.view
+		if view.selection_start >= 0 and \
+		   view.selection_end > view.selection_start:
+			return view.selection_start, view.selection_end
+		return 0, view.data_buffer.length()
+
+	def start(self):
+		if self.view is None or self.view.data_buffer is None:
+			return
+		algorithms = self.algorithms()
+		if not algorithms:
+			raise Exception("Select at least one algorithm.")
+		self.cancel()
+
+		start, end = self.hash_range()
+		if (start, end) == (0, self.view.data_buffer.length()):
+			text = "Whole file, {0} bytes."
+		else:
+			text = "Selection 0x{1:X}-0x{2:X}, {0} bytes."
+		self.rangeLabel.setText(text.format(end - start, start, end))
+		self.text.setPlainText("")
+
+		# The thread may read the data from disk.
+		self.main_window.flush_buffer()
+		self.hash_thread = hashing.HashThread(
+			self.view.data_buffer, start, end, algorithms,
+			lambda thread, fraction, speed:
+				invoke_in_main_thread(self.progress_changed, thread, fraction,
+				                      speed),
+			lambda thread, digests, error:
+				invoke_in_main_thread(self.finished, thread, digests, error))
+		self.hash_thread.start()
+		self.progressBar.setValue(0)
+		self.progressBar.show()
+		self.statusLabel.setText("Hashing...")
+		self.cancelButton.setEnabled(True)
+
+	def cancel(self):
+		if self.hash_thread is not None:
+			self.hash_thread.cancel()
+			self.hash_thread = None
+		self.progressBar.hide()
+		self.cancelButton.setEnabled(False)
+
+	def progress_changed(self, hash_thread, fraction, bytes_per_second):
+		if hash_thread is not self.hash_thread:
+			return
+		self.progressBar.setValue(int(1000 * min(1.0, fraction)))
+		self.statusLabel.setText("Hashing... ({0:.0f} MB/s)".format(
+			bytes_per_second / 1e6))
+
+	def finished(self, hash_thread, digests, error):
+		if hash_thread is not self.hash_thread:
+			return
+		self.cancel()
+		self.statusLabel.setText("")
+		if error is not None:
+			QMessageBox.critical(self, "Hash", error)
+			return
+		if digests is not None:
+			self.text.setPlainText('\n'.join(
+				"{0:8} {1}".format(hashing.NAMES[algorithm], digest)
+				for algorithm, digest in digests.items()))
+
+	@exception_handler
+	def on_startButton_clicked(self):
+		self.start()
+
+	@exception_handler
+	def on_cancelButton_clicked(self):
+		self.cancel()
+		self.statusLabel.setText("Canceled.")
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Hashes and checksums of a range of a data buffer. The data is read
+# once, in chunks, and every algorithm is updated with each chunk.
+# hashlib and zlib release the GIL for large chunks, so hashing on a
+# background thread does not stall the user interface.
+
+import collections
+import hashlib
+import zlib
+
+from modules.data_buffer import read_chunks
+from modules.worker import BufferThread
+
+ALGORITHMS = ('md5', 'sha1', 'sha256', 'crc32')
+NAMES = {'md5': 'MD5', 'sha1': 'SHA-1', 'sha256': 'SHA-256',
+         'crc32': 'CRC32'}
+CHUNK_LENGTH = 4 * 1024 * 1024
+
+
+class Crc32:
+	# zlib.crc32 with the interface of the hashlib objects.
+
+	def __init__(self):
+		self.value = 0
+
+	def update(self, data):
+		self.value = zlib.crc32(data, self.value)
+
+	def hexdigest(self):
+		return '%08x' % self.value
+
+
+def new_hash(algorithm):
+	if algorithm == 'crc32':
+		return Crc32()
+	return hashlib.new(algorithm)
+
+
+def hash_range(data_buffer, start, end, algorithms=ALGORITHMS, progress=None):
+	# Returns an OrderedDict from algorithm to hex digest of [start, end),
+	# or None if progress(position) returned True.
+	hashes = collections.OrderedDict((algorithm, new_hash(algorithm))
+	                                 for algorithm in algorithms)
+	pos = start
+	for chunk in read_chunks(data_buffer, start, end, CHUNK_LENGTH):
+		if progress is not None and progress(pos):
+			return None
+		for hash_object in hashes.values():
+			hash_object.update(chunk)
+		pos += len(chunk)
+	if pos < end:
+		raise ValueError("Could only read {0} of {1} bytes.".format(
+			pos - start, end - start))
+	return collections.OrderedDict((algorithm, hash_object.hexdigest())
+	                               for algorithm, hash_object in hashes.items())
+
+
+class HashThread(BufferThread):
+	# Hashes [start, end) of a buffer on a background thread. The result
+	# is the OrderedDict of digests from hash_range.
+
+	def __init__(self, data_buffer, start, end, algorithms, progress_changed,
+	             finished):
+		BufferThread.__init__(self, data_buffer, end - start,
+		                      progress_changed, finished)
+		self.start_pos = start
+		self.end_pos = end
+		self.algorithms = algorithms
+
+	def work(self, data_buffer):
+		return hash_range(data_buffer, self.start_pos, self.end_pos,
+		                  self.algorithms,
+		                  lambda pos: self.progress(pos - self.start_pos))
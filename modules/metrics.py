@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Counters and latency histograms shared by the data buffers, the page
+# cache, painting and searching. Everything goes into the module-level
+# `metrics` object, which the metrics window shows and which can be
+# written as JSON on exit (--metrics FILE).
+#
+# Metrics from worker processes (parallel search) are not collected.
+# Mapped files are read by page faults wherever their data is used, which
+# can not be timed; only the reads of the prefetch thread are (io_read).
+
+import json
+import threading
+import timeit
+
+# Latencies are kept in buckets of powers of two microseconds.
+NUMBER_OF_BUCKETS = 32
+
+
+class Histogram:
+	def __init__(self):
+		self.buckets = [0] * NUMBER_OF_BUCKETS
+		self.count = 0
+		self.total = 0.0
+		self.max = 0.0
+
+	def add(self, seconds):
+		bucket = int(seconds * 1e6).bit_length()
+		self.buckets[min(bucket, NUMBER_OF_BUCKETS - 1)] += 1
+		self.count += 1
+		self.total += seconds
+		self.max = max(self.max, seconds)
+
+	def as_dict(self):
+		# Bucket i holds latencies shorter than 2**i microseconds.
+		return {'count': self.count,
+		        'total_seconds': self.total,
+		        'mean_seconds': self.total / self.count if self.count else 0.0,
+		        'max_seconds': self.max,
+		        'histogram_us': [[2**i, n] for i, n in enumerate(self.buckets)
+		                         if n > 0]}
+
+
+class Metrics:
+	def __init__(self):
+		self.lock = threading.Lock()
+		self.reset()
+
+	def reset(self):
+		with self.lock:
+			self.counters = {}
+			self.histograms = {}
+			self.start_time = timeit.default_timer()
+
+	def count(self, **amounts):
+		# E.g. metrics.count(reads=1, bytes_read=length).
+		with self.lock:
+			for name, amount in amounts.items():
+				self.counters[name] = self.counters.get(name, 0) + amount
+
+	def record(self, name, seconds):
+		with self.lock:
+			histogram = self.histograms.get(name)
+			if histogram is None:
+				histogram = self.histograms[name] = Histogram()
+			histogram.add(seconds)
+
+	def hit_ratio(self):
+		# None if no page cache has been used, e.g. for mapped files.
+		hits = self.counters.get('cache_hits', 0)
+		total = hits + self.counters.get('cache_misses', 0)
+		if total == 0:
+			return None
+		return hits / total
+
+	def snapshot(self):
+		with self.lock:
+			return {'seconds': timeit.default_timer() - self.start_time,
+			        'counters': dict(self.counters),
+			        'cache_hit_ratio': self.hit_ratio(),
+			        'latencies': {name: histogram.as_dict() for name, histogram
+			                      in self.histograms.items()}}
+
+	def format(self):
+		# A plain-text summary for the metrics window.
+		snapshot = self.snapshot()
+		hit_ratio = snapshot['cache_hit_ratio']
+		lines = ["Elapsed: {0:.1f} s".format(snapshot['seconds']),
+		         "Cache hit ratio: " + ("n/a" if hit_ratio is None else
+		                                "{0:.1%}".format(hit_ratio)),
+		         ""]
+		for name, value in sorted(snapshot['counters'].items()):
+			lines.append("{0:<20} {1:>16,}".format(name, value))
+		for name, latency in sorted(snapshot['latencies'].items()):
+			lines.append("")
+			lines.append("{0}: {1} times, mean {2:.3f} ms, max {3:.3f} ms".format(
+				name, latency['count'], 1000 * latency['mean_seconds'],
+				1000 * latency['max_seconds']))
+			for upper_bound, count in latency['histogram_us']:
+				lines.append("  < {0:>10,} us {1:>10,}".format(upper_bound, count))
+		return '\n'.join(lines)
+
+	def dump(self, file_name):
+		with open(file_name, 'w') as f:
+			json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+
+metrics = Metrics()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+from Petter.guihelper import exception_handler
+
+from modules.metrics import metrics
+
+
+class MetricsWindow(QMainWindow):
+	# Debug window showing the shared metrics, refreshed twice a second.
+
+	def __init__(self, main_window, company_name, software_name):
+		QMainWindow.__init__(self)
+		self.setWindowTitle("Metrics")
+		self.setWindowFlags(Qt.CustomizeWindowHint |
+		                    Qt.WindowTitleHint |
+		                    Qt.WindowCloseButtonHint)
+
+		self.main_window = main_window
+
+		# Set up UI
+		self.text = QPlainTextEdit()
+		self.text.setReadOnly(True)
+		self.text.setFont(QFont("DejaVu Sans Mono, Courier, Monospace", 9))
+		self.resetButton = QPushButton("Reset")
+		self.resetButton.clicked.connect(self.on_resetButton_clicked)
+		layout = QVBoxLayout()
+		layout.addWidget(self.text)
+		layout.addWidget(self.resetButton)
+		widget = QWidget()
+		widget.setLayout(layout)
+		self.setCentralWidget(widget)
+		self.resize(400, 500)
+
+		# Read settings
+		self.settings = QSettings(company_name, software_name)
+		self.restoreGeometry(self.settings.value("Metrics/geometry"))
+
+		self.timer = QTimer(self)
+		self.timer.timeout.connect(self.update)
+		self.timer.start(500)
+
+	def closeEvent(self, event):
+		self.settings.setValue("Metrics/geometry", self.saveGeometry())
+		self.timer.stop()
+		QMainWindow.closeEvent(self, event)
+
+	def showEvent(self, event):
+		self.timer.start(500)
+		self.update()
+		QMainWindow.showEvent(self, event)
+
+	@exception_handler
+	def update(self):
+		scroll_position = self.text.verticalScrollBar().value()
+		self.text.setPlainText(metrics.format())
+		self.text.verticalScrollBar().setValue(scroll_position)
+
+	@exception_handler
+	def on_resetButton_clicked(self):
+		metrics.reset()
+		self.update()
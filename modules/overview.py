@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+from PySide import QtGui
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+from Petter.guihelper import invoke_in_main_thread
+
+from modules.entropy import EntropyThread
+
+
+class OverviewStrip(QtGui.QWidget):
+	# A narrow column next to the scroll bar showing the entropy (left,
+	# blue for low to red for high) and the fraction of zero bytes
+	# (right, darker for more zeros) along the whole file. Clicking
+	# jumps to that part of the file.
+
+	def __init__(self, parent=None, main_window=None):
+		super(OverviewStrip, self).__init__(parent)
+		self.main_window = main_window
+		self.setFixedWidth(16)
+		self.setToolTip("Entropy (left) and zero bytes (right). "
+		                "Click to go to that part of the file.")
+
+		self.view = None
+		self.entropy_thread = None
+		self.entropy_map = None
+		self.background_color = QColor(240, 240, 240)
+
+	def open(self, view, file_name):
+		# file_name is None for drives; their overview is not cached.
+		self.stop()
+		self.view = view
+		self.entropy_thread = EntropyThread(
+			view.data_buffer, file_name,
+			lambda *args: invoke_in_main_thread(self.progress_changed, *args),
+			lambda *args: invoke_in_main_thread(self.finished, *args))
+		self.entropy_map = self.entropy_thread.entropy_map
+		self.entropy_thread.start()
+		self.update()
+
+	def stop(self):
+		if self.entropy_thread is not None:
+			self.entropy_thread.cancel()
+			self.entropy_thread = None
+
+	def progress_changed(self, entropy_thread, fraction, bytes_per_second):
+		if entropy_thread is self.entropy_thread:
+			self.update()
+
+	def finished(self, entropy_thread, entropy_map, error):
+		if entropy_thread is not self.entropy_thread:
+			return
+		# The map may have been loaded from the cache.
+		self.entropy_map = entropy_thread.entropy_map
+		self.entropy_thread = None
+		if error is not None and self.main_window is not None:
+			self.main_window.statusBar().showMessage(
+				"Could not compute the overview: " + error)
+		self.update()
+
+	def position_at(self, y):
+		length = self.entropy_map.length
+		return min(max(0, int(length * y / max(1, self.height()))),
+		           max(0, length - 1))
+
+	def paintEvent(self, event):
+		painter = QtGui.QPainter(self)
+		painter.fillRect(self.rect(), self.background_color)
+		if self.entropy_map is None or self.entropy_map.length == 0:
+			return
+
+		half_width = self.width() // 2
+		for y in range(self.height()):
+			statistics = self.entropy_map.block_range(self.position_at(y),
+			                                          self.position_at(y + 1))
+			if statistics is None:
+				continue
+			entropy, zeros = statistics
+			# Hue from blue (no entropy) to red (8 bits per byte).
+			hue = int(240 * (1.0 - min(entropy, 8.0) / 8.0))
+			painter.fillRect(0, y, half_width, 1, QColor.fromHsv(hue, 200, 230))
+			gray = int(255 * (1.0 - zeros))
+			painter.fillRect(half_width, y, self.width() - half_width, 1,
+			                 QColor(gray, gray, gray))
+
+		# Mark the part of the file that is shown.
+		if self.view is not None:
+			start = self.view.data_line * self.view.line_width
+			y = int(self.height() * start / self.entropy_map.length)
+			painter.setPen(Qt.black)
+			painter.drawLine(0, y, self.width(), y)
+
+	def mousePressEvent(self, event):
+		if self.view is None or self.entropy_map is None or \
+		   self.entropy_map.length == 0:
+			return
+		line = self.position_at(event.y()) // self.view.line_width
+		self.view.set_line(line)
+		if self.main_window is not None:
+			self.main_window.update_line(line)
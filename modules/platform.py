@@ -1,12 +1,8 @@
 # Petter Strandmark 2013.
 
+import importlib.util
 import os
 
-try:
-	import win32com.client
-except:
-	win32com = None
-
 
 def create_platform(main_file):
 	if os.name == 'nt':
@@ -44,12 +40,15 @@ class WindowsPlatform:
 		                                  'sexton.ico')
 
 	def can_install_shortcut(self):
-		if win32com is None:
+		# Only check that pywin32 is installed; importing it is slow
+		# and is done when it is needed.
+		if importlib.util.find_spec('win32com') is None:
 			return False
 		else:
 			return True
 
 	def install_shortcut(self):
+		import win32com.client
 		shell                 = win32com.client.Dispatch('WScript.Shell')
 		shortcut              = shell.CreateShortCut(os.path.join(self.send_to,
 		                                            'Sexton.lnk'))
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+import threading
+
+
+class Prefetcher:
+	# Loads data into a data buffer on a background thread. The view
+	# reports every range it shows with notify(). Ranges that are not
+	# resident are loaded and data_ready() is called afterwards (from the
+	# worker thread). Data ahead of the view, in the direction the user
+	# is scrolling, is loaded as well.
+
+	def __init__(self, data_buffer, data_ready, read_ahead=1024 * 1024):
+		self.data_buffer = data_buffer
+		self.data_ready = data_ready
+		self.read_ahead = read_ahead
+
+		self.last_pos = None
+		self.direction = 1
+
+		# Only the most recent request is kept; when the user scrolls
+		# faster than the disk, old positions are not worth loading.
+		self.condition = threading.Condition()
+		self.pending = None
+		self.stopped = False
+		self.thread = threading.Thread(target=self.run)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def notify(self, pos, length):
+		if self.last_pos is not None and pos != self.last_pos:
+			self.direction = 1 if pos > self.last_pos else -1
+		self.last_pos = pos
+
+		wanted = not self.data_buffer.is_resident(pos, length)
+		if self.direction > 0:
+			ahead_pos = pos + length
+		else:
+			ahead_pos = max(0, pos - self.read_ahead)
+		ahead_length = min(self.read_ahead,
+		                   self.data_buffer.length() - ahead_pos)
+
+		with self.condition:
+			self.pending = (pos, length, wanted, ahead_pos, ahead_length)
+			self.condition.notify()
+
+	def stop(self):
+		with self.condition:
+			self.stopped = True
+			self.condition.notify()
+
+	def run(self):
+		while True:
+			with self.condition:
+				while self.pending is None and not self.stopped:
+					self.condition.wait()
+				if self.stopped:
+					return
+				pos, length, wanted, ahead_pos, ahead_length = self.pending
+				self.pending = None
+
+			try:
+				if wanted:
+					self.data_buffer.prefetch(pos, length)
+					self.data_ready()
+				if ahead_length > 0 and \
+				   not self.data_buffer.is_resident(ahead_pos, ahead_length):
+					self.data_buffer.prefetch(ahead_pos, ahead_length)
+			except Exception:
+				# Reading errors are reported when the view reads
+				# the data itself.
+				pass
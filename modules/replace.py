@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Replacing the matches of a search. Replacements of the same length as
+# the matches are written in place; otherwise the result is written to
+# a new file in one sequential pass. Either way, only a bounded amount
+# of data is held in memory.
+
+import os
+
+from modules import search
+from modules.data_buffer import open_copy, read_chunks
+from modules.worker import BufferThread
+
+# Number of bytes copied at a time between matches.
+COPY_CHUNK_LENGTH = 1024 * 1024
+
+
+def match_length(pattern):
+	# The length of every match of the pattern, or None if it varies.
+	if isinstance(pattern, search.MultiPattern):
+		lengths = set(map(len, pattern.patterns))
+		if len(lengths) == 1:
+			return lengths.pop()
+		return None
+	if isinstance(pattern, (bytes, bytearray)):
+		return len(pattern)
+	return None
+
+
+def non_overlapping(matches, start=0):
+	# Skips matches that overlap an earlier one, like re.sub.
+	last_end = start
+	for match in matches:
+		if match[0] >= last_end:
+			last_end = match[1]
+			yield match
+
+
+def replace_in_place(data_buffer, pattern, replacement, output=None,
+                     progress=None, chunk_length=search.DEFAULT_CHUNK_LENGTH):
+	# Searches the buffer and overwrites every (non-overlapping) match
+	# with the replacement, which must have the same length. The data is
+	# written to output, another instance of the same data that can be
+	# written, or to the buffer itself. Returns the number of
+	# replacements, or None if progress(position) returned True; the
+	# matches before that position have then been replaced.
+	#
+	# A replacement may form a new match with the data around it, so a
+	# match is only written once the search has passed it and will not
+	# read it again. The matches of each search chunk are written
+	# together: the range they span is read, patched and written at once.
+	if output is None:
+		output = data_buffer
+	replacement = bytes(replacement)
+	pending = []
+	replacements = 0
+	canceled = False
+
+	def write_pending(pos):
+		# Writes the pending matches that end at or before pos.
+		nonlocal replacements
+		count = 0
+		while count < len(pending) and pending[count][1] <= pos:
+			count += 1
+		if count == 0:
+			return
+		span_start = pending[0][0]
+		span_end = pending[count - 1][1]
+		data = bytearray(span_end - span_start)
+		offset = 0
+		for chunk in read_chunks(data_buffer, span_start, span_end):
+			data[offset:offset + len(chunk)] = chunk
+			offset += len(chunk)
+		for start, end in pending[:count]:
+			data[start - span_start:end - span_start] = replacement
+		output.write(span_start, data)
+		del pending[:count]
+		replacements += count
+
+	def search_progress(pos):
+		nonlocal canceled
+		write_pending(pos)
+		canceled = progress is not None and progress(pos)
+		return canceled
+
+	for match in non_overlapping(search.find_all(data_buffer, pattern,
+	                                             chunk_length=chunk_length,
+	                                             progress=search_progress)):
+		if match[1] - match[0] != len(replacement):
+			raise ValueError("The replacement must have the same length "
+			                 "as the matches.")
+		pending.append((match[0], match[1]))
+	if canceled:
+		return None
+	write_pending(data_buffer.length())
+	return replacements
+
+
+def copy_range(data_buffer, output, start, end, progress=None):
+	# Returns False if progress(position) returned True.
+	pos = start
+	while pos < end:
+		if progress is not None and progress(pos):
+			return False
+		view, length = data_buffer.read(pos, min(COPY_CHUNK_LENGTH, end - pos))
+		length = min(length, len(view))
+		if length <= 0:
+			raise ValueError("The data buffer returned no data.")
+		output.write(view[:length])
+		pos += length
+	return True
+
+
+def replace_to_file(data_buffer, matches, replacement, output, progress=None):
+	# Writes the data with every (non-overlapping) match replaced to the
+	# binary file object output. Returns the number of replacements, or
+	# None if progress(position) returned True.
+	pos = 0
+	replacements = 0
+	for match in non_overlapping(matches):
+		if not copy_range(data_buffer, output, pos, match[0], progress):
+			return None
+		output.write(replacement)
+		pos = match[1]
+		replacements += 1
+	if not copy_range(data_buffer, output, pos, data_buffer.length(), progress):
+		return None
+	return replacements
+
+
+class ReplaceThread(BufferThread):
+	# Replaces all matches on a background thread. Without an output file
+	# name, the matches are overwritten in place (see replace_in_place)
+	# and the buffer must be flushed beforehand. Otherwise a copy of the
+	# buffer with the matches replaced is written to the new file, for
+	# replacements that change the length of the data; a canceled or
+	# failed copy is removed. The result is the number of replacements.
+
+	def __init__(self, data_buffer, pattern, replacement, output_file_name,
+	             progress_changed, finished):
+		BufferThread.__init__(self, data_buffer, data_buffer.length(),
+		                      progress_changed, finished)
+		self.pattern = pattern
+		self.replacement = replacement
+		self.output_file_name = output_file_name
+
+	def work(self, data_buffer):
+		if self.output_file_name is None:
+			with open_copy(self.data_buffer, writable=True) as output:
+				return replace_in_place(data_buffer, self.pattern,
+				                        self.replacement, output,
+				                        self.progress)
+
+		replacements = None
+		try:
+			with open(self.output_file_name, 'wb') as output:
+				matches = search.find_all(data_buffer, self.pattern,
+				                          progress=self.progress)
+				replacements = replace_to_file(data_buffer, matches,
+				                               self.replacement, output,
+				                               self.progress)
+		finally:
+			if replacements is None and \
+			   os.path.exists(self.output_file_name):
+				os.remove(self.output_file_name)
+		return replacements
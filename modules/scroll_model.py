@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Qt scroll bars hold 32-bit values, but a large drive has more lines
+# than that. The scroll model keeps the exact (Python int) line and maps
+# it to and from scroll bar values. When there are too many lines, the
+# scroll bar is coarse: dragging the slider moves proportionally, while
+# line and page steps still move by exactly one line or one page.
+
+# Largest scroll bar value used. Well inside Qt's int range.
+SCROLLBAR_MAXIMUM = 2**30
+
+
+class ScrollModel:
+	def __init__(self, max_line=0, page_lines=1):
+		self.line = 0
+		self.set_range(max_line, page_lines)
+
+	def set_range(self, max_line, page_lines):
+		self.max_line = max(0, max_line)
+		self.page_lines = max(1, page_lines)
+		self.line = min(self.line, self.max_line)
+
+	def is_exact(self):
+		return self.max_line <= SCROLLBAR_MAXIMUM
+
+	def maximum(self):
+		# Maximum value of the scroll bar.
+		if self.is_exact():
+			return self.max_line
+		return SCROLLBAR_MAXIMUM
+
+	def page_step(self):
+		# Page step of the scroll bar. Only used to size the slider; page
+		# steps are performed exactly by step().
+		if self.is_exact():
+			return self.page_lines
+		return max(1, self.page_lines * SCROLLBAR_MAXIMUM // self.max_line)
+
+	def line_to_value(self, line):
+		line = min(max(0, line), self.max_line)
+		if self.is_exact():
+			return line
+		return line * SCROLLBAR_MAXIMUM // self.max_line
+
+	def value_to_line(self, value):
+		if self.is_exact():
+			return value
+		# Several lines map to the same value. Stay on the current line
+		# if it is one of them, so that positions are never rounded.
+		if self.line_to_value(self.line) == value:
+			return self.line
+		return value * self.max_line // SCROLLBAR_MAXIMUM
+
+	def set_line(self, line):
+		# Sets the current line and returns the scroll bar value for it.
+		self.line = line
+		return self.line_to_value(line)
+
+	def set_value(self, value):
+		# Sets the current line from a scroll bar value and returns it.
+		self.line = self.value_to_line(value)
+		return self.line
+
+	def step(self, lines):
+		# Moves the current line by a number of lines (e.g. one page) and
+		# returns the scroll bar value for the new line.
+		return self.set_line(min(max(0, self.line + lines), self.max_line))
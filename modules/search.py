@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+import array
+import concurrent.futures
+import contextlib
+import multiprocessing
+import re
+
+# Number of bytes searched per read from the data buffer.
+DEFAULT_CHUNK_LENGTH = 256 * 1024
+# Regular expressions can not be searched in chunks exactly. Matches
+# longer than this are not found (or found only in part).
+DEFAULT_MAX_SPAN = 4096
+# Number of bytes searched by each task in a parallel search.
+DEFAULT_SEGMENT_LENGTH = 64 * 1024 * 1024
+
+
+class MultiPattern:
+	# Several byte strings that are searched for in a single pass. They
+	# are combined into one regular expression with a group for each
+	# string. The longest strings are tried first, so where several
+	# strings match at the same offset, the longest one is reported.
+
+	def __init__(self, patterns):
+		self.patterns = [bytes(pattern) for pattern in patterns]
+		if len(self.patterns) == 0 or min(map(len, self.patterns)) == 0:
+			raise ValueError("Can not search for an empty pattern.")
+
+		self.group_patterns = sorted(range(len(self.patterns)),
+		                             key=lambda i: -len(self.patterns[i]))
+		self.regex = re.compile(b'|'.join(b'(' + re.escape(self.patterns[i]) + b')'
+		                                  for i in self.group_patterns))
+		self.max_span = max(map(len, self.patterns))
+
+	def pattern_index(self, match):
+		return self.group_patterns[match.lastindex - 1]
+
+
+def compile_pattern(pattern, max_span=None):
+	# Returns a compiled regular expression, the longest possible
+	# match and whether overlapping matches should be reported.
+	if isinstance(pattern, MultiPattern):
+		return pattern.regex, pattern.max_span, True
+	if isinstance(pattern, (bytes, bytearray)):
+		if len(pattern) == 0:
+			raise ValueError("Can not search for an empty pattern.")
+		return re.compile(re.escape(bytes(pattern))), len(pattern), True
+	if max_span is None:
+		max_span = DEFAULT_MAX_SPAN
+	return pattern, max_span, False
+
+
+def find_all(data_buffer, pattern, start=0, end=None,
+             chunk_length=DEFAULT_CHUNK_LENGTH, max_span=None, progress=None):
+	# Generates (match_start, match_end) for every match of pattern in
+	# the data buffer between start and end.
+	#
+	# The pattern is either a byte string, in which case every occurrence
+	# is reported (also overlapping ones), or a compiled regular
+	# expression, which reports non-overlapping matches like
+	# re.finditer. A MultiPattern reports every offset where one of its
+	# strings occurs, as (match_start, match_end, pattern_index).
+	#
+	# Consecutive chunks overlap by max_span - 1 bytes so that matches
+	# across chunk boundaries are found. The data is searched directly
+	# in the views returned by the buffer, without copying.
+	#
+	# progress(position) is called before each chunk is read. If it
+	# returns True, the search stops.
+	regex, max_span, overlapping = compile_pattern(pattern, max_span)
+	multi_pattern = isinstance(pattern, MultiPattern)
+	overlap = max_span - 1
+	if end is None:
+		end = data_buffer.length()
+
+	chunk_pos = start
+	search_pos = start
+	while chunk_pos < end:
+		if progress is not None and progress(chunk_pos):
+			return
+
+		wanted_length = min(chunk_length + overlap, end - chunk_pos)
+		view, length = read_chunk(data_buffer, chunk_pos, wanted_length)
+		if chunk_pos + length >= end:
+			step = length
+		else:
+			step = length - overlap
+		if step <= 0:
+			raise ValueError("The data buffer returned too little data "
+			                 "to search for the pattern.")
+		report_end = chunk_pos + step
+
+		pos = search_pos - chunk_pos
+		while True:
+			match = regex.search(view, pos)
+			if match is None or chunk_pos + match.start() >= report_end:
+				break
+
+			match_start = match.start()
+			if overlapping or match.end() == match_start:
+				pos = match_start + 1
+			else:
+				pos = match.end()
+
+			if multi_pattern:
+				yield (chunk_pos + match_start, chunk_pos + match.end(),
+				       pattern.pattern_index(match))
+			else:
+				yield chunk_pos + match_start, chunk_pos + match.end()
+
+			# The caller may have read other parts of the buffer,
+			# which could have invalidated our view.
+			view, length = read_chunk(data_buffer, chunk_pos, length)
+
+		search_pos = max(chunk_pos + pos, report_end)
+		chunk_pos = report_end
+
+
+def read_chunk(data_buffer, pos, length):
+	view, length = data_buffer.read(pos, length)
+	length = min(length, len(view))
+	return view[:length], length
+
+
+def parallel_find_all(data_buffer, pattern, start=0, end=None,
+                      segment_length=DEFAULT_SEGMENT_LENGTH, max_span=None,
+                      max_workers=None, progress=None):
+	# Same as find_all, but the range is split into overlapping segments
+	# that are searched by a pool of processes, each of which opens the
+	# data again. Matches are generated in offset order; the first match
+	# is generated as soon as all segments before it have been searched.
+	#
+	# progress(position) is called regularly with start plus the number
+	# of bytes searched so far. If it returns True, the search stops.
+	#
+	# Buffers that can not be opened again are searched sequentially.
+	opener = data_buffer.opener()
+	if opener is None:
+		for match in find_all(data_buffer, pattern, start, end,
+		                      max_span=max_span, progress=progress):
+			yield match
+		return
+
+	regex, max_span, overlapping = compile_pattern(pattern, max_span)
+	match_size = 3 if isinstance(pattern, MultiPattern) else 2
+	if end is None:
+		end = data_buffer.length()
+	if max_workers is None:
+		max_workers = multiprocessing.cpu_count()
+
+	segments = []
+	for segment_start in range(start, end, segment_length):
+		segments.append((segment_start, min(segment_start + segment_length, end)))
+
+	executor = concurrent.futures.ProcessPoolExecutor(max_workers)
+	futures = {}
+	next_to_submit = 0
+	next_to_report = 0
+	bytes_searched = 0
+	last_end = start
+	try:
+		while next_to_report < len(segments):
+			# Keep a bounded number of segments in flight so that a
+			# canceled search stops quickly.
+			while next_to_submit < len(segments) and \
+			      next_to_submit < next_to_report + 2 * max_workers:
+				segment_start, segment_end = segments[next_to_submit]
+				futures[next_to_submit] = executor.submit(
+					search_segment, opener, pattern, segment_start, segment_end,
+					min(segment_end + max_span - 1, end), max_span)
+				next_to_submit += 1
+
+			if progress is not None and progress(start + bytes_searched):
+				return
+			concurrent.futures.wait(list(futures.values()), timeout=0.1,
+			                        return_when=concurrent.futures.FIRST_COMPLETED)
+
+			# Report the segments that are done, in order.
+			while next_to_report in futures and \
+			      futures[next_to_report].done():
+				matches = futures.pop(next_to_report).result()
+				segment_start, segment_end = segments[next_to_report]
+				bytes_searched += segment_end - segment_start
+				next_to_report += 1
+				for i in range(0, len(matches), match_size):
+					match = tuple(matches[i:i + match_size])
+					# Regex matches may overlap a match that was found
+					# in the previous segment.
+					if not overlapping and match[0] < last_end:
+						continue
+					last_end = match[1]
+					yield match
+	finally:
+		# If the search was stopped early, do not wait for the
+		# segments that are still being searched.
+		for future in futures.values():
+			future.cancel()
+		executor.shutdown(wait=len(futures) == 0)
+
+
+def search_segment(opener, pattern, segment_start, segment_end,
+                   search_end, max_span):
+	# Runs in a worker process. Returns the matches starting in the
+	# segment as a flat array of the generated tuples.
+	buffer_class, arguments = opener
+	matches = array.array('Q')
+	with contextlib.closing(buffer_class(*arguments)) as data_buffer:
+		for match in find_all(data_buffer, pattern, segment_start, search_end,
+		                      max_span=max_span):
+			if match[0] >= segment_end:
+				break
+			matches.extend(match)
+	return matches
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+from PySide.QtCore import *
+from PySide.QtGui import *
+
+from Petter.guihelper import exception_handler
+
+from modules import templates
+
+# Qt views count rows with 32-bit integers.
+MAX_ROWS = 2**31 - 1
+
+
+class RecordModel(QAbstractTableModel):
+	# One row per record, with the offset and the fields as columns. Only
+	# the records that the table displays are decoded.
+
+	def __init__(self):
+		QAbstractTableModel.__init__(self)
+		self.reader = None
+
+	def rowCount(self, parent=QModelIndex()):
+		if parent.isValid() or self.reader is None:
+			return 0
+		return min(self.reader.count, MAX_ROWS)
+
+	def columnCount(self, parent=QModelIndex()):
+		if parent.isValid() or self.reader is None:
+			return 0
+		return 1 + len(self.reader.template.names)
+
+	def data(self, index, role=Qt.DisplayRole):
+		if role != Qt.DisplayRole or not index.isValid():
+			return None
+		row = index.row()
+		if index.column() == 0:
+			return "0x{0:X}".format(self.reader.offset(row))
+		return self.reader.template.format_field(self.reader.record(row),
+		                                         index.column() - 1)
+
+	def headerData(self, section, orientation, role=Qt.DisplayRole):
+		if role != Qt.DisplayRole or orientation != Qt.Horizontal or \
+		   self.reader is None:
+			return None
+		if section == 0:
+			return "Offset"
+		return self.reader.template.names[section - 1]
+
+	def set_reader(self, reader):
+		self.beginResetModel()
+		self.reader = reader
+		self.endResetModel()
+
+	def refresh(self):
+		# The data has changed; decode the records again.
+		if self.reader is not None:
+			self.reader.clear()
+			self.dataChanged.emit(self.index(0, 0),
+			                      self.index(self.rowCount() - 1,
+			                                 self.columnCount() - 1))
+
+
+class TemplateWindow(QMainWindow):
+	# Shows the file as a table of records laid out by a template,
+	# starting at the cursor. The table follows the cursor of the hex
+	# view, and clicking a record selects it in the hex view.
+
+	def __init__(self, main_window, company_name, software_name):
+		QMainWindow.__init__(self)
+		self.setWindowTitle("Templates")
+		self.setWindowFlags(Qt.CustomizeWindowHint |
+		                    Qt.WindowTitleHint |
+		                    Qt.WindowCloseButtonHint)
+
+		self.main_window = main_window
+		self.view = None
+
+		# Set up UI
+		self.templateComboBox = QComboBox()
+		for name in templates.TEMPLATES:
+			self.templateComboBox.addItem(name)
+		self.templateComboBox.addItem("Custom")
+		self.applyButton = QPushButton("Apply at cursor")
+		self.textEdit = QPlainTextEdit()
+		self.textEdit.setFont(QFont("DejaVu Sans Mono, Courier, Monospace", 9))
+		self.textEdit.setMaximumHeight(150)
+		self.textEdit.setReadOnly(True)
+		self.recordTable = QTableView()
+		self.recordTable.setSelectionBehavior(QAbstractItemView.SelectRows)
+		self.recordTable.setSelectionMode(QAbstractItemView.SingleSelection)
+		self.recordTable.verticalHeader().hide()
+		self.record_model = RecordModel()
+		self.recordTable.setModel(self.record_model)
+		self.statusLabel = QLabel("")
+
+		top_layout = QHBoxLayout()
+		top_layout.addWidget(self.templateComboBox, 1)
+		top_layout.addWidget(self.applyButton)
+		layout = QVBoxLayout()
+		layout.addLayout(top_layout)
+		layout.addWidget(self.textEdit)
+		layout.addWidget(self.recordTable, 1)
+		layout.addWidget(self.statusLabel)
+		widget = QWidget()
+		widget.setLayout(layout)
+		self.setCentralWidget(widget)
+		self.resize(600, 500)
+
+		# Read settings
+		self.settings = QSettings(company_name, software_name)
+		self.restoreGeometry(self.settings.value("Templates/geometry"))
+		self.custom_text = self.settings.value("Templates/custom", "")
+		template_index = int(self.settings.value("Templates/template", 0))
+		if 0 <= template_index < self.templateComboBox.count():
+			self.templateComboBox.setCurrentIndex(template_index)
+		self.on_templateComboBox_currentIndexChanged()
+
+		self.templateComboBox.currentIndexChanged.connect(
+			self.on_templateComboBox_currentIndexChanged)
+		self.applyButton.clicked.connect(self.on_applyButton_clicked)
+		self.recordTable.clicked.connect(self.on_recordTable_clicked)
+
+	def set_view(self, view):
+		self.view = view
+
+	def is_custom(self):
+		return self.templateComboBox.currentIndex() == len(templates.TEMPLATES)
+
+	def closeEvent(self, event):
+		if self.is_custom():
+			self.custom_text = self.textEdit.toPlainText()
+		self.settings.setValue("Templates/geometry", self.saveGeometry())
+		self.settings.setValue("Templates/template",
+		                       self.templateComboBox.currentIndex())
+		self.settings.setValue("Templates/custom", self.custom_text)
+		QMainWindow.closeEvent(self, event)
+
+	def current_reader(self):
+		# The reader, if it reads the data shown in the view.
+		reader = self.record_model.reader
+		if reader is None or self.view is None or \
+		   reader.data_buffer is not self.view.data_buffer:
+			return None
+		return reader
+
+	def refresh(self):
+		# Called when the data has changed.
+		if self.current_reader() is not None:
+			self.record_model.refresh()
+
+	def follow_cursor(self):
+		# Called when the cursor has moved. Only selects the record at
+		# the cursor; the decoded records are kept.
+		reader = self.current_reader()
+		if reader is None:
+			return
+		index = reader.index_at(self.view.get_cursor_position())
+		if index is not None and index < MAX_ROWS:
+			self.recordTable.selectRow(index)
+			self.recordTable.scrollTo(self.record_model.index(index, 0))
+		else:
+			self.recordTable.clearSelection()
+
+	@exception_handler
+	def on_templateComboBox_currentIndexChanged(self, index=None):
+		if self.is_custom():
+			self.textEdit.setReadOnly(False)
+			self.textEdit.setPlainText(self.custom_text)
+		else:
+			# Remember the custom template while a built-in one is shown.
+			if not self.textEdit.isReadOnly():
+				self.custom_text = self.textEdit.toPlainText()
+			self.textEdit.setReadOnly(True)
+			name = self.templateComboBox.currentText()
+			self.textEdit.setPlainText(templates.TEMPLATES[name])
+
+	@exception_handler
+	def on_applyButton_clicked(self):
+		if self.view is None or self.view.data_buffer is None:
+			return
+		template = templates.parse_template(self.textEdit.toPlainText())
+		reader = templates.RecordReader(self.view.data_buffer, template,
+		                                self.view.get_cursor_position())
+		self.record_model.set_reader(reader)
+		self.statusLabel.setText("{0} records of {1} bytes.".format(
+			reader.count, template.record_length))
+		self.follow_cursor()
+
+	@exception_handler
+	def on_recordTable_clicked(self, index):
+		reader = self.record_model.reader
+		start = reader.offset(index.row())
+		self.view.set_cursor_position(start)
+		self.view.set_selection(start, start + reader.template.record_length)
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Record templates. A template declares the fields of a fixed-size
+# record, one per line:
+#
+#   big                 (optional byte order; little-endian by default)
+#   char[4] magic       (a byte string)
+#   uint16  machine     (int8 to uint64, float or double)
+#   pad[2]  reserved    (skipped bytes, not shown)
+#
+# and is compiled into a single struct.Struct and, if NumPy is
+# installed, a structured dtype. Repeated records are decoded lazily in
+# batches straight from the data buffer.
+
+import collections
+import struct
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from modules import typed_array
+from modules.data_buffer import read_chunks
+
+# Number of records decoded at a time, and the number of decoded batches
+# kept in memory.
+BATCH_RECORDS = 4096
+MAX_BATCHES = 16
+
+TEMPLATES = collections.OrderedDict([
+('DOS header (MZ)', """\
+char[2] e_magic
+uint16  e_cblp
+uint16  e_cp
+uint16  e_crlc
+uint16  e_cparhdr
+uint16  e_minalloc
+uint16  e_maxalloc
+uint16  e_ss
+uint16  e_sp
+uint16  e_csum
+uint16  e_ip
+uint16  e_cs
+uint16  e_lfarlc
+uint16  e_ovno
+pad[8]  e_res
+uint16  e_oemid
+uint16  e_oeminfo
+pad[20] e_res2
+int32   e_lfanew
+"""),
+('PE file header (at e_lfanew)', """\
+char[4] signature
+uint16  machine
+uint16  number_of_sections
+uint32  time_date_stamp
+uint32  pointer_to_symbol_table
+uint32  number_of_symbols
+uint16  size_of_optional_header
+uint16  characteristics
+"""),
+('ELF64 header', """\
+char[4] e_ident_magic
+uint8   e_ident_class
+uint8   e_ident_data
+uint8   e_ident_version
+uint8   e_ident_osabi
+uint8   e_ident_abiversion
+pad[7]  e_ident_pad
+uint16  e_type
+uint16  e_machine
+uint32  e_version
+uint64  e_entry
+uint64  e_phoff
+uint64  e_shoff
+uint32  e_flags
+uint16  e_ehsize
+uint16  e_phentsize
+uint16  e_phnum
+uint16  e_shentsize
+uint16  e_shnum
+uint16  e_shstrndx
+"""),
+('ELF64 section header', """\
+uint32 sh_name
+uint32 sh_type
+uint64 sh_flags
+uint64 sh_addr
+uint64 sh_offset
+uint64 sh_size
+uint32 sh_link
+uint32 sh_info
+uint64 sh_addralign
+uint64 sh_entsize
+"""),
+])
+
+
+class Template:
+	def __init__(self, fields, little_endian=True):
+		# fields is a list of (name, type name, count), where the type
+		# name is one of typed_array.TYPES, 'char' or 'pad'.
+		if len(fields) == 0:
+			raise ValueError("A template needs at least one field.")
+		self.little_endian = little_endian
+		self.names = []
+		self.type_characters = []
+
+		type_characters = dict(typed_array.TYPES)
+		if little_endian:
+			format_string = '<'
+		else:
+			format_string = '>'
+		dtype_formats = []
+		dtype_offsets = []
+		offset = 0
+		for name, type_name, count in fields:
+			if type_name == 'pad':
+				format_string += '%dx' % count
+				offset += count
+				continue
+			if name in self.names:
+				raise ValueError("The field " + name + " is declared twice.")
+			if type_name == 'char':
+				format_string += '%ds' % count
+				dtype_formats.append('S%d' % count)
+				type_character = 's'
+				length = count
+			else:
+				type_character = type_characters[type_name]
+				format_string += type_character
+				if numpy is not None:
+					dtype_formats.append(typed_array.numpy_dtype(type_character,
+					                                             little_endian))
+				length = typed_array.ITEM_SIZES[type_character]
+			self.names.append(name)
+			self.type_characters.append(type_character)
+			dtype_offsets.append(offset)
+			offset += length
+
+		self.struct = struct.Struct(format_string)
+		self.record_length = self.struct.size
+		if numpy is not None:
+			self.dtype = numpy.dtype({'names': self.names,
+			                          'formats': dtype_formats,
+			                          'offsets': dtype_offsets,
+			                          'itemsize': self.record_length})
+		else:
+			self.dtype = None
+
+	def decode(self, data):
+		# The whole records in data. Record i, field j is
+		# records[i][j]; with NumPy, a whole field is records[name].
+		data = memoryview(data).cast('B')
+		data = data[:len(data) - len(data) % self.record_length]
+		if self.dtype is not None:
+			return numpy.frombuffer(data, dtype=self.dtype)
+		return list(self.struct.iter_unpack(data))
+
+	def format_field(self, record, field):
+		value = record[field]
+		if self.type_characters[field] == 's':
+			return repr(bytes(value))[2:-1]
+		return typed_array.format_value(value, self.type_characters[field])
+
+
+def parse_template(text):
+	# Compiles a template from its declaration. Raises ValueError with
+	# the line number for errors.
+	type_names = set(name for name, type_character in typed_array.TYPES)
+	little_endian = True
+	fields = []
+	for line_number, line in enumerate(text.splitlines(), 1):
+		line = line.split('#')[0].strip()
+		if not line:
+			continue
+		if line in ('little', 'big'):
+			little_endian = line == 'little'
+			continue
+		parts = line.split()
+		if len(parts) != 2:
+			raise ValueError("Line {0}: expected a type and a name.".format(
+				line_number))
+		type_name, name = parts
+		count = 1
+		if type_name.endswith(']') and '[' in type_name:
+			type_name, count_string = type_name[:-1].split('[', 1)
+			try:
+				count = int(count_string, 0)
+			except ValueError:
+				count = 0
+			if count <= 0 or type_name not in ('char', 'pad'):
+				raise ValueError("Line {0}: invalid array {1}.".format(
+					line_number, parts[0]))
+		elif type_name not in type_names:
+			raise ValueError("Line {0}: unknown type {1}.".format(
+				line_number, type_name))
+		fields.append((name, type_name, count))
+	return Template(fields, little_endian)
+
+
+class RecordReader:
+	# Repeated records from start to the end of a data buffer. Records
+	# are decoded in batches when they are first accessed.
+
+	def __init__(self, data_buffer, template, start=0):
+		self.data_buffer = data_buffer
+		self.template = template
+		self.start = start
+		self.count = max(0, data_buffer.length() - start) // \
+		             template.record_length
+		self.batches = collections.OrderedDict()
+
+	def offset(self, index):
+		return self.start + index * self.template.record_length
+
+	def index_at(self, pos):
+		# The record containing pos, or None.
+		if pos < self.start:
+			return None
+		index = (pos - self.start) // self.template.record_length
+		if index >= self.count:
+			return None
+		return index
+
+	def record(self, index):
+		batch_number = index // BATCH_RECORDS
+		batch = self.batches.get(batch_number)
+		if batch is None:
+			batch = self.decode_batch(batch_number)
+			self.batches[batch_number] = batch
+			if len(self.batches) > MAX_BATCHES:
+				self.batches.popitem(last=False)
+		else:
+			self.batches.move_to_end(batch_number)
+		return batch[index - batch_number * BATCH_RECORDS]
+
+	def decode_batch(self, batch_number):
+		record_length = self.template.record_length
+		first = batch_number * BATCH_RECORDS
+		count = min(BATCH_RECORDS, self.count - first)
+		start = self.offset(first)
+		end = start + count * record_length
+		chunks = list(read_chunks(self.data_buffer, start, end,
+		                          max(1024 * 1024, record_length),
+		                          record_length))
+		if len(chunks) == 1:
+			return self.template.decode(chunks[0])
+		return self.template.decode(b''.join(chunks))
+
+	def clear(self):
+		# Call when the data has changed.
+		self.batches.clear()
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+# Decoding data as arrays of numbers, for the array table of the Data
+# Types window. Values are decoded directly from the memoryviews of the
+# data buffer, with NumPy if it is installed and with memoryview.cast
+# (or array for the other byte order) otherwise.
+
+import array
+import sys
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+from modules.data_buffer import read_chunks
+
+# Name and struct format character of each type.
+TYPES = [('int8', 'b'), ('uint8', 'B'),
+         ('int16', 'h'), ('uint16', 'H'),
+         ('int32', 'i'), ('uint32', 'I'),
+         ('int64', 'q'), ('uint64', 'Q'),
+         ('float', 'f'), ('double', 'd')]
+
+ITEM_SIZES = {'b': 1, 'B': 1, 'h': 2, 'H': 2, 'i': 4, 'I': 4,
+              'q': 8, 'Q': 8, 'f': 4, 'd': 8}
+
+# Statistics are computed over at most this many bytes of a selection.
+if numpy is not None:
+	STATISTICS_MAX_LENGTH = 16 * 1024 * 1024
+else:
+	STATISTICS_MAX_LENGTH = 1024 * 1024
+
+
+def numpy_dtype(type_character, little_endian=True):
+	kind = type_character.lower()
+	if kind in 'fd':
+		name = 'f'
+	elif type_character.islower():
+		name = 'i'
+	else:
+		name = 'u'
+	if little_endian:
+		byte_order = '<'
+	else:
+		byte_order = '>'
+	return numpy.dtype(byte_order + name + str(ITEM_SIZES[type_character]))
+
+
+def decode(data, type_character, little_endian=True):
+	# The whole values in data as a sequence of numbers. Trailing bytes
+	# that do not make up a value are ignored.
+	data = memoryview(data).cast('B')
+	size = ITEM_SIZES[type_character]
+	data = data[:len(data) - len(data) % size]
+	if numpy is not None:
+		return numpy.frombuffer(data, dtype=numpy_dtype(type_character,
+		                                                little_endian))
+	if little_endian == (sys.byteorder == 'little'):
+		return data.cast(type_character)
+	# The array type codes have the same sizes as the struct ones on
+	# all supported platforms.
+	values = array.array(type_character)
+	values.frombytes(data)
+	values.byteswap()
+	return values
+
+
+def statistics(data_buffer, start, end, type_character, little_endian=True):
+	# Returns (count, minimum, maximum, mean) of the values in
+	# [start, end), or None if there are no whole values.
+	size = ITEM_SIZES[type_character]
+	count = 0
+	minimum = None
+	maximum = None
+	total = 0.0
+	for chunk in read_chunks(data_buffer, start, end, alignment=size):
+		values = decode(chunk, type_character, little_endian)
+		if numpy is not None:
+			chunk_minimum = values.min().item()
+			chunk_maximum = values.max().item()
+			total += values.sum(dtype=numpy.float64).item()
+		else:
+			chunk_minimum = min(values)
+			chunk_maximum = max(values)
+			total += sum(values)
+		if count == 0:
+			minimum, maximum = chunk_minimum, chunk_maximum
+		else:
+			minimum = min(minimum, chunk_minimum)
+			maximum = max(maximum, chunk_maximum)
+		count += len(values)
+	if count == 0:
+		return None
+	return count, minimum, maximum, total / count
+
+
+def format_value(value, type_character):
+	if type_character in 'fd':
+		return '%e' % value
+	return '%d' % value
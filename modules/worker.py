@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#
+# Petter Strandmark 2014.
+
+import threading
+import timeit
+
+from modules.data_buffer import open_copy
+
+# Seconds between progress reports.
+REPORT_INTERVAL = 0.1
+
+
+class BufferThread(threading.Thread):
+	# Base class of the threads that process a data buffer in the
+	# background. Subclasses implement work(data_buffer), which gets a
+	# separate copy of the buffer (see open_copy), calls progress(done)
+	# regularly and stops when it returns True. The callbacks are called
+	# from this thread, with the thread as first argument:
+	#
+	#   progress_changed(thread, fraction, bytes_per_second) a few times
+	#     per second, unless it is None,
+	#   finished(thread, result, error) with the return value of work(),
+	#     which is None if the thread was canceled or failed.
+	#
+	# User interfaces pass them through invoke_in_main_thread. Threads
+	# that find results along the way hand them over in batches in
+	# deliver(), which is called before every progress report and before
+	# finished.
+
+	def __init__(self, data_buffer, total_length, progress_changed, finished):
+		threading.Thread.__init__(self)
+		self.daemon = True
+
+		self.data_buffer = data_buffer
+		self.total_length = total_length
+		self.progress_changed = progress_changed
+		self.finished = finished
+		self.canceled = threading.Event()
+
+	def cancel(self):
+		self.canceled.set()
+
+	def progress(self, done):
+		# Reports that done of total_length bytes have been processed.
+		# Returns True if the thread has been canceled.
+		now = timeit.default_timer()
+		if now - self.last_report >= REPORT_INTERVAL:
+			self.last_report = now
+			self.deliver()
+			if self.progress_changed is not None:
+				self.progress_changed(self,
+				                      float(done) / max(1, self.total_length),
+				                      done / max(1e-6, now - self.start_time))
+		return self.canceled.is_set()
+
+	def run(self):
+		self.start_time = timeit.default_timer()
+		self.last_report = self.start_time
+		result = None
+		error = None
+		try:
+			with open_copy(self.data_buffer) as data_buffer:
+				result = self.work(data_buffer)
+		except Exception as err:
+			error = str(err)
+		self.deliver()
+		self.finished(self, result, error)
+
+	def work(self, data_buffer):
+		raise NotImplementedError()
+
+	def deliver(self):
+		pass
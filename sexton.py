@@ -4,8 +4,25 @@
 # Petter Strandmark 2013–2014.
 
 import argparse
+import collections
+import importlib.util
 import os
 import sys
+import timeit
+
+# Times at which the phases of startup ended. Printed at the first
+# paint when started with --profile-startup.
+startup_phases = [('start', timeit.default_timer())]
+
+if __name__ == "__main__" and len(sys.argv) > 1:
+	# The command-line subcommands do not need (or import) Qt.
+	from modules import cli
+	if sys.argv[1] in cli.COMMANDS:
+		# Worker processes started with the spawn method import the
+		# main module again; make that modules.cli instead of this
+		# file, which imports Qt.
+		sys.modules['__main__'] = cli
+		sys.exit(cli.main(sys.argv[1:]))
 
 # Import Qt modules
 import PySide
@@ -13,19 +30,22 @@ from PySide import QtGui
 from PySide.QtCore import *
 from PySide.QtGui import *
 
-try:
-	import win32com.shell.shell as pywin32_shell
-except ImportError:
-	pywin32_shell = None
-
 from Petter.guihelper import invoke_in_main_thread, \
                              exception_handler, PMainWindow
 
+from modules import export
+from modules.byte_format import bytes_to_hex, bytes_to_string
 from modules.data_buffer import *
-from modules.data_types import DataTypes
-from modules.drives import DriveDialog
-from modules.find_and_replace import FindAndReplace
+from modules.file_cache import file_signature
 from modules.platform import create_platform
+from modules.metrics import metrics as session_metrics
+from modules.prefetch import Prefetcher
+from modules.scroll_model import ScrollModel
+
+# The auxiliary windows (Data Types, Find and Replace, Open Drive, Compare
+# and Metrics) are imported when they are first opened.
+
+startup_phases.append(('imports', timeit.default_timer()))
 
 # Used for saving settings (e.g. in the registry on Windows)
 company_name  = 'Petter Strandmark'
@@ -47,10 +67,25 @@ class HexView(QtGui.QWidget):
 		self.main_window = main_window
 
 		self.line_height = 14.0
+		# Height used without a GUI, e.g. when painting into an image.
+		self.headless_height = 200
 
 		self.font = QFont("DejaVu Sans Mono, Courier, Monospace", 10)
-		self.character_width = 10
+		# Updated from the font metrics when painting.
+		self.character_width = 8.0
+		self.character_ascent = 11.0
+		# Left edge of the hexadecimal column.
+		self.hex_left = 180
+		# Time taken by the last paint, in seconds.
+		self.paint_time = 0.0
+		# Rendered rows, so that scrolling only renders the rows that
+		# become visible. See paint_row.
+		self.row_cache = collections.OrderedDict()
+		self.row_cache_size = 1024
 		self.data_buffer = None
+		self.prefetcher = None
+		# Called once, after the view has been painted for the first time.
+		self.first_paint_callback = None
 		self.line_width = 16
 		self.data_line = 0
 
@@ -62,18 +97,19 @@ class HexView(QtGui.QWidget):
 		self.selection_start = -1
 		self.selection_end = -1
 
+		self.cursor_color = QColor(255, 0, 0)
+		self.text_color   = QColor(0, 0, 0)
+		self.cursor_background_brush          = QBrush(QColor(255, 255, 1))
+		self.cursor_disabled_background_brush = QBrush(QColor(220, 220, 220))
+		self.selection_background_brush       = QBrush(QColor(180, 255, 180))
+
 		if have_gui:
 			window_color = self.palette().window().color()
 			cursor_disabled_color = QColor()
 			cursor_disabled_color.setRedF(window_color.redF()     - 0.1)
 			cursor_disabled_color.setGreenF(window_color.greenF() - 0.1)
 			cursor_disabled_color.setBlueF(window_color.blueF()   - 0.1)
-
-			self.cursor_color = QColor(255, 0, 0)
-			self.text_color   = QColor(0, 0, 0)
-			self.cursor_background_brush          = QBrush(QColor(255, 255, 1))
 			self.cursor_disabled_background_brush = QBrush(cursor_disabled_color)
-			self.selection_background_brush       = QBrush(QColor(180, 255, 180))
 
 			# Accept key strokes.
 			self.setFocusPolicy(Qt.WheelFocus)
@@ -97,10 +133,20 @@ class HexView(QtGui.QWidget):
 		if self.data_buffer is not None:
 			self.data_buffer.flush()
 
+		if self.prefetcher is not None:
+			self.prefetcher.stop()
+			self.prefetcher = None
+
 		self.data_buffer = data_buffer
+		self.row_cache.clear()
 		if self.data_buffer.length() == 0:
 			self.data_buffer = None
 			raise RuntimeError('File is empty.')
+
+		# Reads data on a background thread and repaints the
+		# view when it has arrived.
+		self.prefetcher = Prefetcher(self.data_buffer,
+		                             lambda: invoke_in_main_thread(self.update))
 		# Is the cursor outside the file?
 		if self.cursor_line * self.line_width + self.cursor_column \
 		   >= self.data_buffer.length():
@@ -114,7 +160,7 @@ class HexView(QtGui.QWidget):
 		else:
 			# If no GUI is available, 200 pixels is an acceptable
 			# height for testing.
-			screen_height = 200
+			screen_height = self.headless_height
 		return int(screen_height // self.line_height)
 
 	def number_of_rows(self):
@@ -159,17 +205,15 @@ class HexView(QtGui.QWidget):
 		return view
 
 	def bytes_to_string(self, byte_data):
-		output_string = ''
-		for i in range(len(byte_data)):
-			if byte_data[i] >= 32:
-				try:
-					# TODO: allow user to change decoder.
-					output_string += byte_data[i:i+1].decode('cp1252')
-				except:
-					output_string += byte_data[i:i+1].decode('cp850')
-			else:
-				output_string += '.'
-		return output_string
+		return bytes_to_string(byte_data)
+
+	def hex_x(self, column):
+		# Each byte takes three characters: two digits and a space.
+		return self.hex_left + 3 * self.character_width * column
+
+	def text_x(self, column):
+		text_left = self.hex_x(self.line_width) + self.character_width
+		return text_left + self.character_width * column
 
 	def switch_view(self):
 		if self.cursor_hexmode == self.TEXT:
@@ -184,23 +228,16 @@ class HexView(QtGui.QWidget):
 		if self.data_buffer.is_readonly():
 			return
 
-		num_rows = self.number_of_lines_on_screen()
-		view, length = self.data_buffer.read(self.line_width * self.data_line,
-		                                     self.line_width * num_rows)
-		view_pos = ((self.cursor_line - self.data_line) * self.line_width
-			           + self.cursor_column)
-		for b in byte_string:
-			try:
-				view[view_pos] = b
-				self.data_buffer.set_modified()
-			except:
-				# We might be outside the file. This is not an error.
-				# Just ignore these bytes.
-				pass
-			view_pos += 1
+		# Bytes outside the file are ignored by the buffer.
+		self.data_buffer.write(self.get_cursor_position(), byte_string)
+		self.data_edited()
 
 		self.update()
 
+	def data_edited(self):
+		if self.main_window is not None:
+			self.main_window.data_edited()
+
 # PRIVATE METHODS
 
 	def dragEnterEvent(self, e):
@@ -231,14 +268,37 @@ class HexView(QtGui.QWidget):
 
 	def paintEvent_main(self, event):
 		painter = QtGui.QPainter(self)
+		self.paint(painter)
+		if self.first_paint_callback is not None:
+			callback = self.first_paint_callback
+			self.first_paint_callback = None
+			callback()
+
+	def paint(self, painter):
+		# Paints the view with any painter, e.g. one for an image.
+		start_time = timeit.default_timer()
 		painter.setRenderHint(QtGui.QPainter.Antialiasing)
 		painter.setFont(self.font)
+		painter.setPen(self.text_color)
+
+		metrics = QFontMetricsF(painter.font())
+		self.character_width = metrics.width('0')
+		self.character_ascent = metrics.ascent()
 
 		if self.data_buffer:
 			# Number of lines that fit on screen.
 			num_rows = self.number_of_lines_on_screen()
-			view, length = self.data_buffer.read(self.line_width * self.data_line,
-			                                     self.line_width * num_rows)
+			data_pos = self.line_width * self.data_line
+			data_length = self.line_width * num_rows
+
+			# Painting should never wait for the disk. If the data is
+			# not in memory, the prefetcher repaints when it is.
+			self.prefetcher.notify(data_pos, data_length)
+			if not self.data_buffer.is_resident(data_pos, data_length):
+				painter.drawText(QPoint(5, self.line_height), "Loading...")
+				return
+
+			view, length = self.data_buffer.read(data_pos, data_length)
 
 			# Number of lines that are needed.
 			num_rows = length // self.line_width
@@ -247,75 +307,113 @@ class HexView(QtGui.QWidget):
 
 			for l in range(num_rows):
 				line = self.data_line + l
-				position_string = '0x%016X' % (self.line_width * line)
-				painter.drawText(QPoint(5, (l + 1) * self.line_height), position_string)
-
-				global_offset = line * self.line_width
-				for i in range(min(self.line_width, length - self.line_width * l)):
-					text_string = '.'
-					position = self.line_width * l + i
-					num = view[position]
-					# In Python 3.3, memoryviews return int. The following check
-					# is for compatibility with earlier versions.
-					if num.__class__ != int:
-						num = ord(view[position])
-
-					byte_string = '%02X' % num
-					byte = view[position:position + 1].tobytes()
-					text_string = self.bytes_to_string(byte)
-
-					selected = False
-					if i == self.cursor_column and line == self.cursor_line:
-						# We are at the data cursor.
-						selected = True
-					elif self.selection_start <= global_offset and \
-					                             global_offset < self.selection_end:
-						painter.setBackground(self.selection_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						byte_string += ' '
-
-					byte_point = QPoint(180 + 25*i, (l + 1) * self.line_height)
-					if selected and self.cursor_hexmode == self.HEX_LEFT:
-						painter.setBackground(self.cursor_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					elif selected and self.cursor_hexmode == self.TEXT:
-						painter.setBackground(self.cursor_disabled_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					painter.drawText(byte_point, byte_string[0])
-
-					byte_point = QPoint(180 + 25*i + 8, (l + 1) * self.line_height)
-					if selected and self.cursor_hexmode == self.HEX_RIGHT:
-						painter.setBackground(self.cursor_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					elif selected and self.cursor_hexmode == self.TEXT:
-						painter.setBackground(self.cursor_disabled_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					elif selected:
-						painter.setBackgroundMode(Qt.TransparentMode)
-						painter.setPen(self.text_color)
-
-					painter.drawText(byte_point, byte_string[1])
-
-					text_point = QPoint(600 + self.character_width*i,
-					                    (l + 1) * self.line_height)
-					if selected and self.cursor_hexmode == self.TEXT:
-						painter.setBackground(self.cursor_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					elif selected:
-						painter.setBackground(self.cursor_disabled_background_brush)
-						painter.setBackgroundMode(Qt.OpaqueMode)
-						painter.setPen(self.cursor_color)
-					painter.drawText(text_point, text_string)
-
-					painter.setPen(self.text_color)
-					painter.setBackgroundMode(Qt.TransparentMode)
-
-					global_offset += 1
+				row_length = min(self.line_width, length - self.line_width * l)
+				row = view[self.line_width * l:self.line_width * l + row_length]
+				image = self.render_row(line, row, metrics)
+				position = QPointF(0, l * self.line_height)
+				if self.have_gui:
+					painter.drawPixmap(position, image)
+				else:
+					painter.drawImage(position, image)
+
+		self.paint_time = timeit.default_timer() - start_time
+		session_metrics.record('paint', self.paint_time)
+
+	def render_row(self, line, row, metrics):
+		# Returns an image of the row, from the cache if possible. The
+		# cache key contains everything that affects how the row looks.
+		row_offset = line * self.line_width
+		row_bytes = row.tobytes()
+		if line == self.cursor_line and self.cursor_column < len(row_bytes):
+			cursor = (self.cursor_column, self.cursor_hexmode)
+		else:
+			cursor = None
+		selection = (max(self.selection_start, row_offset),
+		             min(self.selection_end, row_offset + len(row_bytes)))
+		if selection[1] <= selection[0]:
+			selection = None
+		key = (row_offset, row_bytes, cursor, selection, self.character_width)
+
+		image = self.row_cache.get(key)
+		if image is not None:
+			self.row_cache.move_to_end(key)
+			return image
+
+		# The image extends below the row to include descenders.
+		width = int(self.text_x(self.line_width) + self.character_width)
+		height = int(self.line_height + metrics.descent() + 1)
+		if self.have_gui:
+			# Pixmaps live on the display server, which makes drawing
+			# them cheap also over remote X.
+			image = QPixmap(width, height)
+		else:
+			image = QImage(width, height, QImage.Format_ARGB32_Premultiplied)
+		image.fill(Qt.transparent)
+		painter = QtGui.QPainter(image)
+		painter.setRenderHint(QtGui.QPainter.Antialiasing)
+		painter.setFont(self.font)
+		painter.setPen(self.text_color)
+		self.paint_row(painter, self.line_height, row_offset, row)
+		painter.end()
+
+		self.row_cache[key] = image
+		while len(self.row_cache) > self.row_cache_size:
+			self.row_cache.popitem(last=False)
+		return image
+
+	def paint_row(self, painter, y, row_offset, row):
+		# Each row is drawn with three calls; the selection and the
+		# cursor are drawn as overlays.
+		self.paint_selection(painter, y, row_offset, len(row))
+
+		painter.drawText(QPointF(5, y), '0x%016X' % row_offset)
+		painter.drawText(QPointF(self.hex_x(0), y), bytes_to_hex(row))
+		painter.drawText(QPointF(self.text_x(0), y), bytes_to_string(row))
+
+		if row_offset == self.cursor_line * self.line_width and \
+		   self.cursor_column < len(row):
+			self.paint_cursor(painter, y, row[self.cursor_column:
+			                                  self.cursor_column + 1])
+
+	def cell_rect(self, x, y, number_of_characters):
+		# The rectangle behind characters drawn at baseline y.
+		return QRectF(x, y - self.character_ascent,
+		              number_of_characters * self.character_width,
+		              self.line_height)
+
+	def paint_selection(self, painter, y, row_offset, row_length):
+		first = max(self.selection_start, row_offset) - row_offset
+		end = min(self.selection_end, row_offset + row_length) - row_offset
+		if end <= first:
+			return
+		brush = self.selection_background_brush
+		painter.fillRect(self.cell_rect(self.hex_x(first), y,
+		                                3 * (end - first)), brush)
+		painter.fillRect(self.cell_rect(self.text_x(first), y,
+		                                end - first), brush)
+
+	def paint_cursor(self, painter, y, byte):
+		hex_string = bytes_to_hex(byte)
+		column = self.cursor_column
+		enabled = self.cursor_background_brush
+		disabled = self.cursor_disabled_background_brush
+
+		if self.cursor_hexmode == self.HEX_LEFT:
+			brushes = [enabled, None, disabled]
+		elif self.cursor_hexmode == self.HEX_RIGHT:
+			brushes = [None, enabled, disabled]
+		else:
+			brushes = [disabled, disabled, enabled]
+		cells = [(self.hex_x(column), hex_string[0]),
+		         (self.hex_x(column) + self.character_width, hex_string[1]),
+		         (self.text_x(column), bytes_to_string(byte))]
+
+		painter.setPen(self.cursor_color)
+		for (x, text), brush in zip(cells, brushes):
+			if brush is not None:
+				painter.fillRect(self.cell_rect(x, y, 1), brush)
+				painter.drawText(QPointF(x, y), text)
+		painter.setPen(self.text_color)
 
 	def is_cursor_visible(self):
 		if self.cursor_line >= self.data_line and \
@@ -462,41 +560,35 @@ class HexView(QtGui.QWidget):
 			if self.data_buffer.is_readonly():
 				return
 
-			num_rows = self.number_of_lines_on_screen()
-			view, length = self.data_buffer.read(self.line_width * self.data_line,
-			                                     self.line_width * num_rows)
-
 			if self.cursor_hexmode == self.TEXT:
 				# TODO: Allow other encodings.
 				byte_string = event.text().encode('utf-8')
-				# To memoryview for Python 3.2 compatibility.
-				byte_string = memoryview(byte_string)
 				for i in range(len(byte_string)):
-					view_pos = ((self.cursor_line - self.data_line) * self.line_width
-					           + self.cursor_column)
-					view[view_pos] = byte_string[i]
+					self.data_buffer.write(self.get_cursor_position(),
+					                       byte_string[i:i + 1])
 					self.move_cursor_right()
 			else:
 				try:
 					input_digit = int(event.text(), 16)
-					view_pos = ((self.cursor_line - self.data_line) * self.line_width
-					           + self.cursor_column)
+					position = self.get_cursor_position()
+					# There is no byte to edit past the end of the data.
+					if position >= self.data_buffer.length():
+						return
+					old_byte = self.data_at_position(position, 1)[0]
 					if self.cursor_hexmode == self.HEX_LEFT:
-						new_byte = 16 * input_digit + (view[view_pos] & 0x0F)
-						view[view_pos] = new_byte
+						new_byte = 16 * input_digit + (old_byte & 0x0F)
+						self.data_buffer.write(position, bytes([new_byte]))
 						self.cursor_hexmode = self.HEX_RIGHT
 					elif self.cursor_hexmode == self.HEX_RIGHT:
-						new_byte = (view[view_pos] & 0xF0) + input_digit
-						view[view_pos] = new_byte
+						new_byte = (old_byte & 0xF0) + input_digit
+						self.data_buffer.write(position, bytes([new_byte]))
 						self.cursor_hexmode = self.HEX_LEFT
 						self.move_cursor_right()
 				except ValueError:
 					# The user may have entered an invalid hex digit.
 					# Not an error.
 					return
-
-			# Mark the buffer modified since last read.
-			self.data_buffer.set_modified()
+			self.data_edited()
 		else:
 			event.ignore()
 			return
@@ -514,11 +606,11 @@ class HexView(QtGui.QWidget):
 				break
 
 		for col in range(self.line_width):
-			if 180 + 25*col <= x and x <= 180 + 25*col + 20:
+			if self.hex_x(col) <= x and \
+			   x <= self.hex_x(col) + 2 * self.character_width:
 				new_col = col
 				break
-			if 600 + col*self.character_width <= x and \
-			   x <= 600 + (col+1)*self.character_width:
+			if self.text_x(col) <= x and x <= self.text_x(col + 1):
 				new_col = col
 				break
 
@@ -606,6 +698,27 @@ class Main(PMainWindow):
 
 		self.find_and_replace = None
 		self.data_types       = None
+		self.template_window  = None
+		self.hash_window      = None
+		self.export_thread    = None
+		self.metrics_window   = None
+		self.compare_window   = None
+		self.file_name        = None
+		# The file or device that the data is read from; file_name is
+		# None for drives.
+		self.data_file_name   = None
+
+		# Size and modification time of the open file, and hashes of its
+		# blocks, used to detect changes made by other programs.
+		self.file_signature = None
+		self.block_index    = None
+		self.index_thread   = None
+
+		# Entropy overview next to the scroll bar. Created when the first
+		# file is opened, if NumPy is installed.
+		self.overview = None
+		self.ui.actionDetect_Changes.setChecked(
+			self.settings.value("detect_changes", 'false') == 'true')
 
 		# Set up status bar
 		self.status_bar_position         = QLabel("")
@@ -621,8 +734,12 @@ class Main(PMainWindow):
 
 		# Set up scoll bar
 		self.ui.fileScrollBar.ignore_valueChanged = False
+		self.scroll_model = ScrollModel()
 
-		if pywin32_shell is None or ASADMIN in sys.argv:
+		# Only check that pywin32 is installed; it is imported when
+		# it is needed.
+		if importlib.util.find_spec('win32com') is None or \
+		   ASADMIN in sys.argv:
 			self.ui.actionElevate.setEnabled(False)
 
 		if ASADMIN in sys.argv:
@@ -638,13 +755,24 @@ class Main(PMainWindow):
 
 	@exception_handler
 	def closeEvent(self, event):
-		if self.ui.view.data_buffer is not None:
-			self.ui.view.data_buffer.flush()
+		self.flush_buffer()
 
 		if self.find_and_replace:
 			self.find_and_replace.close()
 		if self.data_types:
 			self.data_types.close()
+		if self.template_window:
+			self.template_window.close()
+		if self.hash_window:
+			self.hash_window.close()
+		if self.metrics_window:
+			self.metrics_window.close()
+		if self.compare_window:
+			self.compare_window.close()
+		if self.overview is not None:
+			self.overview.stop()
+		if self.export_thread is not None:
+			self.export_thread.cancel()
 		PMainWindow.closeEvent(self, event)
 
 	@exception_handler
@@ -652,49 +780,151 @@ class Main(PMainWindow):
 		if event.type() == QEvent.ActivationChange:
 			# Another window on the desktop has been
 			# activated or deactivated.
-			if self.ui.view.data_buffer is not None:
-				self.ui.view.data_buffer.flush()
+			self.flush_buffer()
 			self.status_bar_modified.setText("")
+			if self.isActiveWindow():
+				self.check_for_changes()
 			event.accept()
 		PMainWindow.changeEvent(self, event)
 
+	def flush_buffer(self):
+		# Writes the edits to the file. The size and modification time
+		# after our own writes are remembered, so that they are not
+		# taken for changes made by other programs.
+		data_buffer = self.ui.view.data_buffer
+		if data_buffer is None:
+			return
+		written = data_buffer.is_modified()
+		data_buffer.flush()
+		if written:
+			self.file_written()
+
+	def file_written(self):
+		self.file_signature = self.current_file_signature()
+
+	def current_file_signature(self):
+		if self.data_file_name is None:
+			return None
+		try:
+			return file_signature(self.data_file_name)
+		except OSError:
+			return None
+
+	def start_index_thread(self):
+		if self.index_thread is not None:
+			self.index_thread.cancel()
+			self.index_thread = None
+		# Buffers that do not refresh single ranges are refreshed as a
+		# whole, so they are not hashed. Nor are drives whose size and
+		# modification time can not be read.
+		if self.file_signature is None or \
+		   not self.ui.actionDetect_Changes.isChecked() or \
+		   not self.ui.view.data_buffer.refreshes_ranges():
+			return
+		from modules.block_index import IndexThread
+		self.index_thread = IndexThread(
+			self.ui.view.data_buffer, self.data_file_name, self.block_index,
+			None,
+			lambda *args: invoke_in_main_thread(self.index_finished, *args))
+		self.index_thread.start()
+
+	def check_for_changes(self):
+		# Cheap check of the size and modification time. If they have
+		# changed, the blocks are hashed again to find what to read
+		# again, when enabled; otherwise the whole buffer is refreshed.
+		if self.data_file_name is None or self.index_thread is not None:
+			return
+		signature = self.current_file_signature()
+		if signature is None or signature == self.file_signature:
+			return
+		self.file_signature = signature
+		if self.block_index is not None and \
+		   self.ui.actionDetect_Changes.isChecked() and \
+		   self.ui.view.data_buffer.refreshes_ranges():
+			self.start_index_thread()
+			return
+		self.ui.view.data_buffer.refresh()
+		self.data_changed()
+		self.statusBar().showMessage("The file has changed.")
+
+	def data_changed(self):
+		# The open file was changed by another program.
+		if self.overview is not None:
+			self.overview.open(self.ui.view, self.file_name)
+		self.data_edited()
+		self.update_scrollbar_range()
+		self.ui.view.update()
+
+	def data_edited(self):
+		# Windows that keep decoded data read it again; the others read
+		# the data when the cursor moves.
+		if self.template_window:
+			self.template_window.refresh()
+
+	def index_finished(self, index_thread, changed_ranges, error):
+		if index_thread is not self.index_thread:
+			return
+		self.index_thread = None
+		if error is not None:
+			self.statusBar().showMessage("Could not index file: " + error)
+			return
+		self.block_index = index_thread.index
+		if changed_ranges:
+			self.ui.view.data_buffer.refresh(changed_ranges)
+			self.data_changed()
+			self.statusBar().showMessage(
+				"The file has changed; {0} MB were read again.".format(
+					len(changed_ranges) * self.block_index.block_length
+					// 1024**2))
+
 	def report_error(self, error, title="Error"):
 		 QtGui.QMessageBox.critical(self, title, error)
 
 	@exception_handler
 	def resizeEvent(self, event):
 		PMainWindow.resizeEvent(self, event)
+		if self.ui.view.data_buffer is not None:
+			self.update_scrollbar_range()
+
+	def update_scrollbar_range(self):
+		self.scroll_model.set_range(self.ui.view.number_of_rows() - 10,
+		                            self.ui.view.number_of_lines_on_screen())
+		self.ui.fileScrollBar.ignore_valueChanged = True
+		self.ui.fileScrollBar.setMinimum(0)
+		self.ui.fileScrollBar.setMaximum(self.scroll_model.maximum())
+		self.ui.fileScrollBar.setPageStep(self.scroll_model.page_step())
+		self.ui.fileScrollBar.ignore_valueChanged = False
+		self.update_line(self.ui.view.data_line)
 
 	@exception_handler
 	def open_file(self, file_name, is_drive=False):
-		if is_drive:
+		if is_drive and os.name == 'nt':
 			buffer = DriveBuffer(file_name)
+		elif is_drive:
+			buffer = BlockDeviceBuffer(file_name)
 		else:
-			buffer = FileBuffer(file_name, readonly=False)
+			# Edits are kept in memory until they are flushed, and
+			# then written in place.
+			buffer = EditBuffer(MmapFileBuffer(file_name, readonly=False))
 		self.ui.view.open(buffer)
+		self.file_name = None if is_drive else file_name
+		self.data_file_name = file_name
+		self.file_signature = self.current_file_signature()
+		self.block_index = None
+		self.start_index_thread()
+
+		if self.overview is None and \
+		   importlib.util.find_spec('numpy') is not None:
+			from modules.overview import OverviewStrip
+			self.overview = OverviewStrip(self.ui.centralwidget, self)
+			self.ui.horizontalLayout.insertWidget(1, self.overview)
+		if self.overview is not None:
+			self.overview.open(self.ui.view, self.file_name)
 
 		self.ui.fileScrollBar.setEnabled(True)
 		self.ui.actionFind_Replace.setEnabled(True)
-		try:
-			self.ui.fileScrollBar.setMinimum(0)
-			self.ui.fileScrollBar.setMaximum(max(0, self.ui.view.number_of_rows() - 10))
-			self.ui.fileScrollBar.setPageStep(self.ui.view.number_of_lines_on_screen())
-
-			self.scrollbar_factor = None
-			self.ui.fileScrollBar.setEnabled(True)
-		except OverflowError:
-			# File is so large we cannot use the scroll bar.
-			#self.ui.fileScrollBar.setEnabled(False)
-
-			wanted_size = self.ui.view.number_of_rows() - 10
-			self.scrollbar_factor = wanted_size // 1000**3
-			self.ui.fileScrollBar.setMaximum(wanted_size // self.scrollbar_factor)
-			self.ui.fileScrollBar.setPageStep(
-				self.ui.view.number_of_lines_on_screen() // self.scrollbar_factor)
-
-			self.statusBar().showMessage(
-				"Warning: Scrollbar not exact due to Qt limitation.")
-			self.ui.fileScrollBar.setEnabled(True)
+		self.ui.actionHash.setEnabled(True)
+		self.update_scrollbar_range()
 
 		# Set the file size in the status bar.
 		file_size = self.ui.view.data_buffer.length()
@@ -726,9 +956,36 @@ class Main(PMainWindow):
 			self.settings.setValue("default_dir", dir)
 			self.open_file(file_name)
 
+	@Slot()
+	@exception_handler
+	def on_actionCompare_triggered(self):
+		default_dir = self.settings.value("default_dir", '')
+		filter = "All files (*)"
+		(file_names, mask) = QtGui.QFileDialog.getOpenFileNames(
+			self, "Choose a file to compare with, or two files",
+			default_dir, filter)
+		if len(file_names) == 1 and self.file_name is not None:
+			file_names = [self.file_name] + file_names
+		if len(file_names) != 2:
+			if file_names:
+				self.report_error("Choose one file to compare with the open "
+				                  "file, or two files.", "Compare")
+			return
+
+		# The open file may have unsaved edits.
+		self.flush_buffer()
+		from modules.compare_window import CompareWindow
+		if self.compare_window:
+			self.compare_window.close()
+		self.compare_window = CompareWindow(self, company_name, software_name,
+		                                    HexView, file_names[0],
+		                                    file_names[1])
+		self.compare_window.show()
+
 	@Slot()
 	@exception_handler
 	def on_actionOpen_Drive_triggered(self):
+		from modules.drives import DriveDialog
 		self.drive_dialog = DriveDialog(self, company_name, software_name)
 		self.drive_dialog.set_view(self.ui.view)
 		self.drive_dialog.exec_()
@@ -773,6 +1030,7 @@ class Main(PMainWindow):
 	@exception_handler
 	def on_actionFind_Replace_triggered(self):
 		if not self.find_and_replace:
+			from modules.find_and_replace import FindAndReplace
 			self.find_and_replace = FindAndReplace(self, company_name, software_name)
 		self.find_and_replace.set_view(self.ui.view)
 		self.find_and_replace.show()
@@ -781,16 +1039,44 @@ class Main(PMainWindow):
 	@exception_handler
 	def on_actionData_Types_triggered(self):
 		if not self.data_types:
+			from modules.data_types import DataTypes
 			self.data_types = DataTypes(self, company_name, software_name)
 		self.data_types.set_view(self.ui.view)
 		self.data_types.show()
 		self.data_types.update()
 
+	@Slot()
+	@exception_handler
+	def on_actionTemplates_triggered(self):
+		if not self.template_window:
+			from modules.template_window import TemplateWindow
+			self.template_window = TemplateWindow(self, company_name,
+			                                      software_name)
+		self.template_window.set_view(self.ui.view)
+		self.template_window.show()
+		self.template_window.follow_cursor()
+
+	@Slot()
+	@exception_handler
+	def on_actionDetect_Changes_triggered(self):
+		enabled = self.ui.actionDetect_Changes.isChecked()
+		self.settings.setValue("detect_changes", 'true' if enabled else 'false')
+		self.start_index_thread()
+
+	@Slot()
+	@exception_handler
+	def on_actionMetrics_triggered(self):
+		if not self.metrics_window:
+			from modules.metrics_window import MetricsWindow
+			self.metrics_window = MetricsWindow(self, company_name, software_name)
+		self.metrics_window.show()
+
 	@Slot()
 	@exception_handler
 	def on_actionElevate_triggered(self):
-		if pywin32_shell is not None:
+		if importlib.util.find_spec('win32com') is not None:
 			if ASADMIN not in sys.argv:
+				import win32com.shell.shell as pywin32_shell
 				script = os.path.abspath(sys.argv[0])
 				params = ' '.join(["\"" + script + "\""] + sys.argv[1:] + [ASADMIN])
 				print("Elevating...")
@@ -808,15 +1094,70 @@ class Main(PMainWindow):
 	@Slot()
 	@exception_handler
 	def on_actionCopy_triggered(self):
-		length = self.ui.view.selection_end - self.ui.view.selection_start
-		data = self.ui.view.data_at_position(self.ui.view.selection_start,
-		                                     length)
-		byte_data = data[:length].tobytes()
-		if self.ui.view.cursor_hexmode == self.ui.view.TEXT:
-			string_data = self.ui.view.bytes_to_string(byte_data)
-		else:
-			string_data = ''.join(["%02X " % x for x in byte_data]).strip()
+		view = self.ui.view
+		string_data, complete = export.copy_text(
+			view.data_buffer, view.selection_start, view.selection_end,
+			view.cursor_hexmode == view.TEXT)
 		self.clipboard.setText(string_data)
+		if not complete:
+			self.statusBar().showMessage(
+				"Copied the first {0} MB of the selection. Use Export "
+				"Selection to save all of it.".format(
+					export.COPY_MAX_LENGTH // 1024**2))
+
+	@Slot()
+	@exception_handler
+	def on_actionExport_Selection_triggered(self):
+		view = self.ui.view
+		file_name, selected_filter = QFileDialog.getSaveFileName(
+			self, "Export Selection", "",
+			"Binary (*.bin);;Hexadecimal text (*.txt)")
+		if not file_name:
+			return
+		if self.file_name is not None and \
+		   os.path.abspath(file_name) == os.path.abspath(self.file_name):
+			raise Exception("Can not export to the file being read.")
+
+		if self.export_thread is not None:
+			self.export_thread.cancel()
+		# The thread may read the data from disk.
+		self.flush_buffer()
+		self.export_thread = export.ExportThread(
+			view.data_buffer, view.selection_start, view.selection_end,
+			file_name, selected_filter.startswith("Hex"),
+			lambda *args: invoke_in_main_thread(self.export_progress_changed,
+			                                    *args),
+			lambda *args: invoke_in_main_thread(self.export_finished, *args))
+		self.export_thread.start()
+		self.statusBar().showMessage("Exporting...")
+
+	def export_progress_changed(self, export_thread, fraction,
+	                            bytes_per_second):
+		if export_thread is self.export_thread:
+			self.statusBar().showMessage("Exporting... {0:.0f}%".format(
+				100 * fraction))
+
+	def export_finished(self, export_thread, completed, error):
+		if export_thread is not self.export_thread:
+			return
+		self.export_thread = None
+		if error is not None:
+			self.statusBar().clearMessage()
+			self.report_error(error, "Export Selection")
+		elif completed:
+			self.statusBar().showMessage("Exported {0} bytes to {1}.".format(
+				export_thread.end_pos - export_thread.start_pos,
+				os.path.basename(export_thread.file_name)))
+
+	@Slot()
+	@exception_handler
+	def on_actionHash_triggered(self):
+		if not self.hash_window:
+			from modules.hash_window import HashWindow
+			self.hash_window = HashWindow(self, company_name, software_name)
+		self.hash_window.set_view(self.ui.view)
+		self.hash_window.show()
+		self.hash_window.start()
 
 	@Slot()
 	@exception_handler
@@ -827,37 +1168,53 @@ class Main(PMainWindow):
 			self.ui.fileScrollBar.ignore_valueChanged = False
 			return
 
-		if self.scrollbar_factor is None:
-			# Scroll bar is exact.
-			self.ui.view.set_line(self.ui.fileScrollBar.value())
+		line = self.scroll_model.set_value(self.ui.fileScrollBar.value())
+		self.ui.view.set_line(line)
+
+	@Slot(int)
+	@exception_handler
+	def on_fileScrollBar_actionTriggered(self, action):
+		# Line and page steps move exactly, also when the scroll bar is
+		# too coarse to show every line.
+		view = self.ui.view
+		if action == QAbstractSlider.SliderSingleStepAdd:
+			lines = 1
+		elif action == QAbstractSlider.SliderSingleStepSub:
+			lines = -1
+		elif action == QAbstractSlider.SliderPageStepAdd:
+			lines = view.number_of_lines_on_screen()
+		elif action == QAbstractSlider.SliderPageStepSub:
+			lines = -view.number_of_lines_on_screen()
 		else:
-			# There are too many lines for the scrollbar to show exactly.
-			value = self.ui.fileScrollBar.value()
-			self.ui.view.set_line(value * self.scrollbar_factor)
+			return
+		self.scroll_model.set_line(view.data_line)
+		value = self.scroll_model.step(lines)
+		# The value may not change if the scroll bar is coarse.
+		view.set_line(self.scroll_model.line)
+		self.ui.fileScrollBar.setSliderPosition(value)
 
 	@exception_handler
 	def update_line(self, line):
 
-		if self.scrollbar_factor is None:
-			# Scroll bar is exact.
-			if self.ui.fileScrollBar.value() != line:
-				self.ui.fileScrollBar.ignore_valueChanged = True
-				self.ui.fileScrollBar.setValue(line)
-		else:
-			# There are too many lines for the scrollbar to show exactly.
-			scrollbar_pos = line // self.scrollbar_factor
-			if self.ui.fileScrollBar.value() != scrollbar_pos:
-				self.ui.fileScrollBar.ignore_valueChanged = True
-				self.ui.fileScrollBar.setValue(scrollbar_pos)
+		scrollbar_pos = self.scroll_model.set_line(line)
+		if self.ui.fileScrollBar.value() != scrollbar_pos:
+			self.ui.fileScrollBar.ignore_valueChanged = True
+			self.ui.fileScrollBar.setValue(scrollbar_pos)
 
 		if self.data_types:
 			self.data_types.update()
+		if self.template_window:
+			self.template_window.follow_cursor()
+		if self.overview is not None:
+			self.overview.update()
 
 		if self.ui.view.selection_start >= 0 and \
 		   self.ui.view.selection_end >= 0:
 			self.ui.actionCopy.setEnabled(True)
+			self.ui.actionExport_Selection.setEnabled(True)
 		else:
 			self.ui.actionCopy.setEnabled(False)
+			self.ui.actionExport_Selection.setEnabled(False)
 
 		position = self.ui.view.get_cursor_position()
 		file_size = self.ui.view.data_buffer.length()
@@ -874,18 +1231,45 @@ class Main(PMainWindow):
 ASADMIN = '--asadmin'
 
 
+def print_startup_phases():
+	print("Startup:")
+	for i in range(1, len(startup_phases)):
+		name, end_time = startup_phases[i]
+		print("  {0:<16} {1:8.1f} ms".format(
+			name, 1000 * (end_time - startup_phases[i - 1][1])))
+	print("  {0:<16} {1:8.1f} ms".format(
+		"total", 1000 * (startup_phases[-1][1] - startup_phases[0][1])))
+
+
 def main():
 	app = QtGui.QApplication(sys.argv)
+	startup_phases.append(('application', timeit.default_timer()))
 	window = Main()
+	startup_phases.append(('main window', timeit.default_timer()))
 	window.show()
+	startup_phases.append(('show', timeit.default_timer()))
 
 	# Parse command line.
 	parser = argparse.ArgumentParser()
 	parser.add_argument('file', type=str, nargs='?')
 	parser.add_argument('--drive', action='store_true')
+	parser.add_argument('--profile-startup', action='store_true',
+	                    help='Print the time spent in each phase of startup.')
+	parser.add_argument('--metrics', type=str, default=None, metavar='FILE',
+	                    help='Write read, cache and paint metrics as JSON '
+	                         'to FILE on exit.')
 	parser.add_argument(ASADMIN, action='store_true')
 	args = parser.parse_args()
 
+	if args.profile_startup:
+		# Opening a file repaints the view, so the hook has to be in
+		# place first. The time to open the file is then part of the
+		# first paint.
+		def first_paint():
+			startup_phases.append(('first paint', timeit.default_timer()))
+			print_startup_phases()
+		window.ui.view.first_paint_callback = first_paint
+
 	if args.file is not None:
 		window.open_file(args.file, args.drive)
 
@@ -895,7 +1279,10 @@ def main():
 	app.setWindowIcon(icon)
 	window.setWindowIcon(icon)
 
-	sys.exit(app.exec_())
+	result = app.exec_()
+	if args.metrics is not None:
+		session_metrics.dump(args.metrics)
+	sys.exit(result)
 
 if __name__ == "__main__":
 	main()
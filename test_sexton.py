@@ -1,13 +1,29 @@
 #!/usr/bin/python3
 # -*- coding: utf-8 -*-
 
+import array
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
 import unittest
 import sys
+import zlib
 
 from PySide import QtCore, QtGui
 
 import sexton
-from modules.data_buffer import TestBuffer
+from modules import block_index, byte_format, compare, entropy, export, \
+                    find_and_replace, hashing, replace, search, templates, \
+                    typed_array
+from modules.metrics import metrics
+from modules.scroll_model import ScrollModel, SCROLLBAR_MAXIMUM
+from modules.data_buffer import TestBuffer, EditBuffer, FileBuffer, \
+                                MmapFileBuffer, PageCache, BlockDeviceBuffer, \
+                                open_copy, read_chunks
 
 # Create an application without GUI support. This allows
 # tests to be run without an X server.
@@ -40,5 +56,885 @@ class TestHexView(unittest.TestCase):
 		self.assertEqual(data_buffer.buffer[4], ord(b'e'))
 		self.assertEqual(data_buffer.buffer[5], ord(b'r'))
 
+	def test_hex_digit_at_end(self):
+		data_buffer = TestBuffer(100)
+		self.view.open(data_buffer)
+		self.view.set_cursor_position(100)
+		self.view.cursor_hexmode = self.view.HEX_LEFT
+		event = QtGui.QKeyEvent(QtCore.QEvent.KeyPress, QtCore.Qt.Key_A,
+		                        QtCore.Qt.NoModifier, "a")
+		# Typing past the end of the data is ignored.
+		self.view.keyPressEvent(event)
+		self.assertEqual(self.view.cursor_hexmode, self.view.HEX_LEFT)
+
+class TestByteFormat(unittest.TestCase):
+
+	def test_bytes_to_hex(self):
+		# Same as formatting every byte on its own.
+		data = os.urandom(1000)
+		for length in [1, 2, 31, 32, 1000]:
+			for separator in ['', ' ', ', ', '\u00b7']:
+				self.assertEqual(
+					byte_format.bytes_to_hex(data[:length], separator),
+					separator.join(['%02X' % byte for byte in data[:length]]))
+		self.assertEqual(byte_format.bytes_to_hex(b''), '')
+
+class TestMatchListModel(unittest.TestCase):
+
+	def test_add_matches(self):
+		model = find_and_replace.MatchListModel()
+		model.clear(['abc', 'de'])
+		model.add_matches(array.array('Q', [16, 300]),
+		                  array.array('Q', [19, 302]),
+		                  array.array('L', [0, 1]))
+		model.add_matches(array.array('Q', [4096]),
+		                  array.array('Q', [4099]),
+		                  array.array('L', [0]))
+		self.assertEqual(model.rowCount(), 3)
+		self.assertEqual(model.data(model.index(1)),
+		                 "0x000000000000012C   2 bytes   de")
+		self.assertEqual(model.starts[2], 4096)
+		model.clear()
+		self.assertEqual(model.rowCount(), 0)
+
+	def test_without_pattern_indices(self):
+		model = find_and_replace.MatchListModel()
+		model.add_matches(array.array('Q', [1]), array.array('Q', [5]),
+		                  array.array('L'))
+		self.assertEqual(model.data(model.index(0)),
+		                 "0x0000000000000001   4 bytes")
+
+class TestMmapFileBuffer(unittest.TestCase):
+
+	def setUp(self):
+		self.data = bytes(range(256)) * 1024
+		handle, self.file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(self.data)
+
+	def tearDown(self):
+		os.unlink(self.file_name)
+
+	def test_read(self):
+		data_buffer = MmapFileBuffer(self.file_name)
+		self.assertEqual(data_buffer.length(), len(self.data))
+		view, length = data_buffer.read(1000, 100)
+		self.assertEqual(length, 100)
+		self.assertEqual(view[:length].tobytes(), self.data[1000:1100])
+		# Reading past the end of the file is truncated.
+		view, length = data_buffer.read(len(self.data) - 10, 100)
+		self.assertEqual(length, 10)
+		self.assertEqual(view[:length].tobytes(), self.data[-10:])
+
+	def test_read_windowed(self):
+		data_buffer = MmapFileBuffer(self.file_name, window_max_length=65536)
+		for pos in [200000, 10, 150000, len(self.data) - 5000]:
+			view, length = data_buffer.read(pos, 4096)
+			self.assertEqual(view[:length].tobytes(),
+			                 self.data[pos:pos + length])
+
+	def test_refresh(self):
+		for buffer_class in [MmapFileBuffer, FileBuffer]:
+			data_buffer = buffer_class(self.file_name)
+			data_buffer.read(1000, 10)
+			with open(self.file_name, 'r+b') as f:
+				f.seek(1000)
+				f.write(b'Petter')
+				f.truncate(2000)
+			data_buffer.refresh([(1000, 6)])
+			self.assertTrue(data_buffer.refreshes_ranges())
+			self.assertEqual(data_buffer.length(), 2000)
+			view, length = data_buffer.read(1000, 10)
+			self.assertEqual(view[:6].tobytes(), b'Petter')
+			with open(self.file_name, 'wb') as f:
+				f.write(self.data)
+
+	def test_write(self):
+		data_buffer = MmapFileBuffer(self.file_name, readonly=False)
+		data_buffer.write(10, b'Petter')
+		view, length = data_buffer.read(8, 10)
+		self.assertEqual(view[2:8].tobytes(), b'Petter')
+		data_buffer.close()
+		with open(self.file_name, 'rb') as f:
+			self.assertEqual(f.read(16)[10:], b'Petter')
+
+	def test_open_write_protected(self):
+		os.chmod(self.file_name, 0o444)
+		if os.access(self.file_name, os.W_OK):
+			self.skipTest("The file is writable anyway (running as root).")
+		data_buffer = MmapFileBuffer(self.file_name, readonly=False)
+		self.assertTrue(data_buffer.is_readonly())
+		self.assertEqual(data_buffer.read(0, 4)[0][:4].tobytes(),
+		                 self.data[:4])
+
+	def test_prefetch_while_remapping(self):
+		data_buffer = MmapFileBuffer(self.file_name, window_max_length=65536)
+		# Only the start of the file has been read.
+		self.assertTrue(data_buffer.is_resident(0, 1000))
+		self.assertFalse(data_buffer.is_resident(0, len(self.data)))
+		data_buffer.prefetch(150000, 70000)
+		self.assertTrue(data_buffer.is_resident(131072, 131072))
+		# Changed ranges have to be read again.
+		data_buffer.refresh([(140000, 10)])
+		self.assertFalse(data_buffer.is_resident(131072, 10))
+		self.assertTrue(data_buffer.is_resident(196608, 10))
+		stopped = threading.Event()
+		errors = []
+		def prefetch():
+			try:
+				while not stopped.is_set():
+					data_buffer.prefetch(100000, 1000)
+			except Exception as err:
+				errors.append(err)
+		thread = threading.Thread(target=prefetch)
+		thread.start()
+		for i in range(200):
+			pos = (i * 70001) % (len(self.data) - 1000)
+			view, length = data_buffer.read(pos, 1000)
+			self.assertEqual(view[:length].tobytes(),
+			                 self.data[pos:pos + length])
+		stopped.set()
+		thread.join()
+		self.assertEqual(errors, [])
+
+	def test_open_copy(self):
+		data_buffer = MmapFileBuffer(self.file_name)
+		with open_copy(data_buffer) as copy:
+			self.assertIsNot(copy, data_buffer)
+			self.assertEqual(copy.read(0, 4)[0][:4].tobytes(), self.data[:4])
+		self.assertTrue(copy.file.closed)
+		self.assertFalse(data_buffer.file.closed)
+		# Buffers that can not be opened again are used directly.
+		test_buffer = TestBuffer(10)
+		with open_copy(test_buffer) as copy:
+			self.assertIs(copy, test_buffer)
+
+class TestBlockDeviceBuffer(unittest.TestCase):
+
+	def setUp(self):
+		# A sparse image stands in for a disk.
+		self.size = 2 * 1024**3
+		handle, self.file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.truncate(self.size)
+			f.seek(self.size // 2 + 1000)
+			f.write(b'Petter')
+			f.seek(self.size - 3)
+			f.write(b'end')
+
+	def tearDown(self):
+		os.unlink(self.file_name)
+
+	def check_read(self, data_buffer):
+		self.assertEqual(data_buffer.length(), self.size)
+		view, length = data_buffer.read(self.size // 2 + 1000, 6)
+		self.assertEqual(bytes(view[:length]), b'Petter')
+		view, length = data_buffer.read(self.size - 3, 100)
+		self.assertEqual(bytes(view[:length]), b'end')
+		view, length = data_buffer.read(0, 4)
+		self.assertEqual(bytes(view[:length]), bytes(4))
+
+	def test_read(self):
+		self.check_read(BlockDeviceBuffer(self.file_name))
+
+	def test_read_without_direct_io(self):
+		data_buffer = BlockDeviceBuffer(self.file_name, direct=False)
+		self.assertFalse(data_buffer.direct)
+		self.check_read(data_buffer)
+		# Copies are opened the same way.
+		with open_copy(data_buffer) as copy:
+			self.assertFalse(copy.direct)
+			self.check_read(copy)
+
+class TestEditBuffer(unittest.TestCase):
+
+	def test_read_and_write(self):
+		data_buffer = EditBuffer(TestBuffer(1000))
+		data_buffer.write(10, b'abc')
+		data_buffer.write(20, b'def')
+		# Overlapping and adjacent edits are merged.
+		data_buffer.write(12, b'XYZ')
+		data_buffer.write(23, b'g')
+		self.assertEqual(data_buffer.piece_starts, [10, 20])
+		self.assertEqual(data_buffer.edited_bytes(), 9)
+		# Writes past the end are ignored.
+		data_buffer.write(998, b'hij')
+
+		view, length = data_buffer.read(5, 20)
+		self.assertEqual(view[:length].tobytes(),
+		                 b'\0' * 5 + b'abXYZ' + b'\0' * 5 + b'defg' + b'\0')
+		self.assertTrue(data_buffer.is_modified())
+		# The underlying buffer is unchanged until flushed.
+		self.assertEqual(data_buffer.data_buffer.buffer[10], 0)
+		data_buffer.flush()
+		self.assertFalse(data_buffer.is_modified())
+		self.assertEqual(bytes(data_buffer.data_buffer.buffer[10:24]),
+		                 b'abXYZ\0\0\0\0\0defg')
+		self.assertEqual(bytes(data_buffer.data_buffer.buffer[998:]), b'hi')
+
+	def test_sequential_writes(self):
+		data_buffer = EditBuffer(TestBuffer(1000))
+		data_buffer.write(100, b'a')
+		piece = data_buffer.pieces[0]
+		for i in range(1, 100):
+			data_buffer.write(100 + i, b'b')
+		# Appending extends the piece in place.
+		self.assertIs(data_buffer.pieces[0], piece)
+		self.assertEqual(data_buffer.piece_starts, [100])
+		# A piece that starts where the data ends is kept.
+		data_buffer.write(99, b'c')
+		self.assertEqual(data_buffer.piece_starts, [99, 100])
+		# Overwriting two pieces merges them.
+		data_buffer.write(99, b'de')
+		self.assertEqual(data_buffer.piece_starts, [99])
+		view, length = data_buffer.read(98, 103)
+		self.assertEqual(view[:length].tobytes(),
+		                 b'\0de' + b'b' * 99 + b'\0')
+
+	def test_flush_in_place(self):
+		data = bytes(range(256)) * 4096
+		handle, file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(data)
+		try:
+			for buffer_class in [FileBuffer, MmapFileBuffer]:
+				data_buffer = EditBuffer(buffer_class(file_name, readonly=False))
+				data_buffer.write(700000, b'Petter')
+				data_buffer.flush()
+				view, length = data_buffer.read(700000, 6)
+				self.assertEqual(view[:length].tobytes(), b'Petter')
+				del data_buffer
+				with open(file_name, 'rb') as f:
+					new_data = f.read()
+				# Only the edited bytes have changed.
+				self.assertEqual(len(new_data), len(data))
+				self.assertEqual(new_data[:700000], data[:700000])
+				self.assertEqual(new_data[700006:], data[700006:])
+		finally:
+			os.unlink(file_name)
+
+
+class TestPageCache(unittest.TestCase):
+
+	def setUp(self):
+		self.data = bytes(range(256)) * 1000
+		self.reads = []
+
+	def read_function(self, pos, length):
+		self.reads.append((pos, length))
+		return self.data[pos:pos + length]
+
+	def test_read_into(self):
+		cache = PageCache(self.read_function, block_length=1000,
+		                  max_memory=10000)
+		target = bytearray(2500)
+		self.assertEqual(cache.read_into(target, 1500, 2500), 2500)
+		self.assertEqual(bytes(target), self.data[1500:4000])
+		# The three missing blocks are read with a single call.
+		self.assertEqual(self.reads, [(1000, 3000)])
+		self.assertEqual(cache.misses, 3)
+
+		# Resident data is served without reading.
+		cache.read_into(target, 2000, 1000)
+		self.assertEqual(len(self.reads), 1)
+		self.assertEqual(cache.hits, 1)
+
+	def test_eviction(self):
+		cache = PageCache(self.read_function, block_length=1000,
+		                  max_memory=3000)
+		target = bytearray(1000)
+		for pos in [0, 1000, 2000, 0, 3000]:
+			cache.read_into(target, pos, 1000)
+		self.assertEqual(cache.memory_usage(), 3000)
+		# Block 1 was the least recently used.
+		self.assertFalse(cache.is_resident(1000, 1))
+		self.assertTrue(cache.is_resident(0, 1))
+
+	def test_file_buffer(self):
+		data = self.data * 8
+		handle, file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(data)
+		try:
+			data_buffer = FileBuffer(file_name)
+			for pos in [1500000, 0, 1500000, 100000]:
+				view, length = data_buffer.read(pos, 4096)
+				self.assertEqual(view[:length].tobytes(),
+				                 data[pos:pos + length])
+			self.assertGreater(data_buffer.cache.hits, 0)
+		finally:
+			os.unlink(file_name)
+
+class TestMetrics(unittest.TestCase):
+
+	def test_file_buffer(self):
+		data = bytes(range(256)) * 8 * 1024
+		handle, file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(data)
+		try:
+			metrics.reset()
+			data_buffer = FileBuffer(file_name)
+			data_buffer.read(1500000, 100)
+			snapshot = metrics.snapshot()
+			self.assertEqual(snapshot['counters']['reads'], 1)
+			self.assertEqual(snapshot['counters']['bytes_read'], 100)
+			self.assertGreater(snapshot['counters']['io_bytes'], 0)
+			self.assertEqual(snapshot['latencies']['io_read']['count'],
+			                 snapshot['counters']['io_reads'])
+		finally:
+			os.unlink(file_name)
+
+	def test_mmap_file_buffer(self):
+		handle, file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(bytes(1000000))
+		try:
+			metrics.reset()
+			data_buffer = MmapFileBuffer(file_name)
+			data_buffer.prefetch(500000, 100)
+			snapshot = metrics.snapshot()
+			# There is no page cache to measure.
+			self.assertIsNone(snapshot['cache_hit_ratio'])
+			self.assertIn("Cache hit ratio: n/a", metrics.format())
+			self.assertEqual(snapshot['latencies']['io_read']['count'], 2)
+			data_buffer.close()
+		finally:
+			os.unlink(file_name)
+
+	def test_histogram(self):
+		metrics.reset()
+		for seconds in [0.5e-6, 3e-6, 3.5e-6, 1.0]:
+			metrics.record('test', seconds)
+		latency = metrics.snapshot()['latencies']['test']
+		self.assertEqual(latency['count'], 4)
+		self.assertEqual(latency['histogram_us'], [[1, 1], [4, 2], [2**20, 1]])
+
+class TestSearch(unittest.TestCase):
+
+	def setUp(self):
+		self.data_buffer = TestBuffer(10000)
+		for pos in [0, 999, 5000, 9996]:
+			self.data_buffer.buffer[pos:pos + 4] = b'abab'
+
+	def test_literal(self):
+		# Small chunks so that matches straddle chunk boundaries.
+		matches = list(search.find_all(self.data_buffer, b'abab',
+		                               chunk_length=1000))
+		self.assertEqual(matches, [(0, 4), (999, 1003), (5000, 5004),
+		                           (9996, 10000)])
+		# Overlapping occurrences are reported.
+		matches = list(search.find_all(self.data_buffer, b'ab',
+		                               start=999, end=1003))
+		self.assertEqual(matches, [(999, 1001), (1001, 1003)])
+
+	def test_regex(self):
+		regex = re.compile(b'(ab)+')
+		matches = list(search.find_all(self.data_buffer, regex,
+		                               chunk_length=1000, max_span=8))
+		self.assertEqual(matches, [(0, 4), (999, 1003), (5000, 5004),
+		                           (9996, 10000)])
+
+	def test_multi_pattern(self):
+		self.data_buffer.buffer[3000:3003] = b'xyz'
+		patterns = search.MultiPattern([b'ab', b'xyz', b'abab'])
+		matches = list(search.find_all(self.data_buffer, patterns,
+		                               start=990, end=3010, chunk_length=1000))
+		# The longest pattern is reported where several match.
+		self.assertEqual(matches, [(999, 1003, 2), (1001, 1003, 0),
+		                           (3000, 3003, 1)])
+
+	def test_thread(self):
+		found = []
+		results = []
+		thread = find_and_replace.SearchThread(
+			self.data_buffer, search.find_all, b'abab', [(0, 5000), (9000, 10000)],
+			None, lambda thread, starts, ends, indices: found.extend(starts),
+			None, lambda *args: results.append(args[1:]))
+		thread.run()
+		self.assertEqual(found, [0, 999, 9996])
+		self.assertEqual(results, [(3, None)])
+
+	def test_cancel(self):
+		positions = []
+		def progress(pos):
+			positions.append(pos)
+			return pos >= 2000
+		matches = list(search.find_all(self.data_buffer, b'abab',
+		                               chunk_length=1000, progress=progress))
+		self.assertEqual(matches, [(0, 4), (999, 1003)])
+		self.assertEqual(positions, [0, 1000, 2000])
+
+	def test_parallel(self):
+		data = bytes(range(256)) * 1000
+		handle, file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(data)
+		try:
+			data_buffer = MmapFileBuffer(file_name)
+			pattern = bytes(range(250, 256)) + bytes(range(0, 6))
+			expected = list(search.find_all(data_buffer, pattern))
+			self.assertEqual(len(expected), 999)
+			# The segment length is not a multiple of the period, so
+			# matches straddle segment boundaries.
+			matches = list(search.parallel_find_all(data_buffer, pattern,
+			                                        segment_length=10001,
+			                                        max_workers=2))
+			self.assertEqual(matches, expected)
+		finally:
+			os.unlink(file_name)
+
+class TestReplace(unittest.TestCase):
+
+	def setUp(self):
+		self.data_buffer = TestBuffer(10000)
+		for pos in [0, 999, 5000, 9996]:
+			self.data_buffer.buffer[pos:pos + 4] = b'abab'
+
+	def test_in_place(self):
+		data = bytes(self.data_buffer.buffer)
+		replacements = replace.replace_in_place(self.data_buffer, b'ba', b'xy')
+		# Overlapping matches are skipped.
+		self.assertEqual(replacements, 4)
+		self.assertEqual(bytes(self.data_buffer.buffer[999:1003]), b'axyb')
+		self.assertEqual(bytes(self.data_buffer.buffer),
+		                 data.replace(b'ba', b'xy'))
+		with self.assertRaises(ValueError):
+			replace.replace_in_place(self.data_buffer, b'b', b'xyz')
+
+	def test_in_place_new_match_across_chunks(self):
+		# Replacing the match straddling the chunk boundary at 1000 forms
+		# a new match, at 1000, which must not be replaced.
+		self.data_buffer.buffer[998:1002] = b'xabb'
+		data = bytes(self.data_buffer.buffer)
+		replacements = replace.replace_in_place(self.data_buffer, b'ab', b'ba',
+		                                        chunk_length=1000)
+		self.assertEqual(replacements, data.count(b'ab'))
+		self.assertEqual(bytes(self.data_buffer.buffer),
+		                 data.replace(b'ab', b'ba'))
+
+	def test_in_place_cancel(self):
+		# The matches before the position where the search was canceled
+		# have been replaced, the others not.
+		data = bytes(self.data_buffer.buffer)
+		replacements = replace.replace_in_place(
+			self.data_buffer, b'ab', b'xy', progress=lambda pos: pos >= 3000,
+			chunk_length=1000)
+		self.assertIsNone(replacements)
+		self.assertEqual(bytes(self.data_buffer.buffer[:2990]),
+		                 data[:2990].replace(b'ab', b'xy'))
+		self.assertEqual(bytes(self.data_buffer.buffer[5000:]), data[5000:])
+
+	def test_to_file(self):
+		data = bytes(self.data_buffer.buffer)
+		handle, file_name = tempfile.mkstemp()
+		try:
+			with os.fdopen(handle, 'wb') as output:
+				matches = search.find_all(self.data_buffer, b'ab',
+				                          chunk_length=1000)
+				replacements = replace.replace_to_file(self.data_buffer,
+				                                       matches, b'xyz', output)
+			self.assertEqual(replacements, 8)
+			with open(file_name, 'rb') as f:
+				self.assertEqual(f.read(), data.replace(b'ab', b'xyz'))
+		finally:
+			os.unlink(file_name)
+
+	def test_thread(self):
+		data = bytes(self.data_buffer.buffer)
+		handle, file_name = tempfile.mkstemp()
+		os.close(handle)
+		results = []
+		thread = replace.ReplaceThread(self.data_buffer, b'ab', b'xyz',
+		                               file_name, lambda *args: None,
+		                               lambda *args: results.append(args[1:]))
+		thread.run()
+		self.assertEqual(results, [(8, None)])
+		with open(file_name, 'rb') as f:
+			self.assertEqual(f.read(), data.replace(b'ab', b'xyz'))
+		# A canceled copy is removed.
+		thread = replace.ReplaceThread(self.data_buffer, b'ab', b'xyz',
+		                               file_name, lambda *args: None,
+		                               lambda *args: results.append(args[1:]))
+		thread.cancel()
+		thread.run()
+		self.assertEqual(results[1], (None, None))
+		self.assertFalse(os.path.exists(file_name))
+
+	def test_thread_in_place(self):
+		data = bytes(self.data_buffer.buffer)
+		results = []
+		thread = replace.ReplaceThread(self.data_buffer, b'ab', b'xy', None,
+		                               None,
+		                               lambda *args: results.append(args[1:]))
+		thread.run()
+		self.assertEqual(results, [(8, None)])
+		self.assertEqual(bytes(self.data_buffer.buffer),
+		                 data.replace(b'ab', b'xy'))
+
+	def test_match_length(self):
+		self.assertEqual(replace.match_length(b'abc'), 3)
+		self.assertEqual(replace.match_length(
+			search.MultiPattern([b'ab', b'cd'])), 2)
+		self.assertEqual(replace.match_length(
+			search.MultiPattern([b'ab', b'c'])), None)
+		self.assertEqual(replace.match_length(re.compile(b'ab')), None)
+
+class TestTypedArray(unittest.TestCase):
+
+	def test_decode(self):
+		data = b'\x01\x00\x00\x02\xff'
+		self.assertEqual(list(typed_array.decode(data, 'H')), [1, 512])
+		self.assertEqual(list(typed_array.decode(data, 'H', False)),
+		                 [256, 2])
+		self.assertEqual(list(typed_array.decode(data, 'b')),
+		                 [1, 0, 0, 2, -1])
+
+	def test_read_chunks(self):
+		data_buffer = TestBuffer(10000)
+		chunks = list(read_chunks(data_buffer, 5, 9999, chunk_length=1001,
+		                          alignment=4))
+		self.assertEqual([len(chunk) for chunk in chunks],
+		                 [1000] * 9 + [992])
+
+	def test_statistics(self):
+		data_buffer = TestBuffer(10000)
+		data_buffer.buffer[0:8] = b'\xff\xff\x00\x00\x10\x00\x00\x00'
+		data_buffer.buffer[9996:] = b'\x00\x00\x00\x80'
+		count, minimum, maximum, mean = typed_array.statistics(
+			data_buffer, 0, 10000, 'i')
+		self.assertEqual((count, minimum, maximum), (2500, -2**31, 65535))
+		self.assertAlmostEqual(mean, (65535 + 16 - 2**31) / 2500.0)
+		self.assertEqual(typed_array.statistics(data_buffer, 0, 3, 'i'), None)
+
+class TestTemplates(unittest.TestCase):
+
+	def test_parse(self):
+		template = templates.parse_template("""
+			big
+			char[2] magic  # Comment
+			pad[2] reserved
+			uint16 length
+			int8 value
+		""")
+		self.assertEqual(template.names, ['magic', 'length', 'value'])
+		self.assertEqual(template.record_length, 7)
+		record = template.decode(b'MZ\0\0\x01\x02\xff')[0]
+		self.assertEqual([template.format_field(record, i) for i in range(3)],
+		                 ['MZ', '258', '-1'])
+		with self.assertRaises(ValueError):
+			templates.parse_template("uint16 a\nfloat16 b")
+		with self.assertRaises(ValueError):
+			templates.parse_template("uint16[2] a")
+		for text in templates.TEMPLATES.values():
+			templates.parse_template(text)
+
+	def test_records(self):
+		data_buffer = TestBuffer(100000)
+		for i in range(10000):
+			data_buffer.buffer[10 * i + 3:10 * i + 7] = i.to_bytes(4, 'little')
+		template = templates.parse_template("pad[2] a\nuint32 b\nuint32 c")
+		reader = templates.RecordReader(data_buffer, template, start=1)
+		self.assertEqual(reader.count, 9999)
+		self.assertEqual(reader.index_at(0), None)
+		self.assertEqual(reader.index_at(25), 2)
+		for index in [0, 5000, 4095, 9998]:
+			self.assertEqual(reader.record(index)[0], index)
+		self.assertLessEqual(len(reader.batches), templates.MAX_BATCHES)
+
+class TestHashing(unittest.TestCase):
+
+	def setUp(self):
+		self.data_buffer = TestBuffer(10000)
+		self.data_buffer.buffer[:] = bytes(range(250)) * 40
+
+	def test_hash_range(self):
+		data = bytes(self.data_buffer.buffer[100:9000])
+		digests = hashing.hash_range(self.data_buffer, 100, 9000)
+		self.assertEqual(list(digests), list(hashing.ALGORITHMS))
+		self.assertEqual(digests['md5'], hashlib.md5(data).hexdigest())
+		self.assertEqual(digests['sha256'], hashlib.sha256(data).hexdigest())
+		self.assertEqual(digests['crc32'], '%08x' % zlib.crc32(data))
+		self.assertEqual(hashing.hash_range(self.data_buffer, 0, 10,
+		                                    progress=lambda pos: True), None)
+
+	def test_thread(self):
+		results = []
+		thread = hashing.HashThread(self.data_buffer, 0, 10000, ['sha1'],
+		                            lambda *args: None,
+		                            lambda *args: results.append(args[1:]))
+		thread.run()
+		data = bytes(self.data_buffer.buffer)
+		self.assertEqual(results, [({'sha1': hashlib.sha1(data).hexdigest()},
+		                            None)])
+
+class TestExport(unittest.TestCase):
+
+	def setUp(self):
+		self.data_buffer = TestBuffer(10000)
+		self.data_buffer.buffer[:] = bytes(range(250)) * 40
+
+	def test_copy_text(self):
+		self.assertEqual(export.copy_text(self.data_buffer, 10, 13),
+		                 ('0A 0B 0C', True))
+		self.assertEqual(export.copy_text(self.data_buffer, 65, 68, True),
+		                 ('ABC', True))
+		text, complete = export.copy_text(self.data_buffer, 0, 10000,
+		                                  max_length=1000)
+		self.assertFalse(complete)
+		self.assertEqual(len(text), 3 * 1000 - 1)
+
+	def test_export(self):
+		handle, file_name = tempfile.mkstemp()
+		try:
+			with os.fdopen(handle, 'wb') as output:
+				self.assertTrue(export.export_range(self.data_buffer, 100,
+				                                    9000, output))
+			with open(file_name, 'rb') as f:
+				self.assertEqual(f.read(),
+				                 bytes(self.data_buffer.buffer[100:9000]))
+
+			thread = export.ExportThread(self.data_buffer, 0, 3, file_name,
+			                             True, None, lambda *args: None)
+			thread.run()
+			with open(file_name, 'rb') as f:
+				self.assertEqual(f.read(), b'00 01 02')
+		finally:
+			os.unlink(file_name)
+
+class TestBlockIndex(unittest.TestCase):
+
+	def test_changed_blocks(self):
+		data_buffer = TestBuffer(10000)
+		index = block_index.BlockHashIndex(block_length=1000)
+		self.assertEqual(index.build(data_buffer), list(range(10)))
+		data_buffer.buffer[2500] = 1
+		data_buffer.buffer[9999] = 1
+		self.assertEqual(index.build(data_buffer), [2, 9])
+		self.assertEqual(index.changed_ranges([2]), [(2000, 1000)])
+
+	def test_save_and_load(self):
+		index = block_index.BlockHashIndex(block_length=1000)
+		index.build(TestBuffer(5500))
+		index.signature = (5500, 123456789)
+		directory = tempfile.mkdtemp()
+		index_file_name = os.path.join(directory, 'test.hashes')
+		try:
+			index.save(index_file_name)
+			loaded = block_index.load_index(index_file_name)
+			self.assertEqual(loaded.signature, index.signature)
+			self.assertEqual(loaded.hashes, index.hashes)
+		finally:
+			os.unlink(index_file_name)
+			os.rmdir(directory)
+
+	def test_thread(self):
+		directory = tempfile.mkdtemp()
+		old_cache_home = os.environ.get('XDG_CACHE_HOME')
+		os.environ['XDG_CACHE_HOME'] = directory
+		file_name = os.path.join(directory, 'test.bin')
+		with open(file_name, 'wb') as f:
+			f.write(bytes(3 * block_index.DEFAULT_BLOCK_LENGTH))
+		try:
+			results = []
+			def finished(thread, changed_ranges, error):
+				results.append((changed_ranges, error))
+			thread = block_index.IndexThread(FileBuffer(file_name), file_name,
+			                                 None, None, finished)
+			thread.run()
+			# The first index has nothing to compare with.
+			self.assertEqual(results, [([], None)])
+			# The change is beyond the first window that the buffer
+			# reads, and the last block is truncated.
+			block_length = block_index.DEFAULT_BLOCK_LENGTH
+			with open(file_name, 'r+b') as f:
+				f.seek(block_length + block_length - 10)
+				f.write(b'Petter')
+				f.truncate(2 * block_length + block_length // 2)
+			thread = block_index.IndexThread(FileBuffer(file_name), file_name,
+			                                 thread.index, None, finished)
+			thread.run()
+			self.assertEqual(results[1], ([(block_length, block_length),
+			                               (2 * block_length, block_length)],
+			                              None))
+		finally:
+			if old_cache_home is None:
+				del os.environ['XDG_CACHE_HOME']
+			else:
+				os.environ['XDG_CACHE_HOME'] = old_cache_home
+			shutil.rmtree(directory)
+
+class TestEntropy(unittest.TestCase):
+
+	def test_computation_order(self):
+		self.assertEqual(entropy.computation_order(5), [0, 4, 2, 1, 3])
+		self.assertEqual(sorted(entropy.computation_order(1000)),
+		                 list(range(1000)))
+
+	@unittest.skipIf(not entropy.NUMPY_AVAILABLE, "NumPy is not installed.")
+	def test_entropy_map(self):
+		data_buffer = TestBuffer(4 * entropy.MIN_BLOCK_LENGTH)
+		# Second block: every byte value equally often.
+		block = entropy.MIN_BLOCK_LENGTH
+		data_buffer.buffer[block:2 * block] = bytes(range(256)) * (block // 256)
+		# Third block: zeros, then ones at the end.
+		data_buffer.buffer[3 * block - block // 4:3 * block] = \
+			b'\xff' * (block // 4)
+		entropy_map = entropy.EntropyMap(data_buffer.length())
+		self.assertTrue(entropy_map.compute(data_buffer))
+		self.assertEqual(entropy_map.block_range(0, 0), (0.0, 1.0))
+		self.assertAlmostEqual(entropy_map.block_range(block, block)[0], 8.0)
+		entropy_value, zeros = entropy_map.block_range(2 * block, 2 * block)
+		self.assertAlmostEqual(zeros, 0.75)
+		self.assertAlmostEqual(entropy_value, 0.811278, places=5)
+
+	@unittest.skipIf(not entropy.NUMPY_AVAILABLE, "NumPy is not installed.")
+	def test_cancel(self):
+		data_buffer = TestBuffer(4 * entropy.MIN_BLOCK_LENGTH)
+		entropy_map = entropy.EntropyMap(data_buffer.length())
+		progress = []
+		def cancel_after_two_blocks(bytes_done):
+			progress.append(bytes_done)
+			return len(progress) == 2
+		self.assertFalse(entropy_map.compute(data_buffer,
+		                                     cancel_after_two_blocks))
+		self.assertEqual(progress, [entropy.MIN_BLOCK_LENGTH,
+		                            2 * entropy.MIN_BLOCK_LENGTH])
+		# The first block in computation order is done, the second not.
+		self.assertEqual(list(entropy_map.entropy),
+		                 [0.0, entropy.UNKNOWN, entropy.UNKNOWN,
+		                  entropy.UNKNOWN])
+
+class TestCompare(unittest.TestCase):
+
+	def test_find_differences(self):
+		buffer_a = TestBuffer(10000)
+		buffer_b = TestBuffer(10010)
+		buffer_b.buffer[0] = 1
+		buffer_b.buffer[2000:2003] = b'abc'
+		buffer_b.buffer[2011] = 1
+		buffer_b.buffer[9999] = 1
+		# Small blocks so that differences straddle block boundaries.
+		differences = list(compare.find_differences(buffer_a, buffer_b,
+		                                            block_length=1001,
+		                                            merge_gap=8))
+		self.assertEqual(differences, [(0, 1), (2000, 2003), (2011, 2012),
+		                               (9999, 10010)])
+		differences = list(compare.find_differences(buffer_a, buffer_b,
+		                                            merge_gap=16))
+		self.assertEqual(differences, [(0, 1), (2000, 2012), (9999, 10010)])
+
+	def test_navigation(self):
+		index = compare.DiffIndex()
+		index.extend([10, 100, 1000], [20, 200, 2000])
+		self.assertEqual(index.different_bytes(), 1110)
+		self.assertEqual(index.next_difference(10), (100, 200))
+		self.assertEqual(index.next_difference(1000), None)
+		self.assertEqual(index.previous_difference(100), (10, 20))
+		self.assertEqual(index.previous_difference(10), None)
+		self.assertEqual(index.range_at(150), (100, 200))
+		self.assertEqual(index.range_at(200), None)
+
+class TestScrollModel(unittest.TestCase):
+
+	def test_exact(self):
+		model = ScrollModel(1000, 50)
+		self.assertTrue(model.is_exact())
+		self.assertEqual(model.maximum(), 1000)
+		self.assertEqual(model.set_line(123), 123)
+		self.assertEqual(model.set_value(456), 456)
+
+	def test_coarse(self):
+		# The lines of a 16 TB drive.
+		max_line = 2**40
+		model = ScrollModel(max_line, 50)
+		self.assertFalse(model.is_exact())
+		self.assertEqual(model.maximum(), SCROLLBAR_MAXIMUM)
+		self.assertEqual(model.set_value(SCROLLBAR_MAXIMUM), max_line)
+		self.assertEqual(model.set_value(0), 0)
+
+		# Steps are exact although the scroll bar value does not change.
+		value = model.set_line(1000000)
+		self.assertEqual(model.step(1), value)
+		self.assertEqual(model.line, 1000001)
+		self.assertEqual(model.set_value(value), 1000001)
+		model.step(-50)
+		self.assertEqual(model.line, 999951)
+
+class TestCommandLine(unittest.TestCase):
+
+	def setUp(self):
+		handle, self.file_name = tempfile.mkstemp()
+		with os.fdopen(handle, 'wb') as f:
+			f.write(b'\x00' * 100 + b'MZ\x90\x00' + b'\x00' * 100 + b'PK')
+
+	def tearDown(self):
+		os.unlink(self.file_name)
+
+	def run_sexton(self, *args):
+		# Returns the exit status, output and error output. The
+		# subcommands must work without importing PySide, from any
+		# working directory.
+		sexton_file = os.path.abspath(sexton.__file__)
+		code = ("import sys, runpy; sys.argv = {0!r}; "
+		        "sys.path.insert(0, {1!r}); "
+		        "sys.modules['PySide'] = None; "
+		        "runpy.run_path({2!r}, run_name='__main__')")
+		code = code.format(['sexton.py'] + list(args),
+		                   os.path.dirname(sexton_file), sexton_file)
+		process = subprocess.Popen([sys.executable, '-c', code],
+		                           cwd=tempfile.gettempdir(),
+		                           stdout=subprocess.PIPE,
+		                           stderr=subprocess.PIPE)
+		output, error_output = process.communicate()
+		return process.returncode, output, error_output.decode('utf-8')
+
+	def test_find(self):
+		status, output, error_output = self.run_sexton(
+			'find', '--hex', '4D5A', '--string', 'PK', '--jobs', '1',
+			self.file_name)
+		self.assertEqual(status, 0)
+		self.assertEqual(output.decode('utf-8').splitlines(),
+		                 [self.file_name + ':100:4D5A',
+		                  self.file_name + ':204:PK'])
+
+	def test_find_missing_file(self):
+		missing = self.file_name + '.missing'
+		status, output, error_output = self.run_sexton(
+			'find', '--string', 'PK', '--jobs', '2', missing, self.file_name)
+		# The other files are still searched.
+		self.assertEqual(status, 2)
+		self.assertEqual(output.decode('utf-8').splitlines(),
+		                 [self.file_name + ':204'])
+		self.assertIn(missing, error_output)
+
+	def test_find_in_order(self):
+		# The files are searched in parallel, but reported in order.
+		directory = tempfile.mkdtemp()
+		try:
+			file_names = []
+			expected = []
+			for i in range(6):
+				file_name = os.path.join(directory, str(i))
+				with open(file_name, 'wb') as f:
+					f.write(bytes(i) + b'PK' + bytes(1000))
+				file_names.append(file_name)
+				expected.append('{0}:{1}'.format(file_name, i))
+			# A directory can not be searched; the files after it are.
+			file_names.insert(3, directory)
+			status, output, error_output = self.run_sexton(
+				'find', '--string', 'PK', '--jobs', '3', *file_names)
+			self.assertEqual(status, 2)
+			self.assertEqual(output.decode('utf-8').splitlines(), expected)
+			self.assertIn(directory, error_output)
+		finally:
+			shutil.rmtree(directory)
+
+	def test_dump(self):
+		status, output, error_output = self.run_sexton(
+			'dump', '--offset', '0x64', '--length', '4', '--raw',
+			self.file_name)
+		self.assertEqual(output, b'MZ\x90\x00')
+
 if __name__ == '__main__':
 	unittest.main(verbosity=2)